@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from pathlib import Path
+import fnmatch
+import json
+import re
+
+
+FALLBACK_BUCKET = 'Other'
+_BAD_BUCKET_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+class RulesError(ValueError):
+    pass
+
+
+class _Bucket:
+    __slots__ = ('name', 'min_size', 'max_size', 'sniffed', 'pattern', 'separate')
+
+    def __init__(self, name: str, min_size: int | None, max_size: int | None, sniffed: frozenset | None, pattern, separate=()):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sniffed = sniffed
+        self.pattern = pattern
+        self.separate = tuple(separate)
+
+    def named(self, name: str) -> bool:
+        if self.pattern is not None and self.pattern.match(name) is not None:
+            return True
+        return any(regex.search(name) is not None for regex in self.separate)
+
+    def accepts(self, size: int | None, sniff) -> bool:
+        if self.min_size is not None and (size is None or size < self.min_size):
+            return False
+        if self.max_size is not None and (size is None or size > self.max_size):
+            return False
+        if self.sniffed is not None:
+            found = sniff() if callable(sniff) else None
+            if found not in self.sniffed:
+                return False
+        return True
+
+
+def _normalize_ext(ext: str) -> str:
+    ext = str(ext).strip().lower()
+    return ext if ext.startswith('.') else f'.{ext}'
+
+
+_PLAIN_FLAGS = re.compile('').flags
+
+
+def _combinable(compiled) -> bool:
+    # Global inline flags, groups and backreferences (which need groups) all
+    # change meaning or fail once the regex is pasted into a bigger pattern.
+    return compiled.groups == 0 and compiled.flags == _PLAIN_FLAGS
+
+
+def _compile(pattern: str, what: str):
+    try:
+        return re.compile(pattern)
+    except (re.error, OverflowError, RecursionError) as exc:
+        raise RulesError(f'{what}: {exc}') from None
+
+
+def _optional_int(value, field: str, bucket: str) -> int | None:
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RulesError(f'{bucket}: {field} must be a byte count') from None
+
+
+class CategoryRules:
+    # Buckets are tried in order and the first one whose name matchers
+    # (extension, glob or regex; none means any name) and filters (size range,
+    # sniffed type) all hold wins. Compiled into one extension table and one
+    # combined regex, so a file costs a dict lookup and a single match no
+    # matter how many buckets there are. Regexes that cannot be combined keep
+    # their own pattern and are searched one by one.
+    def __init__(self, buckets: list[dict], optional=(), fallback: str = FALLBACK_BUCKET):
+        self.fallback = fallback
+        self.optional = frozenset(optional)
+        self.order: list[str] = []
+        self.uses_sniff = False
+        self._buckets: list[_Bucket] = []
+        self._ext: dict[str, list[int]] = {}
+        self._always: list[int] = []
+        self._group_bucket: dict[str, int] = {}
+        self._separate: list[tuple[int, re.Pattern]] = []
+        alternatives: list[str] = []
+
+        for idx, spec in enumerate(buckets):
+            name = str(spec.get('name', '')).strip()
+            if not name or name in ('.', '..') or _BAD_BUCKET_CHARS.search(name):
+                raise RulesError(f'Invalid bucket name: {name!r}')
+            patterns: list[str] = []
+            separate: list[re.Pattern] = []
+            for glob in spec.get('globs', []) or []:
+                patterns.append(f'(?i:{fnmatch.translate(str(glob))})')
+            for regex in spec.get('regex', []) or []:
+                compiled = _compile(str(regex), f'{name}: bad regex {regex!r}')
+                if _combinable(compiled):
+                    patterns.append(f'(?:.*?(?:{regex}))')
+                else:
+                    separate.append(compiled)
+                    self._separate.append((idx, compiled))
+            exts = [_normalize_ext(ext) for ext in spec.get('extensions', []) or []]
+            for ext in exts:
+                self._ext.setdefault(ext, []).append(idx)
+            for pattern in patterns:
+                group = f'b{idx}_{len(self._group_bucket)}'
+                self._group_bucket[group] = idx
+                alternatives.append(f'(?P<{group}>{pattern})')
+            if not exts and not patterns and not separate:
+                self._always.append(idx)
+
+            sniffed = spec.get('sniffed')
+            self.uses_sniff = self.uses_sniff or bool(sniffed)
+            self._buckets.append(
+                _Bucket(
+                    name=name,
+                    min_size=_optional_int(spec.get('min_size'), 'min_size', name),
+                    max_size=_optional_int(spec.get('max_size'), 'max_size', name),
+                    sniffed=frozenset(sniffed) if sniffed else None,
+                    pattern=_compile('|'.join(patterns), f'{name}: bad pattern') if patterns else None,
+                    separate=separate,
+                )
+            )
+            if name not in self.order:
+                self.order.append(name)
+        if fallback not in self.order:
+            self.order.append(fallback)
+        self._combined = _compile('|'.join(alternatives), 'Rules') if alternatives else None
+
+    def categorize(self, name: str, size: int | None = None, sniff=None) -> str:
+        lowered = name.lower()
+        candidates: list[int] = list(self._always)
+        last = lowered.rfind('.')
+        if last > 0:
+            candidates.extend(self._ext.get(lowered[last:], ()))
+            prev = lowered.rfind('.', 0, last)
+            if prev > 0:
+                candidates.extend(self._ext.get(lowered[prev:], ()))
+        first_pattern = None
+        if self._combined is not None:
+            match = self._combined.match(name)
+            if match is not None:
+                first_pattern = self._group_bucket[match.lastgroup]
+        for idx, regex in self._separate:
+            if first_pattern is not None and idx >= first_pattern:
+                break
+            if regex.search(name) is not None:
+                first_pattern = idx
+                break
+        if first_pattern is not None:
+            candidates.append(first_pattern)
+        pending = set(candidates)
+        for idx in sorted(pending):
+            if self._buckets[idx].accepts(size, sniff):
+                return self._buckets[idx].name
+            if idx == first_pattern:
+                break
+        else:
+            return self.fallback
+        # The name patterns only report the earliest matching bucket. It was
+        # filtered out by size or type, so the rest are checked one by one.
+        for idx in range(first_pattern + 1, len(self._buckets)):
+            bucket = self._buckets[idx]
+            named = idx in pending or bucket.named(name)
+            if named and bucket.accepts(size, sniff):
+                return bucket.name
+        return self.fallback
+
+    def gate(self, category: str, include_optional_categories: bool) -> str:
+        if not include_optional_categories and category in self.optional:
+            return self.fallback
+        return category
+
+
+def rules_from_dict(payload: dict) -> CategoryRules:
+    if not isinstance(payload, dict):
+        raise RulesError('Rules must be a JSON object')
+    buckets = payload.get('buckets')
+    if not isinstance(buckets, list) or not buckets:
+        raise RulesError('Rules need a non-empty "buckets" list')
+    return CategoryRules(
+        buckets,
+        optional=payload.get('optional', []) or [],
+        fallback=str(payload.get('fallback', FALLBACK_BUCKET)),
+    )
+
+
+def load_rules(path: Path) -> CategoryRules:
+    try:
+        payload = json.loads(Path(path).read_text(encoding='utf-8'))
+    except ValueError as exc:
+        raise RulesError(f'{path}: {exc}') from None
+    return rules_from_dict(payload)
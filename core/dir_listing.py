@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from pathlib import Path
+import os
+
+
+class _Dir:
+    __slots__ = ('resolved', 'names', 'folded', 'within')
+
+    def __init__(self, resolved: str, names: set[str], within: bool):
+        self.resolved = resolved
+        self.names = names
+        self.folded: set[str] | None = None
+        self.within = within
+
+
+def is_within(resolved: str, resolved_root: str) -> bool:
+    path = os.path.normcase(resolved)
+    root = os.path.normcase(resolved_root)
+    if path == root:
+        return True
+    return path.startswith(root if root.endswith(os.sep) else root + os.sep)
+
+
+class DirListingCache:
+    # One scandir and one realpath per directory, shared by every path checked
+    # against it. Paths are handled as plain strings so big plans do not pay
+    # for Path objects per lookup. Containment in root is decided once per
+    # parent directory: a name without separators cannot escape its parent.
+    def __init__(self, root: Path | str | None = None):
+        self.root = os.path.realpath(root) if root is not None else None
+        self._dirs: dict[str, _Dir] = {}
+
+    def directory(self, parent: str) -> _Dir:
+        found = self._dirs.get(parent)
+        if found is None:
+            try:
+                with os.scandir(parent or '.') as it:
+                    names = {dirent.name for dirent in it}
+            except OSError:
+                names = set()
+            resolved = os.path.realpath(parent or '.')
+            within = self.root is not None and is_within(resolved, self.root)
+            found = _Dir(resolved, names, within)
+            self._dirs[parent] = found
+        return found
+
+    def lookup(self, path: Path | str) -> tuple[_Dir, str]:
+        text = os.fspath(path)
+        parent, sep, name = text.rpartition(os.sep)
+        if not sep or os.altsep and os.altsep in name:
+            parent, name = os.path.split(text)
+        elif not parent:
+            parent = os.sep
+        return self.directory(parent), name
+
+    def exists(self, path: Path | str) -> bool:
+        entry, name = self.lookup(path)
+        return self.has_name(entry, name, path)
+
+    def has_name(self, entry: _Dir, name: str, path: Path | str) -> bool:
+        if name in entry.names:
+            return True
+        if entry.folded is None:
+            entry.folded = {item.casefold() for item in entry.names}
+        # Only a case-only mismatch needs the filesystem to decide, since the
+        # volume may or may not be case-insensitive.
+        return name.casefold() in entry.folded and os.path.lexists(path)
+
+    def resolve(self, path: Path | str) -> str:
+        # Resolves the parent only, like Path(parent).resolve() / name.
+        entry, name = self.lookup(path)
+        return os.path.join(entry.resolved, name)
+
+    def within_root(self, entry: _Dir, name: str) -> bool:
+        if entry.within and name != '..':
+            return True
+        return self.root is not None and is_within(os.path.join(entry.resolved, name), self.root)
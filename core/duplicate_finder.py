@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import os
+
+from .natural_sort import natural_key
+
+
+EDGE_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+
+
+def _edge_digest(path: Path, size: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        digest.update(fh.read(EDGE_BYTES))
+        if size > EDGE_BYTES:
+            fh.seek(max(EDGE_BYTES, size - EDGE_BYTES))
+            digest.update(fh.read(EDGE_BYTES))
+    return digest.hexdigest()
+
+
+def _full_digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _group(keyed) -> list[tuple[tuple, list[Path]]]:
+    buckets: dict[tuple, list[Path]] = {}
+    for key, path in keyed:
+        buckets.setdefault(key, []).append(path)
+    return [(key, bucket) for key, bucket in buckets.items() if len(bucket) > 1]
+
+
+def _safe(fn):
+    def wrapped(*args):
+        try:
+            return fn(*args)
+        except OSError:
+            return None
+    return wrapped
+
+
+def find_duplicates(paths: list[Path], workers: int = 8) -> dict[Path, Path]:
+    # Returns duplicate -> kept original. Only files that share a size are read,
+    # only the edges of those are hashed first, and only edge collisions get a
+    # full hash. Empty files are never reported.
+    by_size: dict[int, list[Path]] = {}
+    for path in paths:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            continue
+        if size > 0:
+            by_size.setdefault(size, []).append(path)
+
+    # Each stage hashes every candidate across all size buckets in one batch,
+    # so the pool stays busy even when most sizes hold only two files.
+    candidates = [(path, size) for size, same_size in by_size.items() if len(same_size) > 1 for path in same_size]
+    groups: list[list[Path]] = []
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        edges = pool.map(_safe(_edge_digest), [path for path, _size in candidates], [size for _path, size in candidates])
+        edge_groups = _group(((size, edge), path) for (path, size), edge in zip(candidates, edges) if edge is not None)
+        full_pending: list[tuple[Path, int]] = []
+        for (size, _edge), group in edge_groups:
+            if size <= 2 * EDGE_BYTES:
+                groups.append(group)
+            else:
+                full_pending.extend((path, size) for path in group)
+        fulls = pool.map(_safe(_full_digest), [path for path, _size in full_pending])
+        groups.extend(group for _key, group in _group(((size, full), path) for (path, size), full in zip(full_pending, fulls) if full is not None))
+
+    duplicates: dict[Path, Path] = {}
+    for group in groups:
+        group.sort(key=lambda p: natural_key(p.name))
+        keeper = group[0]
+        for path in group[1:]:
+            duplicates[path] = keeper
+    return duplicates
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import threading
+
+
+SNIFF_BYTES = 262
+CACHE_LIMIT = 200_000
+
+# (offset, magic, category, strong). Weak matches are container or script
+# formats that many typed extensions share (docx is a zip, .py may have a
+# shebang), so they only fill in for files the extension could not place.
+SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'Images', True),
+    (0, b'\xff\xd8\xff', 'Images', True),
+    (0, b'GIF87a', 'Images', True),
+    (0, b'GIF89a', 'Images', True),
+    (0, b'II*\x00', 'Images', True),
+    (0, b'MM\x00*', 'Images', True),
+    (0, b'8BPS', 'Images', True),
+    (0, b'DDS ', 'Images', True),
+    (0, b'\x1aE\xdf\xa3', 'Videos', True),
+    (0, b'ID3', 'Audio', True),
+    (0, b'\xff\xfb', 'Audio', True),
+    (0, b'OggS', 'Audio', True),
+    (0, b'fLaC', 'Audio', True),
+    (0, b'%PDF-', 'Documents', True),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'Documents', False),
+    (0, b'PK\x03\x04', 'Archives', False),
+    (0, b'7z\xbc\xaf\x27\x1c', 'Archives', True),
+    (0, b'Rar!\x1a\x07', 'Archives', True),
+    (0, b'\x1f\x8b', 'Archives', False),
+    (0, b'BZh', 'Archives', False),
+    (0, b'\xfd7zXZ\x00', 'Archives', True),
+    (257, b'ustar', 'Archives', True),
+    (0, b'#!', 'Code', False),
+]
+
+_RIFF_FORMS = {b'WEBP': 'Images', b'WAVE': 'Audio', b'AVI ': 'Videos'}
+# ISO base media (ftyp) brands. HEIF/AVIF stills share the container with
+# MP4, so the brand decides; unknown brands stay weak guesses.
+_FTYP_BRANDS = {
+    **dict.fromkeys((b'M4A ', b'M4B ', b'M4P '), 'Audio'),
+    **dict.fromkeys((b'heic', b'heix', b'mif1', b'msf1', b'avif', b'avis'), 'Images'),
+    **dict.fromkeys(
+        (b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1', b'qt  ', b'M4V ', b'M4VH', b'3gp4', b'3gp5', b'3gp6', b'3g2a', b'dash', b'f4v '),
+        'Videos',
+    ),
+}
+
+_LEADING: dict[bytes, list[tuple[int, bytes, str, bool]]] = {}
+for _signature in SIGNATURES:
+    _LEADING.setdefault(_signature[1][:1] if _signature[0] == 0 else b'', []).append(_signature)
+
+_cache: dict[tuple, tuple[str, bool] | None] = {}
+_cache_lock = threading.Lock()
+
+
+def _match_ftyp(head: bytes) -> tuple[str, bool]:
+    category = _FTYP_BRANDS.get(head[8:12])
+    if category:
+        return category, True
+    # Unknown major brand: fall back to the compatible brands listed after it.
+    end = min(len(head), int.from_bytes(head[:4], 'big'))
+    for offset in range(16, end - 3, 4):
+        category = _FTYP_BRANDS.get(head[offset:offset + 4])
+        if category:
+            return category, False
+    return 'Videos', False
+
+
+def match_signature(head: bytes) -> tuple[str, bool] | None:
+    if head[:4] == b'RIFF':
+        category = _RIFF_FORMS.get(head[8:12])
+        return (category, True) if category else None
+    if head[4:8] == b'ftyp':
+        return _match_ftyp(head)
+    for offset, magic, category, strong in _LEADING.get(head[:1], []) + _LEADING.get(b'', []):
+        if head[offset:offset + len(magic)] == magic:
+            return category, strong
+    return None
+
+
+def _cache_key(path: Path, st: os.stat_result) -> tuple:
+    identity = st.st_ino if st.st_ino else str(path)
+    return (st.st_dev, identity, st.st_size, st.st_mtime_ns)
+
+
+def sniff_category(path: Path) -> tuple[str, bool] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = _cache_key(path, st)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    try:
+        with open(path, 'rb') as fh:
+            head = fh.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    result = match_signature(head)
+    with _cache_lock:
+        if len(_cache) >= CACHE_LIMIT:
+            _cache.clear()
+        _cache[key] = result
+    return result
+
+
+def sniff_categories(paths: list[Path], workers: int = 8) -> list[tuple[str, bool] | None]:
+    if not paths:
+        return []
+    if workers <= 1 or len(paths) == 1:
+        return [sniff_category(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(sniff_category, paths))
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import os
+import struct
+import threading
+import wave
+
+
+CACHE_PATH = Path.home() / '.goblintools_metadata.json'
+CACHE_LIMIT = 500_000
+# Bumped when read_metadata gains fields, so older cache entries are re-read once.
+CACHE_VERSION = 2
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.bmp', '.gif', '.heic'}
+AUDIO_EXTS = {'.wav', '.flac'}
+
+
+def _exif_datetime(img) -> str | None:
+    try:
+        exif = img.getexif()
+    except Exception:
+        return None
+    value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if not isinstance(value, str) or len(value) < 7:
+        return None
+    return value.strip('\x00 ')
+
+
+def _image_metadata(path: Path, frames: bool = False) -> dict:
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+    # Image.open only parses the header; nothing here touches pixel data.
+    # n_frames is only read when asked for: GIF and APNG have to skip
+    # through every frame block to count them.
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            out = {'width': int(width), 'height': int(height), 'mode': str(img.mode)}
+            if frames:
+                out['frames'] = int(getattr(img, 'n_frames', 1) or 1)
+            taken = _exif_datetime(img)
+    except Exception:
+        return {}
+    if taken:
+        out['taken'] = taken
+    return out
+
+
+def _flac_duration(path: Path) -> float | None:
+    with open(path, 'rb') as fh:
+        if fh.read(4) != b'fLaC':
+            return None
+        header = fh.read(4)
+        if len(header) < 4 or header[0] & 0x7F != 0:
+            return None
+        info = fh.read(34)
+    if len(info) < 18:
+        return None
+    packed = struct.unpack('>Q', info[10:18])[0]
+    sample_rate = packed >> 44
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+
+def _audio_metadata(path: Path) -> dict:
+    try:
+        if path.suffix.lower() == '.wav':
+            with wave.open(str(path), 'rb') as wav:
+                rate = wav.getframerate()
+                duration = wav.getnframes() / rate if rate else None
+        else:
+            duration = _flac_duration(path)
+    except (OSError, EOFError, wave.Error, struct.error):
+        return {}
+    return {'duration': round(duration, 3)} if duration is not None else {}
+
+
+def read_metadata(path: Path, frames: bool = False) -> dict:
+    ext = Path(path).suffix.lower()
+    if ext in IMAGE_EXTS:
+        return _image_metadata(Path(path), frames)
+    if ext in AUDIO_EXTS:
+        return _audio_metadata(Path(path))
+    return {}
+
+
+class MetadataCache:
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path is not None else CACHE_PATH
+        self._entries: dict[str, list] | None = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, list]:
+        if self._entries is None:
+            try:
+                payload = json.loads(self.path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                payload = {}
+            self._entries = payload if isinstance(payload, dict) else {}
+        return self._entries
+
+    def get(self, path: Path, st: os.stat_result) -> dict | None:
+        with self._lock:
+            entry = self._load().get(str(path))
+        if entry and len(entry) > 3 and entry[0] == st.st_size and entry[1] == st.st_mtime_ns and entry[3] == CACHE_VERSION:
+            return entry[2]
+        return None
+
+    def put(self, path: Path, st: os.stat_result, metadata: dict) -> None:
+        with self._lock:
+            entries = self._load()
+            if len(entries) >= CACHE_LIMIT:
+                entries.clear()
+            entries[str(path)] = [st.st_size, st.st_mtime_ns, metadata, CACHE_VERSION]
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty or self._entries is None:
+                return
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            try:
+                tmp.write_text(json.dumps(self._entries, separators=(',', ':')), encoding='utf-8')
+                os.replace(tmp, self.path)
+            except OSError:
+                return
+            self._dirty = False
+
+
+_default_cache: MetadataCache | None = None
+
+
+def default_cache() -> MetadataCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MetadataCache()
+    return _default_cache
+
+
+def read_metadata_many(paths: list[Path], workers: int = 8, cache: MetadataCache | None = None, frames: bool = False) -> list[dict]:
+    cache = cache if cache is not None else default_cache()
+
+    def lookup(path: Path) -> dict:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return {}
+        cached = cache.get(path, st)
+        # Entries cached without a frame count are re-read once when one is
+        # wanted; the fuller entry then serves both kinds of caller.
+        if cached is not None and not (frames and cached and 'frames' not in cached):
+            return cached
+        metadata = read_metadata(path, frames)
+        cache.put(path, st, metadata)
+        return metadata
+
+    if not paths:
+        return []
+    if workers <= 1 or len(paths) == 1:
+        results = [lookup(path) for path in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lookup, paths))
+    cache.save()
+    return results
@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import ctypes
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+
+DEFAULT_TEMP_PREFIX = '.__goblintmp__'
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+COPY_SLOTS = 4
+_copy_slots = threading.BoundedSemaphore(COPY_SLOTS)
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+_UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+_NO_LINK_ERRNOS = _UNSUPPORTED_ERRNOS | {errno.EPERM, errno.EMLINK}
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+
+def _load_renameat2():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fn = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_renameat2 = _load_renameat2()
+
+
+def _move_key(path: Path) -> str:
+    return str(path).casefold()
+
+
+def temp_path_for(src: Path, temp_prefix: str = DEFAULT_TEMP_PREFIX) -> Path:
+    while True:
+        candidate = src.with_name(f'{temp_prefix}{uuid.uuid4().hex}__{src.name}')
+        if not candidate.exists():
+            return candidate
+
+
+def schedule_components(
+    moves: list[tuple[Path, Path]],
+    temp_prefix: str = DEFAULT_TEMP_PREFIX,
+) -> list[list[tuple[Path, Path, int | None]]]:
+    # Each step is (from, to, move index); parking steps into a temp name carry None.
+    # Destinations are unique, so every move frees at most one waiter and the
+    # dependency graph is a set of chains and simple cycles. Each chain or cycle
+    # comes back as one component whose steps must run in order; components are
+    # independent of each other.
+    src_index: dict[str, int] = {}
+    for idx, (src, _dst) in enumerate(moves):
+        src_index[_move_key(src)] = idx
+
+    waits_on: list[int | None] = [None] * len(moves)
+    freed_by: dict[int, int] = {}
+    seen_dst: set[str] = set()
+    for idx, (_src, dst) in enumerate(moves):
+        dst_key = _move_key(dst)
+        if dst_key in seen_dst:
+            raise ValueError(f'Duplicate destination: {dst}')
+        seen_dst.add(dst_key)
+        blocker = src_index.get(dst_key)
+        if blocker is not None and blocker != idx:
+            waits_on[idx] = blocker
+            freed_by[blocker] = idx
+
+    components: list[list[tuple[Path, Path, int | None]]] = []
+    scheduled = [False] * len(moves)
+    parked: dict[int, Path] = {}
+
+    def run_chain(idx: int | None, steps: list):
+        while idx is not None and not scheduled[idx]:
+            src, dst = moves[idx]
+            steps.append((parked.pop(idx, src), dst, idx))
+            scheduled[idx] = True
+            idx = freed_by.get(idx)
+
+    for idx in range(len(moves)):
+        if waits_on[idx] is None:
+            steps: list[tuple[Path, Path, int | None]] = []
+            run_chain(idx, steps)
+            components.append(steps)
+
+    for idx in range(len(moves)):
+        if scheduled[idx]:
+            continue
+        src = moves[idx][0]
+        temp = temp_path_for(src, temp_prefix)
+        steps = [(src, temp, None)]
+        parked[idx] = temp
+        run_chain(freed_by.get(idx), steps)
+        run_chain(idx, steps)
+        components.append(steps)
+    return components
+
+
+def schedule_moves(
+    moves: list[tuple[Path, Path]],
+    temp_prefix: str = DEFAULT_TEMP_PREFIX,
+) -> list[tuple[Path, Path, int | None]]:
+    return [step for component in schedule_components(moves, temp_prefix) for step in component]
+
+
+def partition_components(
+    components: list[list[tuple[Path, Path, int | None]]],
+    workers: int = 1,
+) -> list[tuple[str, list[tuple[Path, Path, int | None]]]]:
+    # Group by destination directory, then slice big directories so one hot
+    # folder can still use the whole pool.
+    by_dir: dict[str, list[list[tuple[Path, Path, int | None]]]] = {}
+    for component in components:
+        label = str(component[-1][1].parent)
+        by_dir.setdefault(label, []).append(component)
+
+    workers = max(1, int(workers))
+    slice_size = max(1, -(-len(components) // workers))
+    groups: list[tuple[str, list[tuple[Path, Path, int | None]]]] = []
+    for label, dir_components in by_dir.items():
+        for start in range(0, len(dir_components), slice_size):
+            steps = [step for component in dir_components[start:start + slice_size] for step in component]
+            groups.append((label, steps))
+    return groups
+
+
+def same_entry(src: Path, dst: Path) -> bool:
+    try:
+        return _move_key(src) == _move_key(dst) and os.path.samefile(src, dst)
+    except OSError:
+        return False
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> None:
+    # Kernel-side copies first (reflink/server-side where the filesystem can),
+    # then sendfile, then a plain read/write loop.
+    offset = 0
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        try:
+            while offset < size:
+                sent = copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_BYTES, size - offset))
+                if sent == 0:
+                    break
+                offset += sent
+            return
+        except OSError as exc:
+            if offset or exc.errno not in _FALLBACK_ERRNOS:
+                raise
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None:
+        try:
+            while offset < size:
+                sent = sendfile(dst_fd, src_fd, offset, min(COPY_CHUNK_BYTES, size - offset))
+                if sent == 0:
+                    break
+                offset += sent
+            return
+        except OSError as exc:
+            if offset or exc.errno not in _FALLBACK_ERRNOS:
+                raise
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    while True:
+        chunk = os.read(src_fd, COPY_CHUNK_BYTES)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_move(src: Path, dst: Path, verify_hash: bool = False, temp_prefix: str = DEFAULT_TEMP_PREFIX) -> None:
+    # Copy into a temp name next to dst and rename it in, so an interrupted
+    # copy never looks like a finished move. The source is only unlinked
+    # after the copy is on disk and verified.
+    temp = temp_path_for(dst, temp_prefix)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    with _copy_slots:
+        try:
+            src_fd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                size = os.fstat(src_fd).st_size
+                dst_fd = os.open(temp, flags, 0o600)
+                try:
+                    _copy_fd(src_fd, dst_fd, size)
+                    os.fsync(dst_fd)
+                    copied = os.fstat(dst_fd).st_size
+                finally:
+                    os.close(dst_fd)
+            finally:
+                os.close(src_fd)
+            if copied != size:
+                raise OSError(errno.EIO, f'Copy size mismatch ({copied} != {size} bytes)', str(dst))
+            if verify_hash and _file_digest(src) != _file_digest(temp):
+                raise OSError(errno.EIO, 'Copy hash mismatch', str(dst))
+            shutil.copystat(src, temp)
+            rename_noreplace(temp, dst)
+        except BaseException:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+    try:
+        os.unlink(src)
+    except BaseException:
+        os.unlink(dst)
+        raise
+
+
+def rename_noreplace(src: Path, dst: Path) -> None:
+    # os.rename silently replaces an existing dst on POSIX; this raises
+    # FileExistsError instead, even if dst appears after any earlier check.
+    # Windows' rename already refuses. On Linux renameat2(RENAME_NOREPLACE) is
+    # atomic; filesystems without it (NFS, SMB) fall back to link + unlink,
+    # and those without hard links to a last check right before the rename.
+    if os.name == 'nt' or same_entry(src, dst):
+        os.rename(src, dst)
+        return
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in _UNSUPPORTED_ERRNOS:
+            raise OSError(err, os.strerror(err), str(src), None, str(dst))
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except OSError as exc:
+        if exc.errno not in _NO_LINK_ERRNOS:
+            raise
+    else:
+        # A crash here leaves both names on one file; journal recovery
+        # finishes or reverses that (see move_journal).
+        try:
+            os.unlink(src)
+        except BaseException:
+            os.unlink(dst)
+            raise
+        return
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, 'Target already exists', str(dst))
+    os.rename(src, dst)
+
+
+def move_entry(src: Path, dst: Path, verify_hash: bool = False) -> None:
+    try:
+        rename_noreplace(src, dst)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        copy_move(src, dst, verify_hash=verify_hash)
+
+
+def step_identities(moves: list[tuple[Path, Path]], steps: list[tuple[Path, Path, int | None]]) -> list[tuple[int, int] | None]:
+    # (st_dev, st_ino) of the entry each step carries, so recovery can find a
+    # moved file even after a chain has put another file at its old name.
+    by_src: dict[str, tuple[int, int] | None] = {}
+    for src, _dst in moves:
+        try:
+            st = os.lstat(src)
+            by_src[_move_key(src)] = (st.st_dev, st.st_ino)
+        except OSError:
+            by_src[_move_key(src)] = None
+    # Parking steps start from the move's own source.
+    return [by_src.get(_move_key(moves[idx][0] if idx is not None else src)) for src, _dst, idx in steps]
+
+
+def rollback_steps(done: list[tuple[Path, Path]]) -> None:
+    for src, dst in reversed(done):
+        if dst.exists():
+            move_entry(dst, src)
+
+
+def execute_moves(
+    moves: list[tuple[Path, Path]],
+    temp_prefix: str = DEFAULT_TEMP_PREFIX,
+    on_conflict=None,
+    make_parents: bool = False,
+    journal=None,
+    workers: int = 1,
+    progress=None,
+    verify_copies: bool = False,
+) -> list[tuple[Path, Path]]:
+    groups = partition_components(schedule_components(moves, temp_prefix), workers)
+    steps: list[tuple[Path, Path, int | None]] = []
+    ranges: list[tuple[int, int]] = []
+    for _label, group_steps in groups:
+        ranges.append((len(steps), len(steps) + len(group_steps)))
+        steps.extend(group_steps)
+
+    final_dst: list[Path | None] = [None] * len(moves)
+    made_dirs: set[Path] = set()
+    done: list[tuple[Path, Path]] = []
+    errors: list[BaseException] = []
+    lock = threading.Lock()
+    failed = threading.Event()
+    if journal is not None:
+        journal.start(moves, steps, ranges, step_identities(moves, steps))
+
+    def run_group(label: str, offset: int, group_steps: list[tuple[Path, Path, int | None]]):
+        started = time.perf_counter()
+        count = 0
+        try:
+            for pos, (src, dst, move_idx) in enumerate(group_steps):
+                if failed.is_set():
+                    return
+                if move_idx is not None:
+                    if make_parents and dst.parent not in made_dirs:
+                        dst.parent.mkdir(parents=True, exist_ok=True)
+                        with lock:
+                            made_dirs.add(dst.parent)
+                    if dst.exists() and not same_entry(src, dst):
+                        if on_conflict is None:
+                            raise FileExistsError(f'Target already exists: {dst}')
+                        with lock:
+                            dst = on_conflict(dst)
+                            if journal is not None:
+                                journal.redirect(move_idx, dst)
+                    final_dst[move_idx] = dst
+                move_entry(src, dst, verify_hash=verify_copies)
+                with lock:
+                    done.append((src, dst))
+                    if journal is not None:
+                        journal.step_done(offset + pos)
+                count += 1
+        except BaseException as exc:
+            with lock:
+                errors.append(exc)
+            failed.set()
+            return
+        if callable(progress):
+            elapsed = time.perf_counter() - started
+            progress({'group': label, 'moves': count, 'seconds': elapsed, 'rate': count / elapsed if elapsed > 0 else 0.0})
+
+    jobs = [(label, start, group_steps) for (label, group_steps), (start, _end) in zip(groups, ranges)]
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            run_group(*job)
+            if failed.is_set():
+                break
+    else:
+        with ThreadPoolExecutor(max_workers=min(int(workers), len(jobs))) as pool:
+            for job in jobs:
+                pool.submit(run_group, *job)
+
+    if errors:
+        # done is in completion order; groups never share paths, so reversing it
+        # also reverses every group's own order.
+        rollback_steps(done)
+        if journal is not None:
+            journal.finish('rolled_back')
+        raise errors[0]
+
+    if journal is not None:
+        journal.finish('committed')
+
+    return [(src, dst) for (src, _planned), dst in zip(moves, final_dst)]
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+import bisect
+import json
+import os
+import time
+import uuid
+
+from .move_engine import move_entry, same_entry
+
+
+JOURNAL_DIR = Path.home() / '.goblintools_journal'
+SYNC_EVERY = 256
+KEEP_FINISHED = 20
+FINISHED_STATES = {'committed', 'rolled_back', 'undone'}
+
+
+@dataclass
+class JournalState:
+    path: Path
+    tool: str
+    root: str
+    created: float
+    moves: list[tuple[Path, Path]]
+    steps: list[tuple[Path, Path, int | None]]
+    groups: list[tuple[int, int]] = field(default_factory=list)
+    idents: list[tuple[int, int] | None] = field(default_factory=list)
+    done: set[int] = field(default_factory=set)
+    redirects: dict[int, Path] = field(default_factory=dict)
+    status: str = 'running'
+
+    def undo_mapping(self) -> list[tuple[Path, Path]]:
+        return [(src, self.redirects.get(idx, dst)) for idx, (src, dst) in enumerate(self.moves)]
+
+
+class MoveJournal:
+    def __init__(
+        self,
+        tool: str,
+        root: Path | str | None = None,
+        journal_dir: Path | None = None,
+        sync_every: int = SYNC_EVERY,
+        history=None,
+    ):
+        # history: an UndoHistory that gets the final moves once the run commits.
+        self.tool = tool
+        self.root = str(root or '')
+        self.journal_dir = Path(journal_dir) if journal_dir is not None else JOURNAL_DIR
+        self.sync_every = max(1, int(sync_every))
+        self.history = history
+        self.path: Path | None = None
+        self._fh = None
+        self._pending = 0
+        self._moves: list[tuple[Path, Path]] = []
+        self._redirects: dict[int, Path] = {}
+
+    def start(
+        self,
+        moves: list[tuple[Path, Path]],
+        steps: list[tuple[Path, Path, int | None]],
+        groups: list[tuple[int, int]] | None = None,
+        idents: list[tuple[int, int] | None] | None = None,
+    ) -> None:
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self._moves = list(moves)
+        self._redirects = {}
+        self.path = self.journal_dir / f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.jsonl'
+        self._fh = open(self.path, 'a', encoding='utf-8')
+        self._write(
+            {
+                'kind': 'begin',
+                'tool': self.tool,
+                'root': self.root,
+                'created': time.time(),
+                'moves': [[str(src), str(dst)] for src, dst in moves],
+                'steps': [[str(src), str(dst), idx] for src, dst, idx in steps],
+                'groups': [list(group) for group in (groups or [(0, len(steps))])],
+                'ids': [list(ident) if ident is not None else None for ident in (idents or [])],
+            }
+        )
+        self._sync()
+
+    def redirect(self, move_idx: int, dst: Path) -> None:
+        # Written ahead of the rename: recovery cannot guess a collision-suffixed name.
+        self._write({'kind': 'redirect', 'i': move_idx, 'dst': str(dst)})
+        self._sync()
+        self._redirects[move_idx] = Path(dst)
+
+    def step_done(self, step_no: int) -> None:
+        self._write({'kind': 'done', 'n': step_no})
+        self._pending += 1
+        if self._pending >= self.sync_every:
+            self._sync()
+
+    def finish(self, status: str) -> None:
+        if self._fh is None:
+            return
+        self._write({'kind': status})
+        self._sync()
+        self._fh.close()
+        self._fh = None
+        if status == 'committed' and self.history is not None:
+            self.history.record(self.tool, self.root, [(src, self._redirects.get(idx, dst)) for idx, (src, dst) in enumerate(self._moves)])
+        prune_journals(self.journal_dir)
+
+    def close(self) -> None:
+        # Stops writing without a terminal record: the run stays interrupted
+        # and shows up for recovery, as if the process had died here.
+        if self._fh is None:
+            return
+        self._sync()
+        self._fh.close()
+        self._fh = None
+
+    def _write(self, record: dict) -> None:
+        self._fh.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _sync(self) -> None:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._pending = 0
+
+
+def load_journal(path: Path) -> JournalState | None:
+    state = None
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn tail from a crash mid-write; everything before it is intact.
+                    break
+                kind = record.get('kind')
+                if kind == 'begin':
+                    state = JournalState(
+                        path=Path(path),
+                        tool=str(record.get('tool', '')),
+                        root=str(record.get('root', '')),
+                        created=float(record.get('created', 0.0)),
+                        moves=[(Path(src), Path(dst)) for src, dst in record.get('moves', [])],
+                        steps=[(Path(src), Path(dst), idx) for src, dst, idx in record.get('steps', [])],
+                    )
+                    state.groups = [(int(start), int(end)) for start, end in record.get('groups', [])]
+                    if not state.groups:
+                        state.groups = [(0, len(state.steps))]
+                    state.idents = [tuple(ident) if ident else None for ident in record.get('ids', [])]
+                elif state is None:
+                    break
+                elif kind == 'done':
+                    state.done.add(int(record['n']))
+                elif kind == 'redirect':
+                    state.redirects[int(record['i'])] = Path(record['dst'])
+                elif kind in FINISHED_STATES:
+                    state.status = kind
+    except OSError:
+        return None
+    return state
+
+
+def _iter_journals(journal_dir: Path | None):
+    root = Path(journal_dir) if journal_dir is not None else JOURNAL_DIR
+    if not root.is_dir():
+        return []
+    return sorted(root.glob('*.jsonl'), key=lambda p: p.name)
+
+
+def _tail_status(path: Path) -> str:
+    # Terminal records are always the last line, so skip parsing the whole move list.
+    try:
+        with open(path, 'rb') as fh:
+            fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, fh.tell() - 256))
+            tail = fh.read().decode('utf-8', errors='replace')
+    except OSError:
+        return 'missing'
+    lines = [line for line in tail.splitlines() if line.strip()]
+    try:
+        kind = json.loads(lines[-1]).get('kind') if lines else None
+    except ValueError:
+        kind = None
+    return kind if kind in FINISHED_STATES else 'running'
+
+
+def find_interrupted(tool: str | None = None, journal_dir: Path | None = None) -> list[JournalState]:
+    out = []
+    for path in _iter_journals(journal_dir):
+        if _tail_status(path) != 'running':
+            continue
+        state = load_journal(path)
+        if state is None or state.status != 'running':
+            continue
+        if tool is not None and state.tool != tool:
+            continue
+        out.append(state)
+    return out
+
+
+def prune_journals(journal_dir: Path | None = None, keep: int = KEEP_FINISHED) -> None:
+    finished = [path for path in _iter_journals(journal_dir) if _tail_status(path) in FINISHED_STATES]
+    for path in finished[:-keep] if keep > 0 else finished:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _step_target(state: JournalState, step: tuple[Path, Path, int | None]) -> Path:
+    _src, dst, idx = step
+    if idx is None:
+        return dst
+    return state.redirects.get(idx, dst)
+
+
+def _identity(path: Path) -> tuple[int, int] | None:
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _step_done(state: JournalState, n: int, later: dict[tuple[int, int], list[int]]) -> bool:
+    if not os.path.lexists(state.steps[n][0]) and os.path.lexists(_step_target(state, state.steps[n])):
+        return True
+    # In a chain (a->x, b->a) the source is refilled by the next step, and a
+    # parked cycle entry moves on from its temp name; both show up as the
+    # step's entry sitting at its own or a later target.
+    ident = state.idents[n] if n < len(state.idents) else None
+    if ident is None:
+        return False
+    return any(m >= n and _identity(_step_target(state, state.steps[m])) == ident for m in later.get(ident, ()))
+
+
+def _completed_steps(state: JournalState) -> list[int]:
+    # Each group runs its steps in order, so only the unsynced tail after each
+    # group's checkpoint needs probing.
+    done = set(state.done)
+    synced = sorted(done)
+    for start, end in state.groups:
+        pos = bisect.bisect_left(synced, end)
+        n = synced[pos - 1] + 1 if pos > 0 and synced[pos - 1] >= start else start
+        later: dict[tuple[int, int], list[int]] = {}
+        for m in range(n, min(end, len(state.idents))):
+            if state.idents[m] is not None:
+                later.setdefault(state.idents[m], []).append(m)
+        while n < end:
+            if not _step_done(state, n, later):
+                break
+            done.add(n)
+            n += 1
+    return sorted(done)
+
+
+def _append_status(state: JournalState, status: str) -> None:
+    with open(state.path, 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps({'kind': status}) + '\n')
+        fh.flush()
+        os.fsync(fh.fileno())
+    state.status = status
+
+
+def _half_linked(src: Path, dst: Path) -> bool:
+    # move_entry's link + unlink fallback stopped between the two calls.
+    try:
+        return os.path.samefile(src, dst) and not same_entry(src, dst)
+    except OSError:
+        return False
+
+
+def rollback_journal(state: JournalState) -> None:
+    for n in reversed(_completed_steps(state)):
+        src = state.steps[n][0]
+        dst = _step_target(state, state.steps[n])
+        if _half_linked(src, dst):
+            os.unlink(dst)
+        elif dst.exists():
+            move_entry(dst, src)
+    _append_status(state, 'rolled_back')
+
+
+def resume_journal(state: JournalState) -> list[tuple[Path, Path]]:
+    completed = set(_completed_steps(state))
+    # Only steps found by probing can have been cut off mid-move.
+    for n in completed.difference(state.done):
+        src = state.steps[n][0]
+        if _half_linked(src, _step_target(state, state.steps[n])):
+            os.unlink(src)
+    with open(state.path, 'a', encoding='utf-8') as fh:
+        for n, step in enumerate(state.steps):
+            if n in completed:
+                continue
+            src = step[0]
+            dst = _step_target(state, step)
+            if dst.exists() and not same_entry(src, dst):
+                raise FileExistsError(f'Target already exists: {dst}')
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            move_entry(src, dst)
+            fh.write(json.dumps({'kind': 'done', 'n': n}) + '\n')
+        fh.flush()
+        os.fsync(fh.fileno())
+    _append_status(state, 'committed')
+    return state.undo_mapping()
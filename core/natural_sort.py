@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from pathlib import Path
+import os
+import re
+
+from .media_metadata import read_metadata_many
+
+
+SORT_ORDERS = ('name', 'mtime', 'size', 'dimensions')
+_DIGIT_RUNS = re.compile(r'(\d+)')
+
+
+def natural_key(name: str) -> tuple:
+    # 'frame2' < 'frame10': digit runs compare as integers. Split parts
+    # alternate text/number, so tuples always compare like with like; the
+    # folded name breaks ties such as 'a01' vs 'a1'. Not cached globally:
+    # sorts compute each key once, and re-sorts of a listing reuse the keys
+    # held by its SortKeyCache.
+    folded = name.casefold()
+    parts = _DIGIT_RUNS.split(folded)
+    for idx in range(1, len(parts), 2):
+        parts[idx] = int(parts[idx])
+    return (tuple(parts), folded)
+
+
+class SortKeyCache:
+    # Keys per (order, path), computed on first use and kept for later
+    # re-sorts. Stat and image reads only happen for the order asked for.
+    def __init__(self):
+        self._keys: dict[str, dict[str, tuple]] = {order: {} for order in SORT_ORDERS}
+
+    def clear(self) -> None:
+        for keys in self._keys.values():
+            keys.clear()
+
+    def keys_for(self, paths: list[Path], order: str = 'name', workers: int = 8) -> list[tuple]:
+        if order not in self._keys:
+            raise ValueError(f'Unknown sort order: {order}')
+        texts = [os.fspath(path) for path in paths]
+        keys = self._keys[order]
+        missing = [idx for idx, text in enumerate(texts) if text not in keys]
+        if order == 'dimensions' and missing:
+            found = read_metadata_many([Path(texts[idx]) for idx in missing], workers=workers)
+            for idx, metadata in zip(missing, found):
+                width = int(metadata.get('width', 0))
+                height = int(metadata.get('height', 0))
+                # Files without a readable size go last.
+                keys[texts[idx]] = (0 if width else 1, width * height, width, height, natural_key(os.path.basename(texts[idx])))
+        for idx in missing:
+            text = texts[idx]
+            if text in keys:
+                continue
+            name = natural_key(os.path.basename(text))
+            if order == 'name':
+                keys[text] = name
+                continue
+            try:
+                st = os.stat(text)
+            except OSError:
+                keys[text] = (1, 0, name)
+                continue
+            keys[text] = (0, st.st_mtime_ns if order == 'mtime' else st.st_size, name)
+        return [keys[text] for text in texts]
+
+
+def sort_paths(
+    paths: list[Path],
+    order: str = 'name',
+    reverse: bool = False,
+    cache: SortKeyCache | None = None,
+    group_by_dir: bool = False,
+) -> list[Path]:
+    cache = cache if cache is not None else SortKeyCache()
+    keys = cache.keys_for(paths, order)
+    if group_by_dir:
+        # Folders stay contiguous (in natural order); the order applies inside each.
+        # Many paths share a folder, so its key is computed once per call.
+        folders: dict[str, tuple] = {}
+        for idx, path in enumerate(paths):
+            folder = os.path.dirname(os.fspath(path))
+            if folder not in folders:
+                folders[folder] = natural_key(folder)
+            keys[idx] = (folders[folder], keys[idx])
+    ranked = sorted(range(len(paths)), key=keys.__getitem__, reverse=reverse)
+    return [paths[idx] for idx in ranked]
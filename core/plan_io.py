@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from pathlib import Path
+import json
+import os
+
+from .move_engine import schedule_components
+from .sort_goblin import FileEntry, OperationPlan, apply_plan
+
+
+PLAN_FORMAT_VERSION = 1
+CHUNK_MOVES = 50_000
+
+
+def _entry_record(entry: FileEntry, component: int | None) -> dict:
+    return {
+        'kind': 'entry',
+        'src': str(entry.path),
+        'dst': str(entry.proposed_path),
+        'name': entry.name,
+        'ext': entry.ext,
+        'category': entry.category,
+        'action': entry.action,
+        'status': entry.status,
+        'c': component,
+    }
+
+
+def export_plan(plan: OperationPlan, path: Path) -> int:
+    # One JSON object per line: a header, then every entry. Moving entries
+    # are written grouped by dependency component (a rename chain or cycle)
+    # and tagged with its id, so a reader can cut the file into chunks that
+    # never split a chain.
+    component_of: dict[str, int] = {}
+    for component_id, steps in enumerate(schedule_components(plan.moves)):
+        for _src, dst, move_idx in steps:
+            if move_idx is not None:
+                component_of[str(plan.moves[move_idx][0])] = component_id
+
+    moving: list[tuple[int, FileEntry]] = []
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        header = {
+            'kind': 'plan',
+            'version': PLAN_FORMAT_VERSION,
+            'mode': plan.mode,
+            'root': str(plan.root_dir),
+            'entries': len(plan.entries),
+            'moves': len(plan.moves),
+            'counts': plan.category_counts,
+        }
+        fh.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for entry in plan.entries:
+            component = component_of.get(str(entry.path))
+            if component is None:
+                fh.write(json.dumps(_entry_record(entry, None), ensure_ascii=False) + '\n')
+            else:
+                moving.append((component, entry))
+        moving.sort(key=lambda item: item[0])
+        for component, entry in moving:
+            fh.write(json.dumps(_entry_record(entry, component), ensure_ascii=False) + '\n')
+    os.replace(tmp, path)
+    return len(moving)
+
+
+def read_plan_header(path: Path) -> dict:
+    with open(path, 'r', encoding='utf-8') as fh:
+        header = json.loads(fh.readline() or '{}')
+    if header.get('kind') != 'plan':
+        raise ValueError(f'Not a plan file: {path}')
+    if int(header.get('version', 0)) > PLAN_FORMAT_VERSION:
+        raise ValueError(f'Unsupported plan format version: {header.get("version")}')
+    return header
+
+
+def _iter_records(path: Path):
+    read_plan_header(path)
+    with open(path, 'r', encoding='utf-8') as fh:
+        fh.readline()
+        for line_no, line in enumerate(fh, start=2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                raise ValueError(f'{path}:{line_no}: {exc}') from exc
+            if record.get('kind') == 'entry':
+                yield record
+
+
+def _record_entry(record: dict) -> FileEntry:
+    src = Path(record['src'])
+    return FileEntry(
+        path=src,
+        name=str(record.get('name') or src.name),
+        ext=str(record.get('ext', src.suffix.lower())),
+        category=str(record.get('category', '')),
+        proposed_path=Path(record.get('dst') or src),
+        status=str(record.get('status', '')),
+        action=str(record.get('action', '')),
+    )
+
+
+def iter_plan_entries(path: Path):
+    for record in _iter_records(path):
+        yield _record_entry(record)
+
+
+def iter_plan_chunks(path: Path, chunk_size: int = CHUNK_MOVES):
+    # Yields OperationPlans of roughly chunk_size moves. A chunk only ends on
+    # a component boundary, so each one can be validated and applied alone.
+    header = read_plan_header(path)
+    root = Path(header.get('root', ''))
+    mode = str(header.get('mode', 'sort'))
+    chunk_size = max(1, int(chunk_size))
+    entries: list[FileEntry] = []
+    moves: list[tuple[Path, Path]] = []
+    component = None
+    for record in _iter_records(path):
+        entry = _record_entry(record)
+        if entry.proposed_path == entry.path:
+            continue
+        if len(moves) >= chunk_size and record.get('c') != component:
+            yield OperationPlan(mode=mode, root_dir=root, entries=entries, moves=moves)
+            entries, moves = [], []
+        component = record.get('c')
+        entries.append(entry)
+        moves.append((entry.path, entry.proposed_path))
+    if moves:
+        yield OperationPlan(mode=mode, root_dir=root, entries=entries, moves=moves)
+
+
+def load_plan(path: Path) -> OperationPlan:
+    header = read_plan_header(path)
+    entries = list(iter_plan_entries(path))
+    return OperationPlan(
+        mode=str(header.get('mode', 'sort')),
+        root_dir=Path(header.get('root', '')),
+        entries=entries,
+        moves=[(entry.path, entry.proposed_path) for entry in entries if entry.proposed_path != entry.path],
+        category_counts=dict(header.get('counts') or {}),
+    )
+
+
+def apply_plan_file(
+    path: Path,
+    chunk_size: int = CHUNK_MOVES,
+    journal_factory=None,
+    workers: int = 1,
+    progress=None,
+    verify_copies: bool = False,
+) -> int:
+    # Each chunk is its own journaled run, so memory stays bounded by the
+    # chunk and an interrupted import only has one chunk to recover.
+    applied = 0
+    for chunk in iter_plan_chunks(path, chunk_size):
+        journal = journal_factory(chunk) if callable(journal_factory) else None
+        applied += len(apply_plan(chunk, journal=journal, workers=workers, progress=progress, verify_copies=verify_copies))
+    return applied
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
+import csv
+import json
+import os
 import re
-import uuid
+
+from .dir_listing import DirListingCache
+from .move_engine import execute_moves
+from .natural_sort import natural_key
 
 
 ILLEGAL_CHARS_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
@@ -32,6 +38,15 @@ RESERVED_NAMES = {
     'lpt9',
 }
 
+TEMP_PREFIX = '.__goblintmp__'
+MAPPING_CHUNK = 10_000
+MAPPING_SAMPLE = 1000
+MAPPING_HEADERS = {'old', 'from', 'src', 'source', 'old_name', 'current'}
+MIN_SEQUENCE = 2
+# Every line matches: shortest prefix, then the digit run right before the
+# extension (possibly empty), then the extension.
+_TRAILING_NUMBER_RE = re.compile(r'^(.*?)(\d*)((?:\.[^.\n]*)?)$', re.M)
+
 
 @dataclass
 class FileItem:
@@ -48,6 +63,53 @@ def sanitize_name(name: str) -> str:
     return cleaned
 
 
+def iter_files(root: Path, recursive: bool = False):
+    for path in _walk_file_names(root, recursive):
+        yield Path(path)
+
+
+def _walk_file_names(root: Path, recursive: bool):
+    # Streaming scandir walk: one directory is listed at a time and its files
+    # are yielded before the next one is opened. Symlinked folders are not
+    # followed and in-flight temp names are skipped.
+    pending = [os.fspath(root)]
+    while pending:
+        current = pending.pop()
+        files: list[str] = []
+        subdirs: list[str] = []
+        try:
+            with os.scandir(current) as it:
+                for dirent in it:
+                    if dirent.name.startswith(TEMP_PREFIX):
+                        continue
+                    try:
+                        if dirent.is_file():
+                            files.append(dirent.path)
+                        elif recursive and dirent.is_dir(follow_symlinks=False):
+                            subdirs.append(dirent.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        yield from files
+        pending.extend(sorted(subdirs, reverse=True))
+
+
+def directory_offsets(items: list[FileItem], per_directory: bool) -> list[int]:
+    # Position of each item in the sequence; with per_directory, numbering
+    # restarts in every parent folder.
+    if not per_directory:
+        return list(range(len(items)))
+    seen: dict[str, int] = {}
+    offsets: list[int] = []
+    for item in items:
+        parent = os.path.dirname(os.fspath(item.path))
+        offset = seen.get(parent, 0)
+        seen[parent] = offset + 1
+        offsets.append(offset)
+    return offsets
+
+
 def generate_names(
     items: list[FileItem],
     base: str,
@@ -55,13 +117,14 @@ def generate_names(
     pad_width: int,
     separator: str,
     keep_ext: bool = True,
+    per_directory: bool = False,
 ) -> list[FileItem]:
     base_value = (base or '').strip() or 'asset'
     index_value = max(0, int(start_index))
     width_value = max(0, int(pad_width))
     sep_value = separator or ''
 
-    for offset, item in enumerate(items):
+    for offset, item in zip(directory_offsets(items, per_directory), items):
         number = str(index_value + offset).zfill(width_value) if width_value > 0 else str(index_value + offset)
         item.proposed_name = f'{base_value}{sep_value}{number}'
         if keep_ext:
@@ -70,85 +133,633 @@ def generate_names(
     return items
 
 
+@dataclass
+class ReplaceResult:
+    names: list[str | None]
+    matches: int = 0
+    files: int = 0
+
+
+def compile_find(pattern: str, regex: bool = False, case: bool = True):
+    # Raises ValueError for a bad regex so callers can check input before
+    # starting a job.
+    try:
+        return re.compile(pattern if regex else re.escape(pattern), 0 if case else re.IGNORECASE)
+    except re.error as exc:
+        raise ValueError(f'Bad pattern: {exc}') from None
+
+
+def find_replace(
+    items: list[FileItem],
+    pattern: str,
+    repl: str,
+    regex: bool = False,
+    case: bool = True,
+    sanitize: bool = False,
+) -> ReplaceResult:
+    # Runs on the stem of each proposed name (the current name if unset); the
+    # extension is left alone. With regex, repl may use \1 / \g<name>.
+    # Plain case-sensitive text skips the regex engine entirely. names holds
+    # None for items without a match.
+    result = ReplaceResult(names=[None] * len(items))
+    if not pattern:
+        return result
+    literal = not regex and case
+    compiled = None if literal else compile_find(pattern, regex, case)
+    if compiled is not None and not regex:
+        repl = repl.replace('\\', '\\\\')
+    for idx, item in enumerate(items):
+        name = item.proposed_name or item.current_name
+        dot = name.rfind('.')
+        stem, ext = (name[:dot], name[dot:]) if 0 < dot < len(name) - 1 else (name, '')
+        if literal:
+            count = stem.count(pattern)
+            if not count:
+                continue
+            stem = stem.replace(pattern, repl)
+        else:
+            try:
+                stem, count = compiled.subn(repl, stem)
+            except re.error as exc:
+                # Group references are only checked on the first match.
+                raise ValueError(f'Bad replacement: {exc}') from None
+            if not count:
+                continue
+        result.matches += count
+        result.files += 1
+        renamed = stem + ext
+        result.names[idx] = sanitize_name(renamed) if sanitize else renamed
+    return result
+
+
+@dataclass
+class FrameSequence:
+    directory: str
+    prefix: str
+    ext: str
+    members: list[int]
+    numbers: list[int]
+    width: int
+    gaps: list[tuple[int, int]] = field(default_factory=list)
+    duplicates: list[int] = field(default_factory=list)
+    mispadded: list[int] = field(default_factory=list)
+
+    @property
+    def first(self) -> int:
+        return self.numbers[0]
+
+    @property
+    def last(self) -> int:
+        return self.numbers[-1]
+
+    @property
+    def missing(self) -> int:
+        return sum(end - start + 1 for start, end in self.gaps)
+
+    @property
+    def clean(self) -> bool:
+        return not (self.gaps or self.duplicates or self.mispadded)
+
+
+@dataclass
+class SequenceReport:
+    sequences: list[FrameSequence]
+    unnumbered: int
+    # Per item: (prefix length, digit count); digits 0 means no trailing number.
+    spans: list[tuple[int, int]]
+
+    @property
+    def gap_count(self) -> int:
+        return sum(len(seq.gaps) for seq in self.sequences)
+
+    @property
+    def duplicate_count(self) -> int:
+        return sum(len(seq.duplicates) for seq in self.sequences)
+
+    @property
+    def mispadded_count(self) -> int:
+        return sum(len(seq.mispadded) for seq in self.sequences)
+
+
+def analyze_sequences(items: list[FileItem], min_length: int = MIN_SEQUENCE) -> SequenceReport:
+    # Trailing numbers for all names come from one regex pass over the joined
+    # names; files sharing folder, prefix and extension (case-insensitively)
+    # form a sequence. Newlines are legal in POSIX names, so they are masked
+    # with '/', which is not, to keep one line per name.
+    names = [item.current_name for item in items]
+    text = '\n'.join(name.replace('\n', '/') for name in names)
+    spans = [(len(prefix), len(digits)) for prefix, digits, _ext in _TRAILING_NUMBER_RE.findall(text)]
+
+    groups: dict[tuple[str, str, str], list[int]] = {}
+    digits: list[str] = [''] * len(names)
+    values: list[int] = [0] * len(names)
+    unnumbered = 0
+    sep = os.sep
+    for idx, (name, (start, size)) in enumerate(zip(names, spans)):
+        if not size:
+            unnumbered += 1
+            continue
+        digits[idx] = name[start:start + size]
+        values[idx] = int(digits[idx])
+        key = (
+            os.fspath(items[idx].path).rpartition(sep)[0],
+            name[:start].casefold(),
+            name[start + size:].casefold(),
+        )
+        groups.setdefault(key, []).append(idx)
+
+    sequences: list[FrameSequence] = []
+    for (directory, _prefix, _ext), members in groups.items():
+        if len(members) < min_length:
+            unnumbered += len(members)
+            continue
+        members.sort(key=lambda idx: (values[idx], names[idx].casefold()))
+        numbers = [values[idx] for idx in members]
+
+        # Padding is the most common width among zero-padded numbers (the
+        # wider one on ties); a sequence with no leading zeros is unpadded.
+        widths: dict[int, int] = {}
+        for idx in members:
+            if len(digits[idx]) > 1 and digits[idx][0] == '0':
+                widths[len(digits[idx])] = widths.get(len(digits[idx]), 0) + 1
+        width = max(widths, key=lambda w: (widths[w], w)) if widths else 0
+
+        first = members[0]
+        seq = FrameSequence(
+            directory=directory,
+            prefix=names[first][:spans[first][0]],
+            ext=names[first][sum(spans[first]):],
+            members=members,
+            numbers=numbers,
+            width=width,
+        )
+        for prev, cur in zip(numbers, numbers[1:]):
+            if cur == prev:
+                if not seq.duplicates or seq.duplicates[-1] != cur:
+                    seq.duplicates.append(cur)
+            elif cur > prev + 1:
+                seq.gaps.append((prev + 1, cur - 1))
+        seq.mispadded = [idx for idx, n in zip(members, numbers) if digits[idx] != str(n).zfill(width)]
+        sequences.append(seq)
+    sequences.sort(key=lambda seq: (natural_key(seq.directory), natural_key(seq.prefix), seq.ext.casefold()))
+    return SequenceReport(sequences=sequences, unnumbered=unnumbered, spans=spans)
+
+
+def renumber_names(
+    items: list[FileItem],
+    report: SequenceReport | None = None,
+    start_index: int | None = None,
+    pad_width: int | None = None,
+) -> list[str | None]:
+    # Contiguous numbers in sequence order: gaps close and duplicates get the
+    # next free numbers. Each sequence keeps its own first number and padding
+    # unless start_index / pad_width say otherwise. None for untouched items.
+    report = report if report is not None else analyze_sequences(items)
+    names: list[str | None] = [None] * len(items)
+    for seq in report.sequences:
+        first = seq.first if start_index is None else max(0, int(start_index))
+        width = seq.width if pad_width is None else max(0, int(pad_width))
+        for offset, idx in enumerate(seq.members):
+            start, size = report.spans[idx]
+            name = items[idx].current_name
+            renamed = f'{name[:start]}{str(first + offset).zfill(width)}{name[start + size:]}'
+            if renamed != name:
+                names[idx] = renamed
+    return names
+
+
+def renumber_plan(
+    items: list[FileItem],
+    report: SequenceReport | None = None,
+    start_index: int | None = None,
+    pad_width: int | None = None,
+) -> list[tuple[Path, Path]]:
+    # Renumbering shifts names onto each other; apply_rename schedules the
+    # chains and cycles this produces.
+    names = renumber_names(items, report, start_index, pad_width)
+    return [(Path(item.path), Path(item.path).with_name(name)) for item, name in zip(items, names) if name is not None]
+
+
 def _status_is_error(status: str) -> bool:
     return bool(status and status != 'no-op')
 
 
 def _is_reserved(name: str) -> bool:
-    stem = Path(name).stem.casefold().strip()
-    return stem in RESERVED_NAMES
-
+    # Same split as Path(name).stem without building a Path per item.
+    dot = name.rfind('.')
+    stem = name[:dot] if 0 < dot < len(name) - 1 else name
+    return stem.casefold().strip() in RESERVED_NAMES
+
+
+STATUS_ISSUES = {
+    'empty name': 'empty',
+    'illegal name': 'illegal',
+    'illegal chars': 'illegal',
+    'reserved name': 'reserved',
+    'duplicate target': 'duplicate',
+    'duplicate source': 'duplicate',
+    'target exists': 'exists',
+    'no-op': 'no_op',
+}
 
-def validate(items: list[FileItem]) -> dict:
-    issues = {
-        'empty': 0,
-        'illegal': 0,
-        'reserved': 0,
-        'duplicate': 0,
-        'exists': 0,
-        'no_op': 0,
-    }
-
-    src_paths = {Path(item.path) for item in items}
-    duplicate_buckets: dict[tuple[str, str], list[int]] = {}
-    target_path_for_idx: dict[int, Path] = {}
 
-    for idx, item in enumerate(items):
+class RenameValidator:
+    # validate() kept alive between edits. Duplicate buckets, per-row status
+    # and the issue counts stay in place, so update() re-checks only the
+    # edited rows and the rows sharing a target with them. Target listings are
+    # read once per parent directory; reset() picks up outside changes.
+    # Batches of one big job can share a listings cache and a vacated set
+    # (normcased paths that other batches rename away).
+    def __init__(self, items: list[FileItem], vacated: set[str] | None = None, listings: DirListingCache | None = None):
+        self.reset(items, vacated, listings)
+
+    def reset(self, items: list[FileItem], vacated: set[str] | None = None, listings: DirListingCache | None = None) -> None:
+        self.items = items
+        self._src_paths = {os.path.normcase(os.fspath(item.path)) for item in items}
+        self._vacated = vacated or set()
+        self._listings = listings if listings is not None else DirListingCache()
+        self._folded_parents: dict[str, str] = {}
+        self._buckets: dict[tuple[str, str], set[int]] = {}
+        self._targets: dict[int, tuple[str, str, tuple[str, str]]] = {}
+        self._status: list[str | None] = [None] * len(items)
+        self._changed = [False] * len(items)
+        self._issues = {key: 0 for key in ('empty', 'illegal', 'reserved', 'duplicate', 'exists', 'no_op')}
+        self._errors = 0
+        self._changes = 0
+        self._base = [self._index_name(idx) for idx in range(len(items))]
+        for idx in range(len(items)):
+            self._apply(idx, self._status_for(idx))
+
+    def update(self, indexes) -> set[int]:
+        # Returns every row whose status was recomputed.
+        touched: set[int] = set()
+        for idx in indexes:
+            touched.add(idx)
+            touched.update(self._unindex(idx))
+            self._base[idx] = self._index_name(idx)
+            target = self._targets.get(idx)
+            if target is not None:
+                touched.update(self._buckets[target[2]])
+        for idx in touched:
+            self._apply(idx, self._status_for(idx))
+        return touched
+
+    def target_key(self, idx: int) -> tuple[str, str] | None:
+        target = self._targets.get(idx)
+        return target[2] if target is not None else None
+
+    def flag(self, idx: int, status: str) -> None:
+        # Marks a problem found outside this batch, e.g. by another chunk.
+        if not _status_is_error(self._status[idx] or ''):
+            self._apply(idx, status)
+
+    def report(self) -> dict:
+        return {
+            'valid': self._errors == 0,
+            'error_count': self._errors,
+            'change_count': self._changes,
+            'issues': dict(self._issues),
+        }
+
+    def _index_name(self, idx: int) -> str:
+        item = self.items[idx]
         proposed = item.proposed_name or ''
-        item.status = ''
-
         if not proposed:
-            item.status = 'empty name'
-            issues['empty'] += 1
-            continue
+            return 'empty name'
         if proposed in {'.', '..'}:
-            item.status = 'illegal name'
-            issues['illegal'] += 1
-            continue
+            return 'illegal name'
         if ILLEGAL_CHARS_RE.search(proposed) or proposed.rstrip(' .') != proposed:
-            item.status = 'illegal chars'
-            issues['illegal'] += 1
-            continue
+            return 'illegal chars'
         if _is_reserved(proposed):
-            item.status = 'reserved name'
-            issues['reserved'] += 1
-            continue
+            return 'reserved name'
+
+        parent = os.path.dirname(os.fspath(item.path))
+        folded_parent = self._folded_parents.get(parent)
+        if folded_parent is None:
+            folded_parent = self._folded_parents[parent] = parent.casefold()
+        key = (folded_parent, proposed.casefold())
+        self._targets[idx] = (parent, proposed, key)
+        self._buckets.setdefault(key, set()).add(idx)
+        return 'no-op' if proposed == item.current_name else ''
+
+    def _unindex(self, idx: int) -> tuple[int, ...]:
+        target = self._targets.pop(idx, None)
+        if target is None:
+            return ()
+        bucket = self._buckets[target[2]]
+        bucket.discard(idx)
+        if not bucket:
+            del self._buckets[target[2]]
+        return tuple(bucket)
+
+    def _status_for(self, idx: int) -> str:
+        target = self._targets.get(idx)
+        if target is None:
+            return self._base[idx]
+        parent, proposed, key = target
+        if len(self._buckets[key]) > 1:
+            return 'duplicate target'
+        dst = os.path.join(parent, proposed)
+        folded_dst = os.path.normcase(dst)
+        if folded_dst not in self._src_paths and folded_dst not in self._vacated and self._listings.has_name(self._listings.directory(parent), proposed, dst):
+            return 'target exists'
+        return self._base[idx]
+
+    def _apply(self, idx: int, status: str) -> None:
+        old = self._status[idx]
+        if old is not None:
+            if old in STATUS_ISSUES:
+                self._issues[STATUS_ISSUES[old]] -= 1
+            self._errors -= _status_is_error(old)
+            self._changes -= self._changed[idx]
+        item = self.items[idx]
+        changed = item.proposed_name != item.current_name and not _status_is_error(status)
+        if status in STATUS_ISSUES:
+            self._issues[STATUS_ISSUES[status]] += 1
+        self._errors += _status_is_error(status)
+        self._changes += changed
+        self._status[idx] = status
+        self._changed[idx] = changed
+        item.status = status
 
-        dst = item.path.with_name(proposed)
-        target_path_for_idx[idx] = dst
 
-        dup_key = (str(dst.parent).casefold(), proposed.casefold())
-        duplicate_buckets.setdefault(dup_key, []).append(idx)
+def validate(items: list[FileItem]) -> dict:
+    # Targets are checked against one scandir listing per parent directory
+    # rather than a stat per item.
+    return RenameValidator(items).report()
+
+
+def iter_mapping_rows(path: Path):
+    # Yields (line, old, new) without loading the file. CSV (delimiter
+    # sniffed, optional old/new header), JSON Lines and .json objects or
+    # arrays all stream; for .json, line is the element number. new is None
+    # for rows that cannot be read.
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in ('.json', '.jsonl'):
+        with open(path, 'r', encoding='utf-8-sig') as fh:
+            if suffix == '.json':
+                for line, row in enumerate(_iter_json_elements(fh), start=1):
+                    yield (line, *_mapping_pair(row))
+                return
+            for line, text in enumerate(fh, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError:
+                    yield line, text.strip(), None
+                    continue
+                yield (line, *_mapping_pair(row))
+        return
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as fh:
+        sample = fh.read(8192)
+        fh.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        for line, row in enumerate(csv.reader(fh, dialect), start=1):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if line == 1 and row[0].strip().casefold() in MAPPING_HEADERS:
+                continue
+            yield (line, *_mapping_pair(row))
+
+
+_JSON_NUMBER_END = re.compile(r'[,\]}\s]')
+
+
+def _iter_json_elements(fh, block: int = 1 << 16):
+    # Elements of a top-level array, or (key, value) pairs of an object,
+    # decoded one at a time from a sliding buffer.
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        more = '' if eof else fh.read(block)
+        if not more:
+            eof = True
+            return False
+        buf = buf[pos:] + more
+        pos = 0
+        return True
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                raise ValueError('Rename map ends early')
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f'Rename map: expected {char!r} at element {count + 1}')
+        pos += 1
+
+    def value():
+        nonlocal pos
+        if peek() in '-0123456789':
+            # A number cut by the block edge still parses, just shorter.
+            while _JSON_NUMBER_END.search(buf, pos) is None and fill():
+                pass
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if fill():
+                    continue
+                raise
+            pos = end
+            return obj
+
+    count = 0
+    opener = peek()
+    if opener not in '[{':
+        raise ValueError('A .json rename map must be an array or an object')
+    closer = ']' if opener == '[' else '}'
+    pos += 1
+    while peek() != closer:
+        if count:
+            expect(',')
+        item = value()
+        if opener == '{':
+            expect(':')
+            item = (item, value())
+        count += 1
+        yield item
+
+
+def _mapping_pair(row) -> tuple[str, str | None]:
+    if isinstance(row, dict):
+        old = row.get('old', row.get('from'))
+        new = row.get('new', row.get('to'))
+    elif isinstance(row, (list, tuple)) and len(row) >= 2:
+        old, new = row[0], row[1]
+    else:
+        return str(row), None
+    if old is None or new is None:
+        return str(old or ''), None
+    return str(old).strip(), str(new).strip()
+
+
+class _ListingIndex:
+    # Hash index of the folder listing by path relative to root ('/'
+    # separators). Case-folded keys are only built if an exact lookup misses.
+    def __init__(self, root: Path, recursive: bool):
+        base = os.fspath(root)
+        cut = len(base) + (0 if base.endswith(os.sep) else 1)
+        self._exact: dict[str, str] = {}
+        for text in _walk_file_names(root, recursive):
+            self._exact[text[cut:].replace(os.sep, '/')] = text
+        self._folded: dict[str, str] | None = None
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def match(self, old: str) -> str | None:
+        key = old.replace('\\', '/')
+        while key.startswith('./'):
+            key = key[2:]
+        found = self._exact.get(key)
+        if found is not None:
+            return found
+        if self._folded is None:
+            self._folded = {}
+            for rel, text in self._exact.items():
+                self._folded.setdefault(rel.casefold(), text)
+        return self._folded.get(key.casefold())
 
-        if proposed == item.current_name:
-            item.status = 'no-op'
-            issues['no_op'] += 1
 
-    for _key, indexes in duplicate_buckets.items():
-        if len(indexes) < 2:
-            continue
-        for idx in indexes:
-            items[idx].status = 'duplicate target'
-            issues['duplicate'] += 1
-
-    for idx, dst in target_path_for_idx.items():
-        item = items[idx]
-        if _status_is_error(item.status):
+@dataclass
+class MappingResult:
+    rows: int = 0
+    matched: int = 0
+    unmatched: int = 0
+    unmatched_rows: list[tuple[int, str]] = field(default_factory=list)
+    error_count: int = 0
+    change_count: int = 0
+    issues: dict[str, int] = field(default_factory=dict)
+    invalid_rows: list[tuple[Path, str, str]] = field(default_factory=list)
+    plan: list[tuple[Path, Path]] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return self.error_count == 0
+
+
+def validate_mapping(
+    mapping_path: Path,
+    folder: Path,
+    recursive: bool = False,
+    chunk_size: int = MAPPING_CHUNK,
+    on_chunk=None,
+) -> MappingResult:
+    # Two streaming passes over the map. The first matches rows to files,
+    # collects which files will be renamed away, so targets freed by a later
+    # row are not reported as existing, and finds sources and targets claimed
+    # by more than one row. Every such row is flagged, as RenameValidator does
+    # within a chunk, so the result does not depend on chunk_size. The second
+    # pass builds FileItems one chunk at a time and validates each; only the
+    # path keys above and the valid moves outlive a chunk, so memory grows by
+    # a few short strings per row rather than a FileItem. on_chunk(items) sees
+    # every chunk. Rows whose target is only free because another row renames
+    # it away are re-checked at the end, once it is known which of those rows
+    # are valid.
+    folder = Path(folder)
+    index = _ListingIndex(folder, recursive)
+    result = MappingResult()
+    vacated: set[str] = set()
+    shared_sources: set[str] = set()
+    claims: dict[tuple[str, str], int] = {}
+    for line, old, new in iter_mapping_rows(mapping_path):
+        result.rows += 1
+        src = index.match(old) if new is not None else None
+        if src is None:
+            result.unmatched += 1
+            if len(result.unmatched_rows) < MAPPING_SAMPLE:
+                result.unmatched_rows.append((line, old))
             continue
-        if dst in src_paths:
+        result.matched += 1
+        src_key = os.path.normcase(src)
+        if src_key in vacated:
+            shared_sources.add(src_key)
+        vacated.add(src_key)
+        key = (os.path.dirname(src).casefold(), new.casefold())
+        claims[key] = claims.get(key, 0) + 1
+    shared_targets = {key for key, count in claims.items() if count > 1}
+    del claims
+
+    listings = DirListingCache()
+    chunk: list[FileItem] = []
+    waiting: list[tuple[int, FileItem]] = []
+
+    def flush():
+        validator = RenameValidator(chunk, vacated=vacated, listings=listings)
+        for idx, item in enumerate(chunk):
+            if os.path.normcase(os.fspath(item.path)) in shared_sources:
+                validator.flag(idx, 'duplicate source')
+            elif validator.target_key(idx) in shared_targets:
+                validator.flag(idx, 'duplicate target')
+        report = validator.report()
+        result.error_count += report['error_count']
+        result.change_count += report['change_count']
+        for name, count in report['issues'].items():
+            result.issues[name] = result.issues.get(name, 0) + count
+        for item in chunk:
+            if _status_is_error(item.status):
+                if len(result.invalid_rows) < MAPPING_SAMPLE:
+                    result.invalid_rows.append((item.path, item.proposed_name, item.status))
+            elif item.proposed_name != item.current_name:
+                dst = item.path.with_name(item.proposed_name)
+                folded = os.path.normcase(os.fspath(dst))
+                if folded in vacated and folded != os.path.normcase(os.fspath(item.path)):
+                    if listings.has_name(listings.directory(os.fspath(dst.parent)), item.proposed_name, os.fspath(dst)):
+                        waiting.append((len(result.plan), item))
+                result.plan.append((item.path, dst))
+        if callable(on_chunk):
+            on_chunk(chunk)
+        chunk.clear()
+
+    for _line, old, new in iter_mapping_rows(mapping_path):
+        src = index.match(old) if new is not None else None
+        if src is None:
             continue
-        if dst.exists():
+        path = Path(src)
+        chunk.append(FileItem(path=path, current_name=path.name, ext=path.suffix.lower(), proposed_name=new))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    # Dropping a row keeps its source in place, which can strand the rows
+    # waiting on that name in turn.
+    moving = {os.path.normcase(os.fspath(src)) for src, _dst in result.plan}
+    dropped: set[int] = set()
+    while True:
+        stranded = [(pos, item) for pos, item in waiting if pos not in dropped and os.path.normcase(os.fspath(result.plan[pos][1])) not in moving]
+        if not stranded:
+            break
+        for pos, item in stranded:
+            dropped.add(pos)
+            moving.discard(os.path.normcase(os.fspath(item.path)))
             item.status = 'target exists'
-            issues['exists'] += 1
-
-    error_count = sum(1 for item in items if _status_is_error(item.status))
-    change_count = sum(1 for item in items if item.proposed_name != item.current_name and not _status_is_error(item.status))
-    return {
-        'valid': error_count == 0,
-        'error_count': error_count,
-        'change_count': change_count,
-        'issues': issues,
-    }
+            result.error_count += 1
+            result.change_count -= 1
+            result.issues['exists'] = result.issues.get('exists', 0) + 1
+            if len(result.invalid_rows) < MAPPING_SAMPLE:
+                result.invalid_rows.append((item.path, item.proposed_name, item.status))
+    if dropped:
+        result.plan = [move for pos, move in enumerate(result.plan) if pos not in dropped]
+    return result
 
 
 def plan_rename(items: list[FileItem]) -> list[tuple[Path, Path]]:
@@ -162,52 +773,17 @@ def plan_rename(items: list[FileItem]) -> list[tuple[Path, Path]]:
     return plan
 
 
-def _unique_temp_path(src: Path) -> Path:
-    while True:
-        temp_name = f'.__goblintmp__{uuid.uuid4().hex}__{src.name}'
-        candidate = src.with_name(temp_name)
-        if not candidate.exists():
-            return candidate
-
-
-def apply_rename(plan: list[tuple[Path, Path]]) -> list[tuple[Path, Path]]:
+def apply_rename(plan: list[tuple[Path, Path]], journal=None, workers: int = 1, progress=None) -> list[tuple[Path, Path]]:
     if not plan:
         return []
 
     normalized = [(Path(src), Path(dst)) for src, dst in plan]
-    temp_map: dict[Path, Path] = {}
-    moved_phase1: list[tuple[Path, Path]] = []
-    moved_phase2: list[tuple[Path, Path]] = []
+    for src, _dst in normalized:
+        if not src.exists():
+            raise FileNotFoundError(f'Missing source file: {src}')
+    done = execute_moves(normalized, temp_prefix=TEMP_PREFIX, journal=journal, workers=workers, progress=progress)
+    return [(dst, src) for src, dst in done]
 
-    try:
-        for src, _dst in normalized:
-            if not src.exists():
-                raise FileNotFoundError(f'Missing source file: {src}')
-            temp = _unique_temp_path(src)
-            src.rename(temp)
-            temp_map[src] = temp
-            moved_phase1.append((temp, src))
-
-        for src, dst in normalized:
-            temp = temp_map[src]
-            if dst.exists() and dst != temp:
-                raise FileExistsError(f'Target already exists: {dst}')
-            temp.rename(dst)
-            moved_phase2.append((dst, src))
-    except Exception:
-        # Roll back phase 2 moves to temp names.
-        for final_dst, original_src in reversed(moved_phase2):
-            temp = temp_map.get(original_src)
-            if temp is not None and final_dst.exists():
-                final_dst.rename(temp)
-        # Roll back all temp names to original sources.
-        for temp, src in reversed(moved_phase1):
-            if temp.exists():
-                temp.rename(src)
-        raise
-
-    return moved_phase2
-
-
-def undo_rename(last_plan_reverse: list[tuple[Path, Path]]) -> list[tuple[Path, Path]]:
-    return apply_rename(last_plan_reverse)
+
+def undo_rename(last_plan_reverse: list[tuple[Path, Path]], journal=None, workers: int = 1, progress=None) -> list[tuple[Path, Path]]:
+    return apply_rename(last_plan_reverse, journal=journal, workers=workers, progress=progress)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import os
+import re
+import string
+
+from .media_metadata import IMAGE_EXTS, read_metadata_many
+from .rename_goblin import FileItem, directory_offsets
+
+
+DEFAULT_DATE_FORMAT = '%Y%m%d'
+NAME_TOKENS = ('name', 'stem', 'ext', 'parent')
+STAT_TOKENS = ('mtime', 'size')
+METADATA_TOKENS = ('w', 'h', 'mode', 'frames')
+METADATA_FIELDS = {'w': 'width', 'h': 'height', 'mode': 'mode', 'frames': 'frames'}
+INT_TOKENS = ('n', 'size', 'w', 'h', 'frames')
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class _Subject:
+    # Per-item values, filled on first use. Only tokens present in the
+    # template ever touch the filesystem.
+    __slots__ = ('item', 'index', 'groups', 'metadata', '_stat')
+
+    def __init__(self, item: FileItem, index: int, groups: tuple, metadata: dict | None):
+        self.item = item
+        self.index = index
+        self.groups = groups
+        self.metadata = metadata
+        self._stat: os.stat_result | None = None
+
+    def stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = os.stat(self.item.path)
+        return self._stat
+
+
+def _split_name(name: str) -> tuple[str, str]:
+    # Same split as Path(name).stem / .suffix.
+    dot = name.rfind('.')
+    if 0 < dot < len(name) - 1:
+        return name[:dot], name[dot:]
+    return name, ''
+
+
+def _getter(token: str, spec: str):
+    if token == 'name':
+        return lambda s: s.item.current_name
+    if token == 'stem':
+        return lambda s: _split_name(s.item.current_name)[0]
+    if token == 'ext':
+        return lambda s: _split_name(s.item.current_name)[1]
+    if token == 'parent':
+        return lambda s: os.path.basename(os.path.dirname(os.fspath(s.item.path)))
+    if token == 'n':
+        return lambda s: s.index
+    if token == 'size':
+        return lambda s: s.stat().st_size
+    if token == 'mtime':
+        date_format = spec or DEFAULT_DATE_FORMAT
+        return lambda s: datetime.fromtimestamp(s.stat().st_mtime).strftime(date_format)
+    if token == 'mode':
+        return lambda s: str((s.metadata or {}).get('mode', ''))
+    if token in METADATA_TOKENS:
+        key = METADATA_FIELDS[token]
+        return lambda s: int((s.metadata or {}).get(key, 0))
+    group = int(token)
+    return lambda s: s.groups[group] or ''
+
+
+class RenameTemplate:
+    # Parsed once into literal strings and small getter functions; rendering
+    # an item is a join over that list. Tokens: {name} {stem} {ext} {parent}
+    # {n[:spec]} {size} {mtime[:strftime]} {w} {h} {mode} {frames} and
+    # {0}..{9} for the groups of the optional match regex (run against the
+    # current stem).
+    def __init__(self, text: str, match: str | None = None):
+        self.text = text
+        try:
+            self.pattern = re.compile(match) if match else None
+        except re.error as exc:
+            raise TemplateError(f'Bad match pattern: {exc}') from None
+        self.tokens: set[str] = set()
+        self._parts: list = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as exc:
+            raise TemplateError(f'Bad template: {exc}') from None
+        for literal, field, spec, conversion in parsed:
+            if literal:
+                self._parts.append(literal)
+            if field is None:
+                continue
+            if conversion:
+                raise TemplateError(f'Conversions are not supported: {{{field}!{conversion}}}')
+            self._parts.append(self._compile_field(field, spec or ''))
+            self.tokens.add(field)
+        self.uses_stat = any(token in STAT_TOKENS for token in self.tokens)
+        self.uses_metadata = any(token in METADATA_TOKENS for token in self.tokens)
+        self.has_ext = bool(self.tokens & {'ext', 'name'})
+
+    def _compile_field(self, field: str, spec: str):
+        if field.isdigit():
+            groups = self.pattern.groups if self.pattern is not None else -1
+            if int(field) > groups:
+                raise TemplateError(f'{{{field}}} needs a match pattern with that many groups')
+        elif field not in NAME_TOKENS + STAT_TOKENS + METADATA_TOKENS + ('n',):
+            raise TemplateError(f'Unknown token: {{{field}}}')
+        get = _getter(field, spec)
+        if field == 'mtime' or not spec:
+            return lambda s: str(get(s))
+        try:
+            format(0 if field in INT_TOKENS else '', spec)
+        except ValueError as exc:
+            raise TemplateError(f'{{{field}:{spec}}}: {exc}') from None
+        return lambda s: format(get(s), spec)
+
+    def render(self, item: FileItem, index: int, metadata: dict | None = None, keep_ext: bool = True) -> str | None:
+        # None when a match pattern is set and the stem does not match.
+        groups: tuple = ()
+        if self.pattern is not None:
+            found = self.pattern.search(_split_name(item.current_name)[0])
+            if found is None:
+                return None
+            groups = (found.group(0),) + found.groups()
+        subject = _Subject(item, index, groups, metadata)
+        out = ''.join([part if part.__class__ is str else part(subject) for part in self._parts])
+        if keep_ext and not self.has_ext:
+            out += item.ext
+        return out
+
+
+def render_names(
+    items: list[FileItem],
+    template: RenameTemplate,
+    start_index: int = 1,
+    keep_ext: bool = True,
+    workers: int = 8,
+    per_directory: bool = False,
+) -> list[str | None]:
+    # Image headers come from the shared metadata cache (keyed by path, size
+    # and mtime, so re-rendering reads nothing), fetched in parallel and only
+    # for image files when the template asks for {w}/{h}/{mode}/{frames}.
+    # Stat-based tokens fan out the same way; plain name templates stay a
+    # single pass.
+    metadata: list[dict | None] = [None] * len(items)
+    if template.uses_metadata:
+        images = [idx for idx, item in enumerate(items) if item.ext.lower() in IMAGE_EXTS]
+        found = read_metadata_many([Path(items[idx].path) for idx in images], workers=workers, frames='frames' in template.tokens)
+        for idx, entry in zip(images, found):
+            metadata[idx] = entry
+
+    offsets = directory_offsets(items, per_directory)
+
+    def render(idx: int) -> str | None:
+        try:
+            return template.render(items[idx], start_index + offsets[idx], metadata[idx], keep_ext=keep_ext)
+        except OSError:
+            return None
+
+    if template.uses_stat and workers > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(render, range(len(items))))
+    return [render(idx) for idx in range(len(items))]
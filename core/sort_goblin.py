@@ -2,8 +2,17 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from pathlib import Path
+import os
 import re
-import uuid
+import time
+
+from .category_rules import CategoryRules
+from .dir_listing import DirListingCache
+from .duplicate_finder import find_duplicates
+from .file_sniffer import sniff_categories
+from .media_metadata import read_metadata_many
+from .move_engine import execute_moves
+from .natural_sort import natural_key
 
 
 ILLEGAL_CHARS_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
@@ -32,19 +41,40 @@ RESERVED_NAMES = {
     'lpt9',
 }
 
-CATEGORY_ORDER = ['Images', 'Videos', 'Audio', 'Documents', 'Archives', 'Code', 'Other']
+DUPLICATES_CATEGORY = 'Duplicates'
+CATEGORY_ORDER = ['Images', 'Videos', 'Audio', 'Documents', 'Archives', 'Code', 'Other', DUPLICATES_CATEGORY]
 
 CATEGORY_EXTENSIONS = {
     'Images': {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tga', '.tiff', '.tif', '.svg'},
     'Videos': {'.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v'},
     'Audio': {'.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac'},
     'Documents': {'.pdf', '.txt', '.md', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'},
-    'Archives': {'.zip', '.7z', '.rar', '.tar', '.gz', '.bz2', '.xz'},
+    'Archives': {'.zip', '.7z', '.rar', '.tar', '.gz', '.bz2', '.xz', '.tgz', '.tar.gz', '.tar.bz2', '.tar.xz'},
     'Code': {'.py', '.js', '.ts', '.json', '.yml', '.yaml', '.cs', '.gd', '.gdshader', '.cpp', '.h', '.java'},
 }
 
 OPTIONAL_BUCKETS = {'Archives', 'Code', 'Audio'}
 
+DUPLICATE_MODES = ('off', 'bucket', 'skip')
+
+# Rule -> the category whose folder it splits into sub-buckets.
+BUCKET_RULES = {
+    'category': None,
+    'date': 'Images',
+    'resolution': 'Images',
+    'duration': 'Audio',
+}
+RESOLUTION_BUCKETS = [(3840, '4K+'), (1920, 'Full HD'), (1280, 'HD'), (1, 'Small')]
+DURATION_BUCKETS = [(60, 'Under 1 min'), (300, '1-5 min'), (1200, '5-20 min')]
+
+EXTENSION_CATEGORY = {
+    ext: category
+    for category in reversed(CATEGORY_ORDER)
+    for ext in CATEGORY_EXTENSIONS.get(category, ())
+}
+
+TEMP_PREFIX = '.__sortgoblin_tmp__'
+
 
 @dataclass
 class FileEntry:
@@ -79,89 +109,391 @@ def sanitize_name(name: str) -> str:
     return cleaned
 
 
-def categorize(path: Path, include_optional_categories: bool = True) -> str:
-    ext = path.suffix.lower()
-    for category in CATEGORY_ORDER:
-        if category == 'Other':
-            continue
-        if ext in CATEGORY_EXTENSIONS[category]:
-            if not include_optional_categories and category in OPTIONAL_BUCKETS:
-                return 'Other'
+def _extension_category(name: str) -> str:
+    lowered = name.lower()
+    last = lowered.rfind('.')
+    if last <= 0:
+        return 'Other'
+    prev = lowered.rfind('.', 0, last)
+    if prev > 0:
+        category = EXTENSION_CATEGORY.get(lowered[prev:])
+        if category is not None:
             return category
-    return 'Other'
-
-
-def resolve_collision(dst_path: Path, used_keys: set[str] | None = None) -> Path:
-    candidate = dst_path
-    stem = dst_path.stem
-    suffix = dst_path.suffix
-    parent = dst_path.parent
-    idx = 2
-    while True:
-        key = str(candidate).casefold()
-        occupied = candidate.exists() or (used_keys is not None and key in used_keys)
-        if not occupied:
-            return candidate
-        candidate = parent / f'{stem} ({idx}){suffix}'
-        idx += 1
+    return EXTENSION_CATEGORY.get(lowered[last:], 'Other')
 
 
-def _list_top_level_files(dir_path: Path) -> list[Path]:
-    root = Path(dir_path)
-    if not root.exists() or not root.is_dir():
-        raise NotADirectoryError(f'Not a directory: {root}')
-    files = [p for p in root.iterdir() if p.is_file()]
-    files.sort(key=lambda p: p.name.casefold())
-    return files
+def _gate_optional(category: str, include_optional_categories: bool) -> str:
+    if not include_optional_categories and category in OPTIONAL_BUCKETS:
+        return 'Other'
+    return category
 
 
-def _ensure_within_root(path: Path, root: Path) -> bool:
-    try:
-        path.resolve().relative_to(root.resolve())
+def categorize(path: Path, include_optional_categories: bool = True) -> str:
+    return _gate_optional(_extension_category(path.name), include_optional_categories)
+
+
+class _PlanRow:
+    __slots__ = ('src', 'dst', 'name', 'ext', 'category', 'action', 'status', 'fixed')
+
+    def __init__(self, src: Path, name: str, ext: str, category: str):
+        self.src = src
+        self.dst = src
+        self.name = name
+        self.ext = ext
+        self.category = category
+        self.action = 'No-op'
+        self.status = ''
+        self.fixed = False
+
+    def to_entry(self) -> FileEntry:
+        return FileEntry(
+            path=self.src,
+            name=self.name,
+            ext=self.ext,
+            category=self.category,
+            proposed_path=self.dst,
+            status=self.status,
+            action=self.action,
+        )
+
+
+def _path_key(path: Path) -> str:
+    return str(path).casefold()
+
+
+class CollisionIndex:
+    def __init__(self):
+        self._names: dict[str, dict[str, int]] = {}
+        self._next_suffix: dict[tuple[str, str, str], int] = {}
+
+    def _listing(self, parent: Path) -> dict[str, int]:
+        dir_key = _path_key(parent)
+        names = self._names.get(dir_key)
+        if names is None:
+            names = {}
+            try:
+                with os.scandir(parent) as it:
+                    for dirent in it:
+                        name_key = dirent.name.casefold()
+                        names[name_key] = names.get(name_key, 0) + 1
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self._names[dir_key] = names
+        return names
+
+    def is_occupied(self, path: Path) -> bool:
+        return self._listing(path.parent).get(path.name.casefold(), 0) > 0
+
+    def occupy(self, path: Path) -> None:
+        names = self._listing(path.parent)
+        name_key = path.name.casefold()
+        names[name_key] = names.get(name_key, 0) + 1
+
+    def release(self, path: Path) -> None:
+        names = self._listing(path.parent)
+        name_key = path.name.casefold()
+        count = names.get(name_key, 0)
+        if count > 1:
+            names[name_key] = count - 1
+        else:
+            names.pop(name_key, None)
+
+    def next_free(self, path: Path) -> Path:
+        if not self.is_occupied(path):
+            return path
+        stem = path.stem
+        suffix = path.suffix
+        parent = path.parent
+        counter_key = (_path_key(parent), stem.casefold(), suffix.casefold())
+        idx = self._next_suffix.get(counter_key, 2)
+        candidate = parent / f'{stem} ({idx}){suffix}'
+        while self.is_occupied(candidate):
+            idx += 1
+            candidate = parent / f'{stem} ({idx}){suffix}'
+        self._next_suffix[counter_key] = idx + 1
+        return candidate
+
+
+_UNSNIFFED = object()
+# A folder touched within this window of the scan may change again without its
+# mtime moving (coarse filesystem clocks), so such scans are not trusted.
+RACY_MTIME_NS = 2_000_000_000
+# Option sets (optional folders, sniffing, rules) whose categories are kept.
+CATEGORY_CACHE_SETS = 8
+
+
+class _SnapshotEntry:
+    __slots__ = ('name', 'src', 'ext', 'ext_category', 'size', 'mtime_ns', 'sniffed', 'metadata')
+
+    def __init__(self, root: Path, name: str, size: int, mtime_ns: int):
+        self.name = name
+        self.src = root / name
+        self.ext = self.src.suffix.lower()
+        self.ext_category = _extension_category(name)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sniffed = _UNSNIFFED
+        self.metadata: dict | None = None
+
+
+class DirectorySnapshot:
+    def __init__(self, dir_path: Path):
+        self.root = Path(dir_path).resolve()
+        self.dir_mtime_ns = -1
+        self._entries: dict[str, _SnapshotEntry] = {}
+        self._ordered: list[_SnapshotEntry] | None = None
+        self._duplicates: dict[str, str] | None = None
+        self._destinations: dict[tuple[str, tuple[str, ...]], tuple[int, list[Path]]] = {}
+        self._categories: dict[tuple, dict[str, str]] = {}
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def has_changed(self) -> bool:
+        try:
+            return os.stat(self.root).st_mtime_ns != self.dir_mtime_ns
+        except OSError:
+            return True
+
+    def refresh(self, restat: bool = False) -> tuple[list[str], list[str], list[str]]:
+        # Adding, removing or renaming a file bumps the folder mtime, so an
+        # unchanged mtime means the cached listing is still current. Editing a
+        # file in place does not, so `restat` also checks each tracked file.
+        if not self.root.is_dir():
+            raise NotADirectoryError(f'Not a directory: {self.root}')
+        dir_mtime_ns = os.stat(self.root).st_mtime_ns
+        if dir_mtime_ns == self.dir_mtime_ns:
+            if not restat:
+                return [], [], []
+            changed = []
+            for entry in self._entries.values():
+                try:
+                    st = os.stat(entry.src)
+                except OSError:
+                    # Gone without touching the folder mtime; rescan it.
+                    self.dir_mtime_ns = -1
+                    return self.refresh()
+                if self._update(entry, st):
+                    changed.append(entry.name)
+            if changed:
+                self._duplicates = None
+                self._forget(changed)
+            return [], [], changed
+
+        added: list[str] = []
+        changed: list[str] = []
+        seen: set[str] = set()
+        with os.scandir(self.root) as it:
+            for dirent in it:
+                if not dirent.is_file():
+                    continue
+                st = dirent.stat()
+                name = dirent.name
+                seen.add(name)
+                entry = self._entries.get(name)
+                if entry is None:
+                    self._entries[name] = _SnapshotEntry(self.root, name, st.st_size, st.st_mtime_ns)
+                    added.append(name)
+                elif self._update(entry, st):
+                    changed.append(name)
+        removed = [name for name in self._entries if name not in seen]
+        for name in removed:
+            del self._entries[name]
+        if added or removed:
+            self._ordered = None
+            self._destinations.clear()
+        if added or removed or changed:
+            self._duplicates = None
+            self._forget(removed + changed)
+        self.dir_mtime_ns = dir_mtime_ns if time.time_ns() - dir_mtime_ns > RACY_MTIME_NS else -1
+        return added, removed, changed
+
+    def _forget(self, names: list[str]) -> None:
+        for categories in self._categories.values():
+            for name in names:
+                categories.pop(name, None)
+
+    @staticmethod
+    def _update(entry: _SnapshotEntry, st: os.stat_result) -> bool:
+        # Drops what was read from the old contents.
+        if entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+            return False
+        entry.size = st.st_size
+        entry.mtime_ns = st.st_mtime_ns
+        entry.sniffed = _UNSNIFFED
+        entry.metadata = None
         return True
-    except Exception:
-        return False
-
-
-def _normalize_destinations(moves: list[tuple[Path, Path]]) -> list[tuple[Path, Path]]:
-    src_keys = {str(src.resolve()).casefold() for src, _ in moves}
-    used_keys = set()
-    normalized: list[tuple[Path, Path]] = []
-    for src, dst in moves:
-        candidate = Path(dst)
-        while True:
-            key = str(candidate.resolve()).casefold()
-            exists_conflict = candidate.exists() and key not in src_keys
-            if key in used_keys or exists_conflict:
-                candidate = resolve_collision(candidate, used_keys)
-                continue
-            break
-        used_keys.add(str(candidate.resolve()).casefold())
-        normalized.append((Path(src), candidate))
-    return normalized
-
-
-def _build_entries_for_sort(root: Path, include_optional_categories: bool) -> tuple[list[FileEntry], dict[str, int]]:
-    files = _list_top_level_files(root)
-    counts = {category: 0 for category in CATEGORY_ORDER}
-    entries: list[FileEntry] = []
-    for src in files:
-        category = categorize(src, include_optional_categories=include_optional_categories)
-        counts[category] += 1
-        dst = root / category / src.name
-        action = 'Move' if dst != src else 'No-op'
-        entries.append(
-            FileEntry(
-                path=src,
-                name=src.name,
-                ext=src.suffix.lower(),
-                category=category,
-                proposed_path=dst,
-                status='',
-                action=action,
+
+    def _ordered_entries(self) -> list[_SnapshotEntry]:
+        if self._ordered is None:
+            self._ordered = sorted(self._entries.values(), key=lambda entry: natural_key(entry.name))
+        return self._ordered
+
+    def rows(
+        self,
+        include_optional_categories: bool = True,
+        sniff_content: bool = False,
+        rules: CategoryRules | None = None,
+    ) -> list[_PlanRow]:
+        # Categories are kept per option set and only computed for files that
+        # are new or changed since that set was last used. Rows themselves are
+        # fresh each time because plan builders fill them in.
+        key = (include_optional_categories, sniff_content, rules)
+        categories = self._categories.pop(key, None)
+        if categories is None:
+            categories = {}
+            if len(self._categories) >= CATEGORY_CACHE_SETS:
+                del self._categories[next(iter(self._categories))]
+        self._categories[key] = categories
+        ordered = self._ordered_entries()
+        pending = [entry for entry in ordered if entry.name not in categories]
+        if sniff_content or (rules is not None and rules.uses_sniff):
+            unsniffed = [entry for entry in pending if entry.sniffed is _UNSNIFFED]
+            for entry, match in zip(unsniffed, sniff_categories([entry.src for entry in unsniffed])):
+                entry.sniffed = match
+        for entry in pending:
+            categories[entry.name] = self._category(entry, include_optional_categories, sniff_content, rules)
+        return [_PlanRow(src=entry.src, name=entry.name, ext=entry.ext, category=categories[entry.name]) for entry in ordered]
+
+    @staticmethod
+    def _category(entry: _SnapshotEntry, include_optional_categories: bool, sniff_content: bool, rules: CategoryRules | None) -> str:
+        sniffed = entry.sniffed
+        if rules is not None:
+            category = rules.categorize(
+                entry.name,
+                entry.size,
+                sniff=lambda: sniffed[0] if sniffed and sniffed is not _UNSNIFFED else None,
             )
-        )
-    return entries, counts
+            return rules.gate(category, include_optional_categories)
+        category = entry.ext_category
+        if sniff_content and sniffed is not None:
+            sniffed_category, strong = sniffed
+            if strong or category == 'Other':
+                category = sniffed_category
+        return _gate_optional(category, include_optional_categories)
+
+    def folder_destinations(self, folder: str, names: tuple[str, ...]) -> list[Path]:
+        # Sources all live in the root, so where a folder's files land only
+        # depends on who is going there and what that folder already holds.
+        # Re-previews with other options reuse every folder they left alone.
+        parent = self.root / folder
+        try:
+            listing_mtime_ns = os.stat(parent).st_mtime_ns
+        except OSError:
+            listing_mtime_ns = -1
+        key = (folder, names)
+        cached = self._destinations.get(key)
+        if cached is not None and cached[0] == listing_mtime_ns:
+            return cached[1]
+        collisions = CollisionIndex()
+        destinations = []
+        for name in names:
+            dst = collisions.next_free(parent / name)
+            collisions.occupy(dst)
+            destinations.append(dst)
+        if time.time_ns() - listing_mtime_ns > RACY_MTIME_NS:
+            self._destinations[key] = (listing_mtime_ns, destinations)
+        return destinations
+
+    def metadata(self, names: list[str]) -> list[dict]:
+        entries = [self._entries[name] for name in names]
+        pending = [entry for entry in entries if entry.metadata is None]
+        for entry, metadata in zip(pending, read_metadata_many([entry.src for entry in pending])):
+            entry.metadata = metadata
+        return [entry.metadata for entry in entries]
+
+    def mtime_ns(self, name: str) -> int:
+        return self._entries[name].mtime_ns
+
+    def duplicates(self) -> dict[str, str]:
+        if self._duplicates is None:
+            found = find_duplicates([entry.src for entry in self._ordered_entries()])
+            self._duplicates = {dup.name: keeper.name for dup, keeper in found.items()}
+        return self._duplicates
+
+
+def _snapshot_for(dir_path: Path, snapshot: DirectorySnapshot | None) -> DirectorySnapshot:
+    if snapshot is not None:
+        return snapshot
+    return DirectorySnapshot(dir_path)
+
+
+def _normalize_destinations(rows: list[_PlanRow], collisions: CollisionIndex | None = None) -> None:
+    # Sources that move are vacated, so their names may be reused as destinations.
+    collisions = collisions or CollisionIndex()
+    moving = [row for row in rows if row.dst != row.src]
+    for row in moving:
+        collisions.release(row.src)
+    for row in moving:
+        row.dst = collisions.next_free(row.dst)
+        collisions.occupy(row.dst)
+
+
+def _mark_duplicates(rows: list[_PlanRow], mode: str, snapshot: DirectorySnapshot) -> None:
+    if mode not in DUPLICATE_MODES:
+        raise ValueError(f'Unknown duplicates mode: {mode}')
+    if mode == 'off':
+        return
+    duplicates = snapshot.duplicates()
+    for row in rows:
+        keeper = duplicates.get(row.name)
+        if keeper is None:
+            continue
+        if mode == 'bucket':
+            row.category = DUPLICATES_CATEGORY
+            row.status = f'duplicate of {keeper}'
+        else:
+            row.status = f'duplicate of {keeper} (skipped)'
+            row.fixed = True
+
+
+def _bucket_label(rule: str, metadata: dict, mtime_ns: int) -> str:
+    if rule == 'date':
+        # EXIF DateTimeOriginal is 'YYYY:MM:DD HH:MM:SS'; files without it
+        # fall back to their modification time.
+        taken = str(metadata.get('taken', ''))
+        if len(taken) >= 7 and taken[:4].isdigit() and taken[5:7].isdigit():
+            return f'{taken[:4]}/{taken[5:7]}'
+        return time.strftime('%Y/%m', time.localtime(mtime_ns / 1e9))
+    if rule == 'resolution':
+        long_side = max(int(metadata.get('width', 0)), int(metadata.get('height', 0)))
+        for threshold, label in RESOLUTION_BUCKETS:
+            if long_side >= threshold:
+                return label
+        return 'Unknown'
+    duration = metadata.get('duration')
+    if duration is None:
+        return 'Unknown'
+    for limit, label in DURATION_BUCKETS:
+        if duration < limit:
+            return label
+    return 'Over 20 min'
+
+
+def _row_folders(rows: list[_PlanRow], rule: str, snapshot: DirectorySnapshot) -> dict[str, str]:
+    if rule not in BUCKET_RULES:
+        raise ValueError(f'Unknown bucket rule: {rule}')
+    category = BUCKET_RULES[rule]
+    folders = {row.name: row.category for row in rows}
+    if category is None:
+        return folders
+    names = [row.name for row in rows if row.category == category and not row.fixed]
+    for name, metadata in zip(names, snapshot.metadata(names)):
+        folders[name] = f'{category}/{_bucket_label(rule, metadata, snapshot.mtime_ns(name))}'
+    return folders
+
+
+def _plan_moves(rows: list[_PlanRow]) -> list[tuple[Path, Path]]:
+    return [(row.src, row.dst) for row in rows if row.dst != row.src]
+
+
+def _category_counts(rows: list[_PlanRow], rules: CategoryRules | None = None) -> dict[str, int]:
+    order = rules.order + [DUPLICATES_CATEGORY] if rules is not None else CATEGORY_ORDER
+    counts = {category: 0 for category in order}
+    for row in rows:
+        counts[row.category] = counts.get(row.category, 0) + 1
+    return counts
 
 
 def _rename_name_for_index(
@@ -188,28 +520,43 @@ def _rename_name_for_index(
     return proposed
 
 
-def build_sort_plan(dir_path: Path, include_optional_categories: bool = True) -> OperationPlan:
-    root = Path(dir_path).resolve()
-    entries, counts = _build_entries_for_sort(root, include_optional_categories=include_optional_categories)
-    move_candidates = [(entry.path, entry.proposed_path) for entry in entries if entry.path != entry.proposed_path]
-    moves = _normalize_destinations(move_candidates)
-    dst_by_src = {str(src.resolve()).casefold(): dst for src, dst in moves}
-    for entry in entries:
-        key = str(entry.path.resolve()).casefold()
-        if key in dst_by_src:
-            entry.proposed_path = dst_by_src[key]
-            entry.action = 'Move'
-        else:
-            entry.action = 'No-op'
-    return OperationPlan(mode='sort', root_dir=root, entries=entries, moves=moves, category_counts=counts)
+def build_sort_plan(
+    dir_path: Path,
+    include_optional_categories: bool = True,
+    sniff_content: bool = False,
+    duplicates: str = 'off',
+    snapshot: DirectorySnapshot | None = None,
+    bucket_rule: str = 'category',
+    rules: CategoryRules | None = None,
+) -> OperationPlan:
+    snapshot = _snapshot_for(dir_path, snapshot)
+    root = snapshot.root
+    rows = snapshot.rows(include_optional_categories=include_optional_categories, sniff_content=sniff_content, rules=rules)
+    _mark_duplicates(rows, duplicates, snapshot)
+    folders = _row_folders(rows, bucket_rule, snapshot)
+    by_folder: dict[str, list[_PlanRow]] = {}
+    for row in rows:
+        row.action = 'No-op'
+        if not row.fixed:
+            by_folder.setdefault(folders[row.name], []).append(row)
+    for folder, members in by_folder.items():
+        destinations = snapshot.folder_destinations(folder, tuple(row.name for row in members))
+        for row, dst in zip(members, destinations):
+            row.dst = dst
+            row.action = 'Move'
+    return OperationPlan(
+        mode='sort',
+        root_dir=root,
+        entries=[row.to_entry() for row in rows],
+        moves=[(row.src, row.dst) for row in rows if row.action == 'Move'],
+        category_counts=_category_counts(rows, rules),
+    )
 
 
 def build_rename_plan(file_entries: list[FileEntry], rename_options: dict) -> OperationPlan:
     if not file_entries:
         raise ValueError('No file entries to rename.')
     root = file_entries[0].path.parent.resolve()
-    entries: list[FileEntry] = []
-    moves: list[tuple[Path, Path]] = []
     start = int(rename_options.get('start_index', 1))
     pad = int(rename_options.get('pad_width', 3))
     base = str(rename_options.get('base', 'asset'))
@@ -217,36 +564,39 @@ def build_rename_plan(file_entries: list[FileEntry], rename_options: dict) -> Op
     keep_ext = bool(rename_options.get('preserve_extension', True))
     sanitize = bool(rename_options.get('sanitize', True))
 
-    ordered = sorted(file_entries, key=lambda e: e.path.name.casefold())
-    for idx, src_entry in enumerate(ordered):
-        new_name = _rename_name_for_index(src_entry.ext, idx, base, start, pad, sep, keep_ext, sanitize)
-        dst = src_entry.path.with_name(new_name)
-        action = 'Rename' if dst != src_entry.path else 'No-op'
-        entry = FileEntry(
-            path=src_entry.path,
-            name=src_entry.name,
-            ext=src_entry.ext,
-            category=src_entry.category,
-            proposed_path=dst,
-            status='',
-            action=action,
-        )
-        entries.append(entry)
-        if action != 'No-op':
-            moves.append((src_entry.path, dst))
-
-    moves = _normalize_destinations(moves)
-    dst_by_src = {str(src.resolve()).casefold(): dst for src, dst in moves}
-    for entry in entries:
-        key = str(entry.path.resolve()).casefold()
-        if key in dst_by_src:
-            entry.proposed_path = dst_by_src[key]
-            entry.action = 'Rename'
-    return OperationPlan(mode='rename', root_dir=root, entries=entries, moves=moves, category_counts={})
-
-
-def build_sort_then_rename_plan(dir_path: Path, options: dict) -> OperationPlan:
-    sort_plan = build_sort_plan(dir_path, include_optional_categories=bool(options.get('include_optional_categories', True)))
+    rows: list[_PlanRow] = []
+    for src_entry in file_entries:
+        src = Path(src_entry.path)
+        src = src.parent.resolve() / src.name
+        rows.append(_PlanRow(src=src, name=src_entry.name, ext=src_entry.ext, category=src_entry.category))
+    rows.sort(key=lambda row: natural_key(row.src.name))
+
+    for idx, row in enumerate(rows):
+        new_name = _rename_name_for_index(row.ext, idx, base, start, pad, sep, keep_ext, sanitize)
+        row.dst = row.src.with_name(new_name)
+    _normalize_destinations(rows)
+    for row in rows:
+        row.action = 'Rename' if row.dst != row.src else 'No-op'
+    return OperationPlan(
+        mode='rename',
+        root_dir=root,
+        entries=[row.to_entry() for row in rows],
+        moves=_plan_moves(rows),
+        category_counts={},
+    )
+
+
+def build_sort_then_rename_plan(dir_path: Path, options: dict, snapshot: DirectorySnapshot | None = None) -> OperationPlan:
+    snapshot = _snapshot_for(dir_path, snapshot)
+    root = snapshot.root
+    rules = options.get('rules')
+    rows = snapshot.rows(
+        include_optional_categories=bool(options.get('include_optional_categories', True)),
+        sniff_content=bool(options.get('sniff_content', False)),
+        rules=rules,
+    )
+    _mark_duplicates(rows, str(options.get('duplicates', 'off')), snapshot)
+    folders = _row_folders(rows, str(options.get('bucket_rule', 'category')), snapshot)
     start = int(options.get('start_index', 1))
     base = str(options.get('base', 'asset'))
     pad = int(options.get('pad_width', 3))
@@ -254,85 +604,70 @@ def build_sort_then_rename_plan(dir_path: Path, options: dict) -> OperationPlan:
     keep_ext = bool(options.get('preserve_extension', True))
     sanitize = bool(options.get('sanitize', True))
 
-    entries: list[FileEntry] = []
-    moves: list[tuple[Path, Path]] = []
-    counts = dict(sort_plan.category_counts)
-    per_cat_index = {cat: start for cat in CATEGORY_ORDER}
-
-    ordered = sorted(sort_plan.entries, key=lambda e: (e.category, e.path.name.casefold()))
-    for entry in ordered:
-        moved_path = entry.proposed_path
-        idx_value = per_cat_index.get(entry.category, start)
-        per_cat_index[entry.category] = idx_value + 1
-        rename_name = _rename_name_for_index(entry.ext, idx_value - start, base, start, pad, sep, keep_ext, sanitize)
-        renamed_path = moved_path.with_name(rename_name)
-        action = 'Move+Rename'
-        if moved_path == entry.path and renamed_path == entry.path:
-            action = 'No-op'
-        elif moved_path == entry.path and renamed_path != entry.path:
-            action = 'Rename'
-        elif moved_path != entry.path and renamed_path == moved_path:
-            action = 'Move'
-        entries.append(
-            FileEntry(
-                path=entry.path,
-                name=entry.name,
-                ext=entry.ext,
-                category=entry.category,
-                proposed_path=renamed_path,
-                status='',
-                action=action,
-            )
-        )
-        if renamed_path != entry.path:
-            moves.append((entry.path, renamed_path))
-
-    moves = _normalize_destinations(moves)
-    dst_by_src = {str(src.resolve()).casefold(): dst for src, dst in moves}
-    for entry in entries:
-        key = str(entry.path.resolve()).casefold()
-        if key in dst_by_src:
-            dst = dst_by_src[key]
-            if dst.parent != entry.path.parent and dst.name != entry.path.name:
-                entry.action = 'Move+Rename'
-            elif dst.parent != entry.path.parent:
-                entry.action = 'Move'
-            elif dst.name != entry.path.name:
-                entry.action = 'Rename'
-            entry.proposed_path = dst
-        else:
-            entry.action = 'No-op'
+    counts = _category_counts(rows, rules)
+    per_folder_index: dict[str, int] = {}
 
-    return OperationPlan(mode='sort_rename', root_dir=Path(dir_path).resolve(), entries=entries, moves=moves, category_counts=counts)
+    rows.sort(key=lambda row: (folders[row.name], natural_key(row.name)))
+    for row in rows:
+        if row.fixed:
+            continue
+        folder = folders[row.name]
+        idx_value = per_folder_index.get(folder, start)
+        per_folder_index[folder] = idx_value + 1
+        rename_name = _rename_name_for_index(row.ext, idx_value - start, base, start, pad, sep, keep_ext, sanitize)
+        row.dst = root / folder / rename_name
+    _normalize_destinations(rows)
+
+    for row in rows:
+        dst = row.dst
+        if dst == row.src:
+            row.action = 'No-op'
+        elif dst.parent != row.src.parent and dst.name != row.name:
+            row.action = 'Move+Rename'
+        elif dst.parent != row.src.parent:
+            row.action = 'Move'
+        else:
+            row.action = 'Rename'
+
+    return OperationPlan(
+        mode='sort_rename',
+        root_dir=root,
+        entries=[row.to_entry() for row in rows],
+        moves=_plan_moves(rows),
+        category_counts=counts,
+    )
 
 
 def validate_plan(plan: OperationPlan) -> tuple[bool, list[str]]:
+    # One scandir/realpath per involved directory instead of a stat and two
+    # resolve() calls per move.
     errors: list[str] = []
-    root = plan.root_dir.resolve()
-    seen_dst: set[str] = set()
+    listings = DirListingCache(plan.root_dir)
+    seen_dst: set[tuple[str, str]] = set()
 
     for src, dst in plan.moves:
-        if not src.exists():
+        src_dir, src_name = listings.lookup(src)
+        if not listings.has_name(src_dir, src_name, src):
             errors.append(f'Missing source: {src}')
-        if not _ensure_within_root(src, root):
+        if not listings.within_root(src_dir, src_name):
             errors.append(f'Source outside root: {src}')
-        if not _ensure_within_root(dst, root):
+        dst_dir, dst_name = listings.lookup(dst)
+        if not listings.within_root(dst_dir, dst_name):
             errors.append(f'Destination outside root: {dst}')
-        key = str(dst.resolve()).casefold()
+        key = (dst_dir.resolved, dst_name.casefold())
         if key in seen_dst:
             errors.append(f'Duplicate destination: {dst}')
         seen_dst.add(key)
     return len(errors) == 0, errors
 
 
-def _tmp_path_for(src: Path) -> Path:
-    while True:
-        candidate = src.with_name(f'.__sortgoblin_tmp__{uuid.uuid4().hex}__{src.name}')
-        if not candidate.exists():
-            return candidate
-
-
-def apply_plan(plan: OperationPlan) -> list[tuple[Path, Path]]:
+def apply_plan(
+    plan: OperationPlan,
+    journal=None,
+    workers: int = 1,
+    progress=None,
+    verify_copies: bool = False,
+) -> list[tuple[Path, Path]]:
     ok, errors = validate_plan(plan)
     if not ok:
         raise RuntimeError('; '.join(errors))
@@ -340,38 +675,38 @@ def apply_plan(plan: OperationPlan) -> list[tuple[Path, Path]]:
         return []
 
     mapping = [(Path(src).resolve(), Path(dst).resolve()) for src, dst in plan.moves]
-    temp_for_src: dict[Path, Path] = {}
-    phase1_done: list[tuple[Path, Path]] = []
-    phase2_done: list[tuple[Path, Path]] = []
-
-    try:
-        for src, _dst in mapping:
-            temp = _tmp_path_for(src)
-            src.rename(temp)
-            temp_for_src[src] = temp
-            phase1_done.append((temp, src))
-
-        for src, dst in mapping:
-            temp = temp_for_src[src]
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            if dst.exists():
-                dst = resolve_collision(dst)
-            temp.rename(dst)
-            phase2_done.append((src, dst))
-    except Exception:
-        for original_src, final_dst in reversed(phase2_done):
-            temp = temp_for_src.get(original_src)
-            if temp is not None and final_dst.exists():
-                final_dst.rename(temp)
-        for temp, src in reversed(phase1_done):
-            if temp.exists():
-                temp.rename(src)
-        raise
-
-    return phase2_done
-
-
-def undo_plan(undo_mapping: list[tuple[Path, Path]]) -> list[tuple[Path, Path]]:
+    # Every planned destination is reserved up front, so a "name (n)" picked
+    # for a conflict in one group is never a name another group is about to
+    # move into.
+    collisions = CollisionIndex()
+    for _src, dst in mapping:
+        collisions.occupy(dst)
+
+    def next_free(dst: Path) -> Path:
+        collisions.occupy(dst)
+        free = collisions.next_free(dst)
+        collisions.occupy(free)
+        return free
+
+    return execute_moves(
+        mapping,
+        temp_prefix=TEMP_PREFIX,
+        on_conflict=next_free,
+        make_parents=True,
+        journal=journal,
+        workers=workers,
+        progress=progress,
+        verify_copies=verify_copies,
+    )
+
+
+def undo_plan(
+    undo_mapping: list[tuple[Path, Path]],
+    journal=None,
+    workers: int = 1,
+    progress=None,
+    verify_copies: bool = False,
+) -> list[tuple[Path, Path]]:
     if not undo_mapping:
         return []
     reverse_plan = OperationPlan(
@@ -381,4 +716,4 @@ def undo_plan(undo_mapping: list[tuple[Path, Path]]) -> list[tuple[Path, Path]]:
         moves=[(final, original) for original, final in undo_mapping],
         category_counts={},
     )
-    return apply_plan(reverse_plan)
+    return apply_plan(reverse_plan, journal=journal, workers=workers, progress=progress, verify_copies=verify_copies)
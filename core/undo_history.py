@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from .dir_listing import DirListingCache
+from .move_journal import JOURNAL_DIR
+
+
+HISTORY_FILE = 'undo_history.log'
+UNDO_DEPTH = 50
+
+
+class HistoryError(ValueError):
+    pass
+
+
+def _shared(a: str, b: str) -> int:
+    limit = min(len(a), len(b))
+    n = 0
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return n
+
+
+def _relative(prefix: str, path) -> str:
+    # Paths under root lose the root prefix; anything else stays absolute,
+    # which os.path.join() on the way back leaves as it is.
+    text = os.fspath(path)
+    return text[len(prefix):] if prefix and text.startswith(prefix) else text
+
+
+def _encode(pairs: list[tuple[str, str]]) -> list:
+    # Front coding: each path is stored as the number of leading characters it
+    # shares with the previous path of the same side, plus the rest. Sorted
+    # plans into a few folders shrink to little more than the file names.
+    out: list = []
+    prev_src = prev_dst = ''
+    for src, dst in pairs:
+        p = _shared(prev_src, src)
+        q = _shared(prev_dst, dst)
+        out.extend((p, src[p:], q, dst[q:]))
+        prev_src, prev_dst = src, dst
+    return out
+
+
+def _decode(encoded: list) -> list[tuple[str, str]]:
+    pairs = []
+    prev_src = prev_dst = ''
+    for n in range(0, len(encoded) - 3, 4):
+        p, src_tail, q, dst_tail = encoded[n:n + 4]
+        prev_src = prev_src[:p] + src_tail
+        prev_dst = prev_dst[:q] + dst_tail
+        pairs.append((prev_src, prev_dst))
+    return pairs
+
+
+def _checksum(pairs: list[tuple[str, str]]) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    for src, dst in pairs:
+        digest.update(f'{src}\0{dst}\n'.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+@dataclass
+class UndoEntry:
+    id: str
+    tool: str
+    root: str
+    created: float
+    count: int
+    checksum: str
+    encoded: list
+
+    def _texts(self) -> list[tuple[str, str]]:
+        relative = _decode(self.encoded)
+        if len(relative) != self.count or _checksum(relative) != self.checksum:
+            raise HistoryError(f'Undo record {self.id} is damaged')
+        root = self.root
+        return [(os.path.join(root, src), os.path.join(root, dst)) for src, dst in relative]
+
+    def pairs(self) -> list[tuple[Path, Path]]:
+        # (original, current) per move, in the order they were applied.
+        return [(Path(src), Path(dst)) for src, dst in self._texts()]
+
+
+def _op_record(entry: UndoEntry) -> dict:
+    return {
+        'kind': 'op',
+        'id': entry.id,
+        'tool': entry.tool,
+        'root': entry.root,
+        'created': entry.created,
+        'n': entry.count,
+        'sum': entry.checksum,
+        'pairs': entry.encoded,
+    }
+
+
+class UndoHistory:
+    # Append-only log next to the run journals, one line per committed
+    # operation. Journals are full-size and only the newest committed one is
+    # undoable; this keeps the last `depth` operations in compact form so any
+    # of them can be undone after a restart. Lines are never rewritten except
+    # when the file has grown to twice the depth.
+    def __init__(self, journal_dir: Path | None = None, depth: int = UNDO_DEPTH):
+        self.path = (Path(journal_dir) if journal_dir is not None else JOURNAL_DIR) / HISTORY_FILE
+        self.depth = max(1, int(depth))
+
+    def record(self, tool: str, root: Path | str, pairs: list[tuple[Path, Path]]) -> UndoEntry | None:
+        root = os.fspath(root or '')
+        prefix = os.path.join(root, '') if root else ''
+        relative = [(_relative(prefix, src), _relative(prefix, dst)) for src, dst in pairs]
+        if not relative:
+            return None
+        entry = UndoEntry(
+            id=uuid.uuid4().hex[:12],
+            tool=tool,
+            root=root,
+            created=time.time(),
+            count=len(relative),
+            checksum=_checksum(relative),
+            encoded=_encode(relative),
+        )
+        self._append(_op_record(entry))
+        if self._line_count() > self.depth * 2:
+            self._compact()
+        return entry
+
+    def entries(self, tool: str | None = None, root: Path | str | None = None) -> list[UndoEntry]:
+        # Newest first; undone operations are left out.
+        ops, undone = self._load()
+        root_text = os.fspath(root) if root is not None else None
+        out = []
+        for entry in reversed(ops[-self.depth:]):
+            if entry.id in undone:
+                continue
+            if tool is not None and entry.tool != tool:
+                continue
+            if root_text is not None and entry.root != root_text:
+                continue
+            out.append(entry)
+        return out
+
+    def find(self, entry_id: str, tool: str | None = None, root: Path | str | None = None) -> UndoEntry | None:
+        matches = [entry for entry in self.entries(tool, root) if entry.id.startswith(entry_id)]
+        if len(matches) > 1:
+            raise HistoryError(f'Undo id {entry_id!r} is ambiguous')
+        return matches[0] if matches else None
+
+    def verify(self, entry: UndoEntry) -> list[str]:
+        # One directory listing per folder involved instead of two stats per
+        # move. Every current path must still be there, and every original
+        # name must be free unless another move of the same run frees it.
+        try:
+            texts = entry._texts()
+        except HistoryError as exc:
+            return [str(exc)]
+        listings = DirListingCache()
+        current = {dst for _src, dst in texts}
+        problems = []
+        for src, dst in texts:
+            if not listings.exists(dst):
+                problems.append(f'Missing: {dst}')
+            elif src not in current and listings.exists(src):
+                problems.append(f'Already exists: {src}')
+        return problems
+
+    def mark_undone(self, entry: UndoEntry) -> None:
+        self._append({'kind': 'undone', 'id': entry.id})
+
+    def _append(self, record: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            fh.write(json.dumps(record, separators=(',', ':')) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _line_count(self) -> int:
+        try:
+            with open(self.path, 'rb') as fh:
+                return sum(1 for _line in fh)
+        except OSError:
+            return 0
+
+    def _load(self) -> tuple[list[UndoEntry], set[str]]:
+        ops: list[UndoEntry] = []
+        undone: set[str] = set()
+        try:
+            fh = open(self.path, 'r', encoding='utf-8')
+        except OSError:
+            return ops, undone
+        with fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                    kind = record.get('kind')
+                    if kind == 'undone':
+                        undone.add(str(record['id']))
+                    elif kind == 'op':
+                        ops.append(
+                            UndoEntry(
+                                id=str(record['id']),
+                                tool=str(record.get('tool', '')),
+                                root=str(record.get('root', '')),
+                                created=float(record.get('created', 0.0)),
+                                count=int(record['n']),
+                                checksum=str(record['sum']),
+                                encoded=list(record['pairs']),
+                            )
+                        )
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # A torn or hand-edited line only loses that operation.
+                    continue
+        return ops, undone
+
+    def _compact(self) -> None:
+        ops, undone = self._load()
+        kept = [entry for entry in ops[-self.depth:] if entry.id not in undone]
+        temp = self.path.with_name(self.path.name + '.tmp')
+        with open(temp, 'w', encoding='utf-8') as fh:
+            for entry in kept:
+                fh.write(json.dumps(_op_record(entry), separators=(',', ':')) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temp, self.path)
@@ -0,0 +1,7 @@
+from __future__ import annotations
+
+from goblintools.cli import main
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
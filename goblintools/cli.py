@@ -0,0 +1,454 @@
+from __future__ import annotations
+
+# Headless entry point. Only core engines are imported here: no tkinter,
+# no Pillow, so it runs from cron or over SSH without a display.
+
+from pathlib import Path
+import argparse
+import json
+import sys
+
+from core.category_rules import load_rules
+from core.move_journal import MoveJournal, find_interrupted, resume_journal, rollback_journal
+from core.plan_io import CHUNK_MOVES, apply_plan_file, export_plan, iter_plan_entries, read_plan_header
+from core.natural_sort import SORT_ORDERS, sort_paths
+from core.rename_goblin import (
+    FileItem,
+    analyze_sequences,
+    apply_rename,
+    generate_names,
+    iter_files,
+    plan_rename,
+    renumber_names,
+    undo_rename,
+    validate,
+    validate_mapping,
+)
+from core.rename_template import RenameTemplate, TemplateError, render_names
+from core.sort_goblin import (
+    DUPLICATE_MODES,
+    apply_plan,
+    build_sort_plan,
+    build_sort_then_rename_plan,
+    undo_plan,
+    validate_plan,
+)
+from core.undo_history import UndoHistory
+
+
+SORT_JOURNAL_TOOL = 'sort_goblin'
+SORT_UNDO_TOOL = 'sort_goblin.undo'
+RENAME_JOURNAL_TOOL = 'rename_goblin'
+RENAME_UNDO_TOOL = 'rename_goblin.undo'
+# Date and resolution buckets, image-size ordering and the image template
+# tokens need Pillow for EXIF/headers, which the CLI never loads.
+CLI_BUCKET_RULES = ('category', 'duration')
+CLI_SORT_ORDERS = tuple(order for order in SORT_ORDERS if order != 'dimensions')
+DEFAULT_WORKERS = 8
+
+
+def _emit(record: dict) -> None:
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _log(text: str) -> None:
+    print(text, file=sys.stderr, flush=True)
+
+
+def _progress(payload: dict) -> None:
+    _log(f'{payload.get("group", ".")}: {payload.get("moves", 0)} move(s) at {float(payload.get("rate", 0.0)):.0f}/s')
+
+
+def _folder(value: str) -> Path:
+    path = Path(value).expanduser().resolve()
+    if not path.is_dir():
+        raise argparse.ArgumentTypeError(f'not a directory: {value}')
+    return path
+
+
+def _add_rename_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--base', default='asset', help='Base name for renamed files')
+    parser.add_argument('--start', type=int, default=1, help='First index')
+    parser.add_argument('--pad', type=int, default=3, help='Zero-pad width')
+    parser.add_argument('--separator', default='_', help='Text between base and index')
+    parser.add_argument('--drop-ext', action='store_true', help='Do not keep file extensions')
+
+
+def _sort_plan(args):
+    rules = load_rules(args.rules) if args.rules is not None else None
+    if args.rename:
+        options = {
+            'include_optional_categories': not args.no_optional,
+            'sniff_content': args.sniff,
+            'duplicates': args.duplicates,
+            'bucket_rule': args.bucket,
+            'rules': rules,
+            'base': args.base,
+            'start_index': args.start,
+            'pad_width': args.pad,
+            'separator': args.separator,
+            'preserve_extension': not args.drop_ext,
+        }
+        return build_sort_then_rename_plan(args.folder, options)
+    return build_sort_plan(
+        args.folder,
+        include_optional_categories=not args.no_optional,
+        sniff_content=args.sniff,
+        duplicates=args.duplicates,
+        bucket_rule=args.bucket,
+        rules=rules,
+    )
+
+
+def _emit_entries(entries) -> None:
+    for entry in entries:
+        _emit(
+            {
+                'type': 'entry',
+                'src': str(entry.path),
+                'dst': str(entry.proposed_path),
+                'category': entry.category,
+                'action': entry.action,
+                'status': entry.status,
+            }
+        )
+
+
+def _journal(tool: str, root, args) -> MoveJournal:
+    # Applied runs also go into the undo history; undo runs do not.
+    history = None if tool.endswith('.undo') else UndoHistory(args.journal_dir)
+    return MoveJournal(tool, root=root, journal_dir=args.journal_dir, history=history)
+
+
+def _undo_entry(tool: str, args):
+    history = UndoHistory(args.journal_dir)
+    if args.id:
+        entry = history.find(args.id, tool, root=args.folder)
+    else:
+        found = history.entries(tool, root=args.folder)
+        entry = found[0] if found else None
+    if entry is None:
+        _log('Nothing to undo.')
+        return history, None
+    problems = history.verify(entry)
+    if problems:
+        for problem in problems:
+            _emit({'type': 'error', 'message': problem})
+        _emit({'type': 'summary', 'action': 'undo', 'moves': 0, 'errors': len(problems)})
+        return history, None
+    return history, entry
+
+
+def _run_sort(args) -> int:
+    if args.action == 'undo':
+        history, entry = _undo_entry(SORT_JOURNAL_TOOL, args)
+        if entry is None:
+            return 1
+        done = undo_plan(
+            entry.pairs(),
+            journal=_journal(SORT_UNDO_TOOL, args.folder, args),
+            workers=args.workers,
+            progress=_progress,
+        )
+        history.mark_undone(entry)
+        for src, dst in done:
+            _emit({'type': 'move', 'src': str(src), 'dst': str(dst)})
+        _emit({'type': 'summary', 'action': 'undo', 'moves': len(done)})
+        return 0
+
+    _log(f'Scanning {args.folder}...')
+    plan = _sort_plan(args)
+    ok, errors = validate_plan(plan)
+    if args.action == 'preview':
+        _emit_entries(plan.entries)
+        if args.export is not None:
+            export_plan(plan, args.export)
+            _log(f'Plan written to {args.export}')
+    for error in errors:
+        _emit({'type': 'error', 'message': error})
+    if not ok:
+        _emit({'type': 'summary', 'action': args.action, 'moves': len(plan.moves), 'errors': len(errors)})
+        return 1
+    if args.action == 'preview':
+        _emit({'type': 'summary', 'action': 'preview', 'moves': len(plan.moves), 'counts': plan.category_counts})
+        return 0
+
+    _log(f'Applying {len(plan.moves)} move(s)...')
+    done = apply_plan(
+        plan,
+        journal=_journal(SORT_JOURNAL_TOOL, plan.root_dir, args),
+        workers=args.workers,
+        progress=_progress,
+        verify_copies=args.verify,
+    )
+    for src, dst in done:
+        _emit({'type': 'move', 'src': str(src), 'dst': str(dst)})
+    _emit({'type': 'summary', 'action': 'apply', 'moves': len(done)})
+    return 0
+
+
+def _run_plan(args) -> int:
+    header = read_plan_header(args.plan)
+    if args.action == 'preview':
+        _emit_entries(iter_plan_entries(args.plan))
+        _emit({'type': 'summary', 'action': 'preview', 'moves': int(header.get('moves', 0)), 'counts': header.get('counts') or {}})
+        return 0
+
+    root = Path(header.get('root', ''))
+    _log(f'Applying {header.get("moves", 0)} move(s) into {root} in chunks of {args.chunk}...')
+    applied = apply_plan_file(
+        args.plan,
+        chunk_size=args.chunk,
+        journal_factory=lambda chunk: _journal(SORT_JOURNAL_TOOL, chunk.root_dir, args),
+        workers=args.workers,
+        progress=_progress,
+        verify_copies=args.verify,
+    )
+    _emit({'type': 'summary', 'action': 'apply', 'moves': applied})
+    return 0
+
+
+def _rename_items(args) -> list[FileItem]:
+    exts = {ext.strip().lower() if ext.strip().startswith('.') else f'.{ext.strip().lower()}' for ext in args.ext.split(',') if ext.strip()}
+    files = [p for p in iter_files(args.folder, recursive=args.recursive) if not exts or p.suffix.lower() in exts]
+    files = sort_paths(files, args.order, group_by_dir=args.recursive)
+    items = [FileItem(path=p, current_name=p.name, ext=p.suffix.lower(), proposed_name=p.name) for p in files]
+    per_directory = args.recursive and not args.continuous
+    if args.renumber:
+        report = analyze_sequences(items)
+        if args.action == 'preview':
+            _emit_sequences(report)
+        for item, name in zip(items, renumber_names(items, report)):
+            if name is not None:
+                item.proposed_name = name
+        return items
+    if args.template:
+        template = _cli_template(args)
+        names = render_names(items, template, start_index=args.start, keep_ext=not args.drop_ext, workers=args.workers, per_directory=per_directory)
+        for item, name in zip(items, names):
+            if name is not None:
+                item.proposed_name = name
+        return items
+    return generate_names(items, args.base, args.start, args.pad, args.separator, keep_ext=not args.drop_ext, per_directory=per_directory)
+
+
+def _cli_template(args) -> RenameTemplate:
+    template = RenameTemplate(args.template, args.match)
+    if template.uses_metadata:
+        raise TemplateError('{w}, {h}, {mode} and {frames} read image headers with Pillow; use Rename Goblin for those')
+    return template
+
+
+def _emit_sequences(report) -> None:
+    for seq in report.sequences:
+        _emit(
+            {
+                'type': 'sequence',
+                'folder': seq.directory,
+                'prefix': seq.prefix,
+                'ext': seq.ext,
+                'first': seq.first,
+                'last': seq.last,
+                'files': len(seq.members),
+                'width': seq.width,
+                'gaps': [list(gap) for gap in seq.gaps],
+                'duplicates': seq.duplicates,
+                'mispadded': len(seq.mispadded),
+            }
+        )
+
+
+def _emit_items(items) -> None:
+    for item in items:
+        _emit(
+            {
+                'type': 'entry',
+                'src': str(item.path),
+                'dst': str(item.path.with_name(item.proposed_name)),
+                'status': item.status,
+            }
+        )
+
+
+def _run_rename_map(args) -> int:
+    _log(f'Matching {args.map} against {args.folder}...')
+    result = validate_mapping(
+        args.map,
+        args.folder,
+        recursive=args.recursive,
+        on_chunk=_emit_items if args.action == 'preview' else None,
+    )
+    for line, old in result.unmatched_rows:
+        _emit({'type': 'unmatched', 'line': line, 'old': old})
+    if args.action != 'preview':
+        for path, proposed, status in result.invalid_rows:
+            _emit({'type': 'entry', 'src': str(path), 'dst': str(path.with_name(proposed)), 'status': status})
+    summary = {'rows': result.rows, 'matched': result.matched, 'unmatched': result.unmatched, 'moves': len(result.plan)}
+    if not result.valid:
+        _emit({'type': 'summary', 'action': args.action, **summary, 'errors': result.error_count, 'issues': result.issues})
+        return 1
+    if args.action == 'preview':
+        _emit({'type': 'summary', 'action': 'preview', **summary})
+        return 0
+
+    _log(f'Renaming {len(result.plan)} file(s)...')
+    apply_rename(
+        result.plan,
+        journal=_journal(RENAME_JOURNAL_TOOL, args.folder, args),
+        workers=args.workers,
+        progress=_progress,
+    )
+    _emit({'type': 'summary', 'action': 'apply', **summary})
+    return 0
+
+
+def _run_rename(args) -> int:
+    if args.action == 'undo':
+        history, entry = _undo_entry(RENAME_JOURNAL_TOOL, args)
+        if entry is None:
+            return 1
+        reverse = [(dst, src) for src, dst in entry.pairs()]
+        undo_rename(
+            reverse,
+            journal=_journal(RENAME_UNDO_TOOL, args.folder, args),
+            workers=args.workers,
+            progress=_progress,
+        )
+        history.mark_undone(entry)
+        for src, dst in reverse:
+            _emit({'type': 'move', 'src': str(src), 'dst': str(dst)})
+        _emit({'type': 'summary', 'action': 'undo', 'moves': len(reverse)})
+        return 0
+
+    if args.map is not None:
+        return _run_rename_map(args)
+    items = _rename_items(args)
+    report = validate(items)
+    if args.action == 'preview' or not report['valid']:
+        _emit_items(items)
+    if not report['valid']:
+        _emit({'type': 'summary', 'action': args.action, 'moves': report['change_count'], 'errors': report['error_count'], 'issues': report['issues']})
+        return 1
+    plan = plan_rename(items)
+    if args.action == 'preview':
+        _emit({'type': 'summary', 'action': 'preview', 'moves': len(plan)})
+        return 0
+
+    _log(f'Renaming {len(plan)} file(s)...')
+    apply_rename(
+        plan,
+        journal=_journal(RENAME_JOURNAL_TOOL, args.folder, args),
+        workers=args.workers,
+        progress=_progress,
+    )
+    for src, dst in plan:
+        _emit({'type': 'move', 'src': str(src), 'dst': str(dst)})
+    _emit({'type': 'summary', 'action': 'apply', 'moves': len(plan)})
+    return 0
+
+
+def _run_history(args) -> int:
+    tool = {'sort': SORT_JOURNAL_TOOL, 'rename': RENAME_JOURNAL_TOOL}.get(args.only)
+    for entry in UndoHistory(args.journal_dir).entries(tool, root=args.folder):
+        _emit(
+            {
+                'type': 'undo',
+                'id': entry.id,
+                'tool': entry.tool,
+                'root': entry.root,
+                'created': entry.created,
+                'moves': entry.count,
+            }
+        )
+    return 0
+
+
+def _run_recover(args) -> int:
+    only = {'sort': (SORT_JOURNAL_TOOL, SORT_UNDO_TOOL), 'rename': (RENAME_JOURNAL_TOOL, RENAME_UNDO_TOOL)}
+    tools = only.get(args.only) or (SORT_JOURNAL_TOOL, SORT_UNDO_TOOL, RENAME_JOURNAL_TOOL, RENAME_UNDO_TOOL)
+    states = [state for tool in tools for state in find_interrupted(tool, journal_dir=args.journal_dir)]
+    if args.folder is not None:
+        states = [state for state in states if state.root == str(args.folder)]
+    history = UndoHistory(args.journal_dir)
+    for state in states:
+        record = {'type': 'interrupted', 'journal': str(state.path), 'tool': state.tool, 'root': state.root, 'created': state.created, 'moves': len(state.moves)}
+        if args.action == 'resume':
+            mapping = resume_journal(state)
+            # Resumed runs become undoable like any other; resumed undos do not.
+            if not state.tool.endswith('.undo'):
+                history.record(state.tool, state.root, mapping)
+        elif args.action == 'rollback':
+            rollback_journal(state)
+        _emit(record)
+    _emit({'type': 'summary', 'action': args.action, 'journals': len(states)})
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='goblintools', description='Headless Sort Goblin and Rename Goblin. Plan rows stream to stdout as JSONL.')
+    tools = parser.add_subparsers(dest='tool', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('action', choices=('preview', 'apply', 'undo'))
+    common.add_argument('folder', type=_folder)
+    common.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Parallel move workers')
+    common.add_argument('--journal-dir', type=Path, default=None, help='Where run journals are kept (for undo)')
+    common.add_argument('--id', default=None, help='With undo: which operation to undo (see "history"; default: the newest)')
+
+    sort = tools.add_parser('sort', parents=[common], help='Sort top-level files into category folders')
+    sort.add_argument('--no-optional', action='store_true', help='Send Archives/Code/Audio to Other')
+    sort.add_argument('--sniff', action='store_true', help='Detect type from file contents')
+    sort.add_argument('--duplicates', choices=DUPLICATE_MODES, default='off')
+    sort.add_argument('--bucket', choices=CLI_BUCKET_RULES, default='category')
+    sort.add_argument('--rules', type=Path, default=None, help='JSON category rules file (replaces the built-in categories)')
+    sort.add_argument('--rename', action='store_true', help='Also rename files per folder (Sort + Rename)')
+    sort.add_argument('--verify', action='store_true', help='Hash-check cross-device copies')
+    sort.add_argument('--export', type=Path, default=None, help='With preview: also write the plan to a JSONL plan file')
+    _add_rename_options(sort)
+    sort.set_defaults(run=_run_sort)
+
+    rename = tools.add_parser('rename', parents=[common], help='Batch rename top-level files')
+    rename.add_argument('--ext', default='', help='Comma-separated extensions to include (default: all)')
+    rename.add_argument('--recursive', action='store_true', help='Include files in subfolders (numbering restarts per folder)')
+    rename.add_argument('--continuous', action='store_true', help='With --recursive: number across folders instead')
+    rename.add_argument('--map', type=Path, default=None, help='CSV/JSON/JSONL file of old,new names (old may be a path relative to the folder)')
+    rename.add_argument('--order', choices=CLI_SORT_ORDERS, default='name', help='Numbering order (name sorts digit runs numerically)')
+    rename.add_argument('--template', default=None, help='Name template, e.g. "{parent}_{n:04}" (replaces --base/--pad/--separator)')
+    rename.add_argument('--match', default=None, help='Regex run on each stem; groups are {1}, {2}, ...; non-matching files keep their name')
+    rename.add_argument('--renumber', action='store_true', help='Close gaps, split duplicates and fix padding in numbered sequences (e.g. walk_01.png...)')
+    _add_rename_options(rename)
+    rename.set_defaults(run=_run_rename)
+
+    plan = tools.add_parser('plan', help='Review or apply an exported plan file in bounded-memory chunks')
+    plan.add_argument('action', choices=('preview', 'apply'))
+    plan.add_argument('plan', type=Path)
+    plan.add_argument('--chunk', type=int, default=CHUNK_MOVES, help='Moves per applied chunk')
+    plan.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Parallel move workers')
+    plan.add_argument('--journal-dir', type=Path, default=None, help='Where run journals are kept')
+    plan.add_argument('--verify', action='store_true', help='Hash-check cross-device copies')
+    plan.set_defaults(run=_run_plan)
+
+    history = tools.add_parser('history', help='List operations that can still be undone, newest first')
+    history.add_argument('folder', type=_folder, nargs='?', default=None)
+    history.add_argument('--only', choices=('sort', 'rename'), default=None)
+    history.add_argument('--journal-dir', type=Path, default=None, help='Where run journals are kept')
+    history.set_defaults(run=_run_history)
+
+    recover = tools.add_parser('recover', help='List, resume or roll back runs that were interrupted mid-apply')
+    recover.add_argument('action', choices=('list', 'resume', 'rollback'))
+    recover.add_argument('folder', type=_folder, nargs='?', default=None)
+    recover.add_argument('--only', choices=('sort', 'rename'), default=None)
+    recover.add_argument('--journal-dir', type=Path, default=None, help='Where run journals are kept')
+    recover.set_defaults(run=_run_recover)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return int(args.run(args))
+    except (OSError, RuntimeError, ValueError) as exc:
+        _log(f'error: {exc}')
+        return 1
+    finally:
+        sys.stdout.flush()
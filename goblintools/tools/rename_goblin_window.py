@@ -1,18 +1,36 @@
 ﻿from __future__ import annotations
 
 from pathlib import Path
+import os
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
+from core.move_journal import (
+    JournalState,
+    MoveJournal,
+    find_interrupted,
+    resume_journal,
+    rollback_journal,
+)
 from core.rename_goblin import (
     FileItem,
+    RenameValidator,
+    analyze_sequences,
     apply_rename,
+    compile_find,
+    find_replace,
     generate_names,
+    iter_files,
     plan_rename,
+    renumber_names,
     sanitize_name,
     undo_rename,
-    validate,
+    validate_mapping,
 )
+from core.natural_sort import SortKeyCache, sort_paths
+from core.rename_template import RenameTemplate, TemplateError, render_names
+from core.undo_history import UndoEntry, UndoHistory
 from goblintools.common import (
     BackgroundJobRunner,
     SECTION_GAP,
@@ -30,6 +48,18 @@ from goblintools.common import (
 )
 
 
+JOURNAL_TOOL = 'rename_goblin'
+JOURNAL_UNDO_TOOL = 'rename_goblin.undo'
+TEMPLATE_WORKERS = 8
+APPLY_WORKERS = 8
+TREE_INSERT_CHUNK = 1000
+FIND_PREVIEW_DELAY_MS = 250
+ORDER_CHOICES = {
+    'name': 'Order by name (natural)',
+    'mtime': 'Order by modified time',
+    'size': 'Order by file size',
+    'dimensions': 'Order by image size',
+}
 IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tga', '.dds', '.svg'}
 
 
@@ -52,24 +82,43 @@ class SortGoblinWindow:
         self.shortcuts = ShortcutManager()
 
         self.items: list[FileItem] = []
+        self._validator: RenameValidator | None = None
         self._tree_to_index: dict[str, int] = {}
-        self._last_undo_plan: list[tuple[Path, Path]] = []
+        self._tree_items: list[FileItem] | None = None
+        self._tree_rows: list[tuple[tuple[str, str, str], tuple[str, ...]]] = []
+        self._insert_job = None
+        self._find_preview_job = None
+        self._find_token = 0
+        self._sort_keys = SortKeyCache()
+        self._load_root: str | None = None
+        self._history = UndoHistory()
+        self._undo_entries: list[UndoEntry] = []
         self._pref_key = 'rename_goblin.settings'
         prefs = self._load_settings()
         self._hydrating_prefs = True
 
         self.images_only_var = tk.BooleanVar(value=bool(prefs.get('images_only', False)))
+        self.recursive_var = tk.BooleanVar(value=bool(prefs.get('recursive', False)))
+        self.per_directory_var = tk.BooleanVar(value=bool(prefs.get('per_directory', True)))
         self.ext_filter_var = tk.StringVar(value=str(prefs.get('ext_filter', '')))
+        order = str(prefs.get('order', 'name'))
+        self.order_var = tk.StringVar(value=ORDER_CHOICES.get(order, ORDER_CHOICES['name']))
         self.loaded_count_var = tk.StringVar(value='0 files loaded')
         self.base_var = tk.StringVar(value=str(prefs.get('base', 'asset')))
         self.start_var = tk.IntVar(value=int(prefs.get('start', 1)))
         self.pad_var = tk.IntVar(value=int(prefs.get('pad', 3)))
         self.separator_var = tk.StringVar(value=str(prefs.get('separator', '_')))
+        self.template_var = tk.StringVar(value=str(prefs.get('template', '')))
+        self.match_var = tk.StringVar(value=str(prefs.get('match', '')))
         self.keep_ext_var = tk.BooleanVar(value=bool(prefs.get('keep_ext', True)))
         self.sanitize_var = tk.BooleanVar(value=bool(prefs.get('sanitize', True)))
         self.find_var = tk.StringVar(value=str(prefs.get('find', '')))
         self.replace_var = tk.StringVar(value=str(prefs.get('replace', '')))
+        self.find_regex_var = tk.BooleanVar(value=bool(prefs.get('find_regex', False)))
+        self.find_case_var = tk.BooleanVar(value=bool(prefs.get('find_case', True)))
+        self.find_preview_var = tk.StringVar(value='')
         self.issue_summary_var = tk.StringVar(value='issues: none')
+        self.undo_choice_var = tk.StringVar(value='')
 
         self._build_ui()
         self._bind_pref_traces()
@@ -84,6 +133,93 @@ class SortGoblinWindow:
         self.shortcuts.register_help('Ctrl+A (in editor)', 'Select all text')
         self._hydrating_prefs = False
         self._update_apply_state({'valid': False, 'error_count': 0, 'change_count': 0, 'issues': {}})
+        self.root.after(0, self._restore_session_state)
+
+    def _restore_session_state(self):
+        if self._busy:
+            return
+        self._set_busy(True, 'Goblin checking journal...')
+        self.jobs.submit(self._journal_scan_worker, self._on_journal_scan_done)
+
+    def _journal_scan_worker(self, progress=None):
+        interrupted = find_interrupted(JOURNAL_TOOL) + find_interrupted(JOURNAL_UNDO_TOOL)
+        return {'interrupted': interrupted, 'history': self._history.entries(JOURNAL_TOOL)}
+
+    def _on_journal_scan_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                self.set_status('Journal check failed')
+                return
+            payload = result.value or {}
+            self._set_undo_entries(payload.get('history'))
+            interrupted = list(payload.get('interrupted') or [])
+        finally:
+            self._set_busy(False)
+            self._update_undo_state()
+        if interrupted:
+            self._prompt_recovery(interrupted[0])
+
+    def _prompt_recovery(self, state: JournalState):
+        answer = messagebox.askyesnocancel(
+            'Rename Goblin',
+            f'An interrupted rename ({len(state.moves)} file(s)) was found in:\n{state.root}\n\n'
+            'Yes: resume it\nNo: roll it back\nCancel: decide next time',
+        )
+        if answer is None:
+            return
+        self._set_busy(True, 'Goblin resuming interrupted rename...' if answer else 'Goblin rolling back interrupted rename...')
+        self.jobs.submit(self._recover_worker, self._on_recover_done, state, bool(answer))
+
+    def _recover_worker(self, state: JournalState, resume: bool, progress=None):
+        if resume:
+            mapping = resume_journal(state)
+            if state.tool == JOURNAL_TOOL:
+                self._history.record(state.tool, state.root, mapping)
+        else:
+            rollback_journal(state)
+        return {'resumed': resume, 'history': self._history.entries(JOURNAL_TOOL)}
+
+    def _on_recover_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                messagebox.showerror('Rename Goblin', f'Recovery failed.\n{result.error}')
+                self.set_status('Recovery failed')
+                return
+            payload = result.value or {}
+            self._set_undo_entries(payload.get('history'))
+            self.set_status('Interrupted rename resumed' if payload.get('resumed') else 'Interrupted rename rolled back')
+            self.show_toast('Recovery complete')
+        finally:
+            self._set_busy(False)
+            self._update_undo_state()
+
+    def _set_undo_entries(self, entries: list[UndoEntry] | None):
+        # Newest first; Undo takes the one picked, which defaults to the newest.
+        self._undo_entries = list(entries or [])
+        labels = [self._undo_label(entry) for entry in self._undo_entries]
+        self.undo_combo.configure(values=labels)
+        self.undo_choice_var.set(labels[0] if labels else '')
+        self._update_undo_state()
+
+    def _undo_label(self, entry: UndoEntry) -> str:
+        when = time.strftime('%m-%d %H:%M', time.localtime(entry.created))
+        return f'{when}  {entry.count} rename(s)  {Path(entry.root).name or entry.root}'
+
+    def _selected_undo_entry(self) -> UndoEntry | None:
+        try:
+            idx = list(self.undo_combo.cget('values')).index(self.undo_choice_var.get())
+        except ValueError:
+            idx = 0
+        return self._undo_entries[idx] if idx < len(self._undo_entries) else None
+
+    def _update_undo_state(self):
+        can_undo = bool(self._undo_entries) and not self._busy
+        self.undo_btn.configure(state=('normal' if can_undo else 'disabled'))
+        self.undo_combo.configure(state=('readonly' if can_undo else 'disabled'))
 
     def _load_settings(self) -> dict:
         payload = get_pref(self._pref_key, {})
@@ -95,15 +231,22 @@ class SortGoblinWindow:
         try:
             payload = {
                 'images_only': bool(self.images_only_var.get()),
+                'recursive': bool(self.recursive_var.get()),
+                'per_directory': bool(self.per_directory_var.get()),
                 'ext_filter': self.ext_filter_var.get(),
+                'order': self._sort_order(),
                 'base': self.base_var.get(),
                 'start': int(self.start_var.get()),
                 'pad': int(self.pad_var.get()),
                 'separator': self.separator_var.get(),
+                'template': self.template_var.get(),
+                'match': self.match_var.get(),
                 'keep_ext': bool(self.keep_ext_var.get()),
                 'sanitize': bool(self.sanitize_var.get()),
                 'find': self.find_var.get(),
                 'replace': self.replace_var.get(),
+                'find_regex': bool(self.find_regex_var.get()),
+                'find_case': bool(self.find_case_var.get()),
             }
             set_pref(self._pref_key, payload)
         except Exception:
@@ -112,17 +255,26 @@ class SortGoblinWindow:
     def _bind_pref_traces(self):
         for var in (
             self.images_only_var,
+            self.recursive_var,
+            self.per_directory_var,
             self.ext_filter_var,
+            self.order_var,
             self.base_var,
             self.start_var,
             self.pad_var,
             self.separator_var,
+            self.template_var,
+            self.match_var,
             self.keep_ext_var,
             self.sanitize_var,
             self.find_var,
             self.replace_var,
+            self.find_regex_var,
+            self.find_case_var,
         ):
             var.trace_add('write', lambda *_args: self._save_settings())
+        for var in (self.find_var, self.replace_var, self.find_regex_var, self.find_case_var):
+            var.trace_add('write', lambda *_args: self._schedule_find_preview())
 
     def _build_ui(self):
         self.shell = ToolShell(
@@ -139,7 +291,7 @@ class SortGoblinWindow:
                 {'id': 'select_files', 'label': 'Select Files', 'icon': '>', 'command': self.select_files},
                 {'id': 'reset_all', 'label': 'Reset All', 'icon': '>', 'command': self.reset_all},
                 {'id': 'apply', 'label': 'Apply Rename', 'icon': '>', 'command': self.on_apply},
-                {'id': 'undo', 'label': 'Undo Last Rename', 'icon': '>', 'command': self.on_undo},
+                {'id': 'undo', 'label': 'Undo Rename', 'icon': '>', 'command': self.on_undo},
             ]
         )
 
@@ -229,7 +381,9 @@ class SortGoblinWindow:
         self.select_files_btn = ttk.Button(input_surface, text='Select Files', style='Ghost.TButton', command=self.select_files)
         self.select_files_btn.grid(row=0, column=1, sticky='ew', padx=(4, 0))
         self.images_only_check = ttk.Checkbutton(input_surface, text='Images only', variable=self.images_only_var)
-        self.images_only_check.grid(row=1, column=0, columnspan=2, sticky='w', pady=(8, 0))
+        self.images_only_check.grid(row=1, column=0, sticky='w', pady=(8, 0))
+        self.recursive_check = ttk.Checkbutton(input_surface, text='Include subfolders', variable=self.recursive_var)
+        self.recursive_check.grid(row=1, column=1, sticky='w', pady=(8, 0))
         tk.Label(input_surface, text='Extensions', bg=self.colors['surface'], fg=self.colors['text'], font=('Segoe UI', 9)).grid(
             row=2, column=0, sticky='w', pady=(8, 0)
         )
@@ -242,8 +396,13 @@ class SortGoblinWindow:
             fg=self.colors['muted'],
             font=('Segoe UI', 8),
         ).grid(row=3, column=0, columnspan=2, sticky='w', pady=(4, 0))
+        self.order_combo = ttk.Combobox(input_surface, textvariable=self.order_var, values=list(ORDER_CHOICES.values()), state='readonly')
+        self.order_combo.grid(row=4, column=0, columnspan=2, sticky='ew', pady=(8, 0))
+        self.order_combo.bind('<<ComboboxSelected>>', lambda _e: self.on_reorder())
+        self.load_map_btn = ttk.Button(input_surface, text='Load Rename Map', style='Ghost.TButton', command=self.select_mapping)
+        self.load_map_btn.grid(row=5, column=0, columnspan=2, sticky='ew', pady=(8, 0))
         tk.Label(input_surface, textvariable=self.loaded_count_var, bg=self.colors['surface'], fg=self.colors['muted'], font=('Segoe UI', 9)).grid(
-            row=4, column=0, columnspan=2, sticky='w', pady=(6, 0)
+            row=6, column=0, columnspan=2, sticky='w', pady=(6, 0)
         )
 
         ttk.Label(inspector, text='Generate', style='Section.TLabel').grid(row=4, column=0, sticky='w')
@@ -293,12 +452,32 @@ class SortGoblinWindow:
         self.separator_entry = ttk.Entry(gen_surface, textvariable=self.separator_var, width=10)
         self.separator_entry.grid(row=3, column=1, sticky='w', padx=(8, 0), pady=(8, 0))
 
+        tk.Label(gen_surface, text='Template', bg=self.colors['surface'], fg=self.colors['text'], font=('Segoe UI', 9)).grid(row=4, column=0, sticky='w', pady=(8, 0))
+        self.template_entry = ttk.Entry(gen_surface, textvariable=self.template_var)
+        self.template_entry.grid(row=4, column=1, sticky='ew', padx=(8, 0), pady=(8, 0))
+        tk.Label(gen_surface, text='Match', bg=self.colors['surface'], fg=self.colors['text'], font=('Segoe UI', 9)).grid(row=5, column=0, sticky='w', pady=(8, 0))
+        self.match_entry = ttk.Entry(gen_surface, textvariable=self.match_var)
+        self.match_entry.grid(row=5, column=1, sticky='ew', padx=(8, 0), pady=(8, 0))
+        tk.Label(
+            gen_surface,
+            text='ex: {parent}_{n:04}, {mtime:%Y%m%d}_{stem}, {w}x{h}_{frames}f, {mode}; Match regex groups as {1}',
+            bg=self.colors['surface'],
+            fg=self.colors['muted'],
+            font=('Segoe UI', 8),
+            justify=tk.LEFT,
+            wraplength=300,
+        ).grid(row=6, column=0, columnspan=2, sticky='w', pady=(4, 0))
+
         self.keep_ext_check = ttk.Checkbutton(gen_surface, text='Preserve extension', variable=self.keep_ext_var)
-        self.keep_ext_check.grid(row=4, column=0, columnspan=2, sticky='w', pady=(8, 0))
+        self.keep_ext_check.grid(row=7, column=0, columnspan=2, sticky='w', pady=(8, 0))
         self.sanitize_check = ttk.Checkbutton(gen_surface, text='Sanitize names', variable=self.sanitize_var)
-        self.sanitize_check.grid(row=5, column=0, columnspan=2, sticky='w', pady=(4, 0))
+        self.sanitize_check.grid(row=8, column=0, columnspan=2, sticky='w', pady=(4, 0))
+        self.per_directory_check = ttk.Checkbutton(gen_surface, text='Restart numbering in each folder', variable=self.per_directory_var)
+        self.per_directory_check.grid(row=9, column=0, columnspan=2, sticky='w', pady=(4, 0))
         self.generate_btn = ttk.Button(gen_surface, text='Preview Generate', style='Ghost.TButton', command=self.on_generate)
-        self.generate_btn.grid(row=6, column=0, columnspan=2, sticky='ew', pady=(10, 0))
+        self.generate_btn.grid(row=10, column=0, columnspan=2, sticky='ew', pady=(10, 0))
+        self.sequences_btn = ttk.Button(gen_surface, text='Fix Number Sequences', style='Ghost.TButton', command=self.on_fix_sequences)
+        self.sequences_btn.grid(row=11, column=0, columnspan=2, sticky='ew', pady=(8, 0))
 
         ttk.Label(inspector, text='Find/Replace', style='Section.TLabel').grid(row=6, column=0, sticky='w')
         fr_surface = ttk.Frame(inspector, style='Surface.TFrame', padding=SURFACE_PAD)
@@ -310,8 +489,17 @@ class SortGoblinWindow:
         tk.Label(fr_surface, text='Replace', bg=self.colors['surface'], fg=self.colors['text'], font=('Segoe UI', 9)).grid(row=1, column=0, sticky='w', pady=(8, 0))
         self.replace_entry = ttk.Entry(fr_surface, textvariable=self.replace_var)
         self.replace_entry.grid(row=1, column=1, sticky='ew', padx=(8, 0), pady=(8, 0))
+        find_opts = ttk.Frame(fr_surface, style='Surface.TFrame')
+        find_opts.grid(row=2, column=0, columnspan=2, sticky='w', pady=(8, 0))
+        self.find_regex_check = ttk.Checkbutton(find_opts, text='Regex', variable=self.find_regex_var)
+        self.find_regex_check.pack(side=tk.LEFT)
+        self.find_case_check = ttk.Checkbutton(find_opts, text='Match case', variable=self.find_case_var)
+        self.find_case_check.pack(side=tk.LEFT, padx=(12, 0))
+        tk.Label(fr_surface, textvariable=self.find_preview_var, bg=self.colors['surface'], fg=self.colors['muted'], font=('Segoe UI', 8), justify=tk.LEFT, wraplength=300).grid(
+            row=3, column=0, columnspan=2, sticky='w', pady=(4, 0)
+        )
         self.find_replace_btn = ttk.Button(fr_surface, text='Apply Find/Replace', style='Ghost.TButton', command=self.on_find_replace)
-        self.find_replace_btn.grid(row=2, column=0, columnspan=2, sticky='ew', pady=(10, 0))
+        self.find_replace_btn.grid(row=4, column=0, columnspan=2, sticky='ew', pady=(10, 0))
 
         ttk.Label(inspector, text='Apply', style='Section.TLabel').grid(row=8, column=0, sticky='w')
         apply_surface = ttk.Frame(inspector, style='Surface.TFrame', padding=SURFACE_PAD)
@@ -320,22 +508,26 @@ class SortGoblinWindow:
 
         self.apply_btn = ShinyButton(apply_surface, text='Apply Rename', command=self.on_apply, width=260, height=40, colors=self.colors)
         self.apply_btn.grid(row=0, column=0, sticky='ew')
-        self.undo_btn = ttk.Button(apply_surface, text='Undo Last Rename', style='Ghost.TButton', command=self.on_undo)
-        self.undo_btn.grid(row=1, column=0, sticky='ew', pady=(8, 0))
+        self.undo_combo = ttk.Combobox(apply_surface, textvariable=self.undo_choice_var, values=[], state='readonly')
+        self.undo_combo.grid(row=1, column=0, sticky='ew', pady=(8, 0))
+        self.undo_btn = ttk.Button(apply_surface, text='Undo Rename', style='Ghost.TButton', command=self.on_undo)
+        self.undo_btn.grid(row=2, column=0, sticky='ew', pady=(8, 0))
         self.reset_selected_btn = ttk.Button(apply_surface, text='Reset Selected', style='Ghost.TButton', command=self.reset_selected)
-        self.reset_selected_btn.grid(row=2, column=0, sticky='ew', pady=(8, 0))
+        self.reset_selected_btn.grid(row=3, column=0, sticky='ew', pady=(8, 0))
         self.reset_all_btn = ttk.Button(apply_surface, text='Reset All', style='Ghost.TButton', command=self.reset_all)
-        self.reset_all_btn.grid(row=3, column=0, sticky='ew', pady=(8, 0))
+        self.reset_all_btn.grid(row=4, column=0, sticky='ew', pady=(8, 0))
         self.copy_invalid_btn = ttk.Button(apply_surface, text='Copy Invalid Rows', style='Ghost.TButton', command=self.copy_invalid_rows)
-        self.copy_invalid_btn.grid(row=4, column=0, sticky='ew', pady=(8, 0))
+        self.copy_invalid_btn.grid(row=5, column=0, sticky='ew', pady=(8, 0))
         tk.Label(apply_surface, textvariable=self.issue_summary_var, bg=self.colors['surface'], fg=self.colors['muted'], font=('Segoe UI', 9), justify=tk.LEFT, wraplength=300).grid(
-            row=5, column=0, sticky='w', pady=(8, 0)
+            row=6, column=0, sticky='w', pady=(8, 0)
         )
 
         for btn in (
             self.select_folder_btn,
             self.select_files_btn,
+            self.load_map_btn,
             self.generate_btn,
+            self.sequences_btn,
             self.find_replace_btn,
             self.undo_btn,
             self.reset_selected_btn,
@@ -348,17 +540,26 @@ class SortGoblinWindow:
         self._busy_controls = [
             self.select_folder_btn,
             self.select_files_btn,
+            self.load_map_btn,
             self.images_only_check,
+            self.recursive_check,
+            self.per_directory_check,
             self.ext_filter_entry,
+            self.order_combo,
             self.base_entry,
             self.start_spin,
             self.pad_spin,
             self.separator_entry,
+            self.template_entry,
+            self.match_entry,
             self.keep_ext_check,
             self.sanitize_check,
             self.generate_btn,
+            self.sequences_btn,
             self.find_entry,
             self.replace_entry,
+            self.find_regex_check,
+            self.find_case_check,
             self.find_replace_btn,
             self.undo_btn,
             self.reset_selected_btn,
@@ -459,8 +660,15 @@ class SortGoblinWindow:
         ext_filter = self._parse_extension_filter(self.ext_filter_var.get())
         files = [p.absolute() for p in paths if p.is_file()]
         files = [p for p in files if self._matches_filters(p, bool(self.images_only_var.get()), ext_filter)]
-        files.sort(key=lambda p: p.name.casefold())
-        return files
+        self._sort_keys.clear()
+        return sort_paths(files, self._sort_order(), cache=self._sort_keys)
+
+    def _sort_order(self) -> str:
+        label = self.order_var.get()
+        for key, value in ORDER_CHOICES.items():
+            if value == label:
+                return key
+        return 'name'
 
     def _parse_extension_filter(self, value: str) -> set[str]:
         out = set()
@@ -489,14 +697,52 @@ class SortGoblinWindow:
             return
         ext_filter = self._parse_extension_filter(self.ext_filter_var.get())
         self._set_busy(True, 'Goblin scanning folder...')
-        self.jobs.submit(self._scan_folder_worker, self._on_scan_done, folder, bool(self.images_only_var.get()), ext_filter)
+        self.jobs.submit(
+            self._scan_folder_worker,
+            self._on_scan_done,
+            folder,
+            bool(self.images_only_var.get()),
+            ext_filter,
+            self._sort_order(),
+            bool(self.recursive_var.get()),
+        )
+
+    def _scan_folder_worker(self, folder, images_only, ext_filter, order='name', recursive=False, progress=None):
+        root = Path(folder).absolute()
+        ext_filter = set(ext_filter or [])
+        entries = [p for p in iter_files(root, recursive=recursive) if self._matches_filters(p, images_only, ext_filter)]
+        # Keys are cached per path, so later reorders of this list only
+        # compute the order they switch to.
+        self._sort_keys.clear()
+        return {'root': root, 'paths': sort_paths(entries, order, cache=self._sort_keys, group_by_dir=recursive)}
 
-    def _scan_folder_worker(self, folder, images_only, ext_filter, progress=None):
-        root = Path(folder)
-        entries = [p for p in root.iterdir() if p.is_file()]
-        entries = [p for p in entries if self._matches_filters(p, images_only, set(ext_filter or []))]
-        entries.sort(key=lambda p: p.name.casefold())
-        return entries
+    def on_reorder(self):
+        if self._busy or not self.items:
+            return
+        self._set_busy(True, 'Goblin reordering files...')
+        self.jobs.submit(self._reorder_worker, self._on_reorder_done, list(self.items), self._sort_order())
+
+    def _reorder_worker(self, items, order, progress=None):
+        by_path = {os.fspath(item.path): item for item in items}
+        ordered = sort_paths([item.path for item in items], order, cache=self._sort_keys, group_by_dir=self._load_root is not None)
+        return {'items': items, 'ordered': [by_path[os.fspath(path)] for path in ordered]}
+
+    def _on_reorder_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                messagebox.showerror('Sort Goblin', str(result.error))
+                self.set_status('Reorder failed')
+                return
+            payload = result.value or {}
+            if payload.get('items') != self.items:
+                return
+            self.items = payload.get('ordered') or []
+            self._revalidate_and_refresh()
+            self.show_toast('Order updated; Generate to renumber')
+        finally:
+            self._set_busy(False)
 
     def _on_scan_done(self, result):
         try:
@@ -506,7 +752,8 @@ class SortGoblinWindow:
                 messagebox.showerror('Sort Goblin', str(result.error))
                 self.set_status('Failed to scan folder')
                 return
-            self.load_paths(result.value or [])
+            payload = result.value or {}
+            self.load_paths(payload.get('paths') or [], root=payload.get('root'))
         finally:
             self._set_busy(False)
 
@@ -519,7 +766,51 @@ class SortGoblinWindow:
         paths = [Path(p) for p in selected]
         self.load_paths(self._filter_paths(paths))
 
-    def load_paths(self, paths: list[Path]):
+    def select_mapping(self):
+        if self._busy:
+            return
+        mapping = filedialog.askopenfilename(
+            title='Select Rename Map',
+            filetypes=[('Rename maps', '*.csv *.tsv *.json *.jsonl'), ('All files', '*.*')],
+        )
+        if not mapping:
+            return
+        folder = filedialog.askdirectory(title='Folder the map refers to')
+        if not folder:
+            return
+        self._set_busy(True, 'Goblin matching rename map...')
+        self.jobs.submit(self._mapping_worker, self._on_mapping_done, mapping, folder, bool(self.recursive_var.get()))
+
+    def _mapping_worker(self, mapping, folder, recursive, progress=None):
+        root = Path(folder).absolute()
+        items: list[FileItem] = []
+        result = validate_mapping(Path(mapping), root, recursive=recursive, on_chunk=items.extend)
+        return {'root': root, 'items': items, 'result': result}
+
+    def _on_mapping_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                messagebox.showerror('Sort Goblin', f'Could not read rename map.\n{result.error}')
+                self.set_status('Rename map failed')
+                return
+            payload = result.value or {}
+            mapping = payload['result']
+            self._load_root = os.fspath(payload['root'])
+            self.items = payload.get('items') or []
+            self._revalidate_and_refresh()
+            if mapping.unmatched:
+                lines = ', '.join(str(line) for line, _old in mapping.unmatched_rows[:10])
+                more = ', ...' if mapping.unmatched > 10 else ''
+                messagebox.showwarning('Sort Goblin', f'{mapping.unmatched} of {mapping.rows} row(s) matched no file (lines {lines}{more}).')
+            self.show_toast(f'Matched {mapping.matched} of {mapping.rows} row(s)')
+        finally:
+            self._set_busy(False)
+
+    def load_paths(self, paths: list[Path], root: Path | None = None):
+        # root is set for folder scans so nested rows can show their subpath.
+        self._load_root = os.fspath(root) if root is not None else None
         unique_paths = []
         seen = set()
         for path in paths:
@@ -539,7 +830,6 @@ class SortGoblinWindow:
             )
             for path in unique_paths
         ]
-        self._last_undo_plan = []
         self._revalidate_and_refresh()
         self.show_toast(f'Loaded {len(self.items)} file(s)')
 
@@ -549,6 +839,25 @@ class SortGoblinWindow:
         if not self.items:
             messagebox.showinfo('Sort Goblin', 'Load files first.')
             return
+        template_text = self.template_var.get().strip()
+        if template_text:
+            try:
+                template = RenameTemplate(template_text, self.match_var.get() or None)
+            except TemplateError as exc:
+                messagebox.showerror('Sort Goblin', f'Invalid template.\n{exc}')
+                return
+            self._set_busy(True, 'Goblin rendering names...')
+            self.jobs.submit(
+                self._template_worker,
+                self._on_names_done,
+                list(self.items),
+                template,
+                int(self.start_var.get()),
+                bool(self.keep_ext_var.get()),
+                bool(self.sanitize_var.get()),
+                bool(self.per_directory_var.get()),
+            )
+            return
         try:
             generate_names(
                 self.items,
@@ -557,6 +866,7 @@ class SortGoblinWindow:
                 pad_width=int(self.pad_var.get()),
                 separator=self.separator_var.get(),
                 keep_ext=bool(self.keep_ext_var.get()),
+                per_directory=bool(self.per_directory_var.get()),
             )
             if self.sanitize_var.get():
                 for item in self.items:
@@ -565,57 +875,218 @@ class SortGoblinWindow:
         except Exception as exc:
             messagebox.showerror('Sort Goblin', f'Failed to generate names.\n{exc}')
 
-    def on_find_replace(self):
+    def _template_worker(self, items, template, start_index, keep_ext, sanitize, per_directory=False, progress=None):
+        names = render_names(items, template, start_index=start_index, keep_ext=keep_ext, workers=TEMPLATE_WORKERS, per_directory=per_directory)
+        if sanitize:
+            names = [sanitize_name(name) if name is not None else None for name in names]
+        return {'items': items, 'names': names}
+
+    def on_fix_sequences(self):
         if self._busy:
             return
         if not self.items:
             messagebox.showinfo('Sort Goblin', 'Load files first.')
             return
+        self._set_busy(True, 'Goblin checking number sequences...')
+        self.jobs.submit(self._sequences_worker, self._on_names_done, list(self.items))
+
+    def _sequences_worker(self, items, progress=None):
+        # Current names are analysed, so this also repairs files that were
+        # already renamed; the new names only take effect on Apply.
+        report = analyze_sequences(items)
+        names = renumber_names(items, report)
+        summary = (
+            f'{len(report.sequences)} sequence(s): {report.gap_count} gap(s), '
+            f'{report.duplicate_count} duplicate number(s), {report.mispadded_count} padding mismatch(es)'
+        )
+        return {'items': items, 'names': names, 'summary': summary}
+
+    def _find_options(self):
+        # (needle, replacement, regex, case), or None with the reason shown
+        # under the fields when there is nothing valid to search for.
         needle = self.find_var.get()
-        replacement = self.replace_var.get()
         if not needle:
+            self.find_preview_var.set('')
+            return None
+        regex = bool(self.find_regex_var.get())
+        case = bool(self.find_case_var.get())
+        try:
+            compile_find(needle, regex, case)
+        except ValueError as exc:
+            self.find_preview_var.set(str(exc))
+            return None
+        return needle, self.replace_var.get(), regex, case
+
+    def _schedule_find_preview(self):
+        if self._find_preview_job is not None:
+            self.root.after_cancel(self._find_preview_job)
+        self._find_preview_job = self.root.after(FIND_PREVIEW_DELAY_MS, self._run_find_preview)
+
+    def _run_find_preview(self):
+        # Typing restarts the timer, so only the last keystroke's settings run.
+        self._find_preview_job = None
+        self._find_token += 1
+        options = self._find_options()
+        if options is None or not self.items or self._busy:
+            if options is not None:
+                self.find_preview_var.set('')
+            self.find_replace_btn.configure(text='Apply Find/Replace')
+            return
+        self.jobs.submit(self._find_preview_worker, self._on_find_preview_done, list(self.items), self._find_token, *options)
+
+    def _find_preview_worker(self, items, token, needle, replacement, regex, case, progress=None):
+        result = find_replace(items, needle, replacement, regex=regex, case=case)
+        sample = next(((items[idx], name) for idx, name in enumerate(result.names) if name is not None), None)
+        return {'token': token, 'result': result, 'sample': sample}
+
+    def _on_find_preview_done(self, result):
+        if not result.ok:
+            self.find_preview_var.set(f'Find failed: {result.error}')
+            return
+        payload = result.value or {}
+        if payload.get('token') != self._find_token:
+            return
+        found = payload['result']
+        text = f'{found.matches} match(es) in {found.files} file(s)'
+        sample = payload.get('sample')
+        if sample is not None:
+            item, name = sample
+            text += f'\n{item.proposed_name or item.current_name} -> {name}'
+        self.find_preview_var.set(text)
+        self.find_replace_btn.configure(text=f'Replace {found.matches} match(es)' if found.matches else 'Apply Find/Replace')
+
+    def on_find_replace(self):
+        if self._busy:
+            return
+        if not self.items:
+            messagebox.showinfo('Sort Goblin', 'Load files first.')
+            return
+        if not self.find_var.get():
             messagebox.showinfo('Sort Goblin', 'Enter a Find value first.')
             return
+        options = self._find_options()
+        if options is None:
+            messagebox.showerror('Sort Goblin', self.find_preview_var.get())
+            return
+        self._set_busy(True, 'Goblin replacing text...')
+        self.jobs.submit(
+            self._find_replace_worker,
+            self._on_names_done,
+            list(self.items),
+            *options,
+            bool(self.sanitize_var.get()),
+        )
 
-        changed = 0
-        for item in self.items:
-            src_name = item.proposed_name or item.current_name
-            stem = Path(src_name).stem
-            ext = Path(src_name).suffix
-            if needle not in stem:
-                continue
-            new_stem = stem.replace(needle, replacement)
-            new_name = f'{new_stem}{ext}'
-            if self.sanitize_var.get():
-                new_name = sanitize_name(new_name)
-            if new_name != item.proposed_name:
-                item.proposed_name = new_name
-                changed += 1
+    def _find_replace_worker(self, items, needle, replacement, regex, case, sanitize, progress=None):
+        result = find_replace(items, needle, replacement, regex=regex, case=case, sanitize=sanitize)
+        summary = f'Replaced {result.matches} match(es) in {result.files} file(s)'
+        return {'items': items, 'names': result.names, 'summary': summary}
 
-        self._revalidate_and_refresh()
-        self.show_toast(f'Updated {changed} row(s)')
+    def _on_names_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                messagebox.showerror('Sort Goblin', f'Failed to generate names.\n{result.error}')
+                self.set_status('Name update failed')
+                return
+            payload = result.value or {}
+            # Rows loaded while the job ran make the result stale.
+            if payload.get('items') != self.items:
+                self.set_status('File list changed; run it again')
+                return
+            changed = 0
+            for item, name in zip(self.items, payload.get('names') or []):
+                if name is not None and name != item.proposed_name:
+                    item.proposed_name = name
+                    changed += 1
+            self._revalidate_and_refresh()
+            if payload.get('summary'):
+                self.set_status(payload['summary'])
+            self.show_toast(f'Updated {changed} row(s)')
+        finally:
+            self._set_busy(False)
 
     def _revalidate_and_refresh(self):
-        report = validate(self.items)
+        self._validator = RenameValidator(self.items)
         self._refresh_tree()
         self.loaded_count_var.set(f'{len(self.items)} files loaded')
-        self._update_apply_state(report)
+        self._update_apply_state(self._validator.report())
+        self._schedule_find_preview()
+
+    def _revalidate_rows(self, indexes):
+        # Inline edits only touch their own rows and duplicate peers, so the
+        # live validator and a per-row tree update keep big lists responsive.
+        if self._validator is None or self._validator.items is not self.items:
+            self._revalidate_and_refresh()
+            return
+        for idx in self._validator.update(indexes):
+            self._sync_row(idx)
+        self._update_apply_state(self._validator.report())
+        self._schedule_find_preview()
+
+    def _row_tags(self, idx: int, item: FileItem) -> tuple[str, ...]:
+        tags = ['row_even' if idx % 2 == 0 else 'row_odd']
+        if item.status and item.status != 'no-op':
+            tags.append('invalid')
+        elif item.status == 'no-op':
+            tags.append('no_op')
+        return tuple(tags)
+
+    def _display_name(self, item: FileItem) -> str:
+        root = self._load_root
+        if root is None:
+            return item.current_name
+        text = os.fspath(item.path)
+        if text.startswith(root) and len(text) > len(root) + 1 + len(item.current_name):
+            return text[len(root) + 1:]
+        return item.current_name
+
+    def _row_state(self, idx: int, item: FileItem) -> tuple[tuple[str, str, str], tuple[str, ...]]:
+        return (self._display_name(item), item.proposed_name, item.status), self._row_tags(idx, item)
+
+    def _sync_row(self, idx: int):
+        # Rows not inserted yet pick up the current state when their chunk runs.
+        if idx >= len(self._tree_rows):
+            return
+        state = self._row_state(idx, self.items[idx])
+        if state != self._tree_rows[idx]:
+            self._tree_rows[idx] = state
+            self.tree.item(f'row_{idx}', values=state[0], tags=state[1])
 
     def _refresh_tree(self):
+        # The tree mirrors self._tree_rows. Same item list: only rows whose
+        # values or tags changed are touched. New list: rows are inserted in
+        # chunks between Tk events so big loads keep painting.
         self._close_editor()
-        for iid in self.tree.get_children():
-            self.tree.delete(iid)
+        if self._tree_items is self.items:
+            for idx in range(len(self._tree_rows)):
+                self._sync_row(idx)
+            return
+        if self._insert_job is not None:
+            self.root.after_cancel(self._insert_job)
+            self._insert_job = None
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self._tree_items = self.items
+        self._tree_rows = []
         self._tree_to_index = {}
-
-        for idx, item in enumerate(self.items):
+        self._insert_rows()
+
+    def _insert_rows(self):
+        self._insert_job = None
+        items = self._tree_items or []
+        start = len(self._tree_rows)
+        stop = min(start + TREE_INSERT_CHUNK, len(items))
+        for idx in range(start, stop):
             iid = f'row_{idx}'
+            state = self._row_state(idx, items[idx])
+            self.tree.insert('', tk.END, iid=iid, values=state[0], tags=state[1])
+            self._tree_rows.append(state)
             self._tree_to_index[iid] = idx
-            tags = ['row_even' if idx % 2 == 0 else 'row_odd']
-            if item.status and item.status != 'no-op':
-                tags.append('invalid')
-            elif item.status == 'no-op':
-                tags.append('no_op')
-            self.tree.insert('', tk.END, iid=iid, values=(item.current_name, item.proposed_name, item.status), tags=tuple(tags))
+        if stop < len(items):
+            self._insert_job = self.root.after(1, self._insert_rows)
 
     def _update_apply_state(self, report: dict):
         issues = report.get('issues', {})
@@ -631,7 +1102,7 @@ class SortGoblinWindow:
         )
         can_apply = bool(report.get('valid')) and change_count > 0 and not self._busy
         self._set_widget_state(self.apply_btn, can_apply)
-        self.undo_btn.configure(state=('normal' if (self._last_undo_plan and not self._busy) else 'disabled'))
+        self._update_undo_state()
         self.shell.set_dirty(change_count > 0)
 
         if not self.items:
@@ -689,7 +1160,7 @@ class SortGoblinWindow:
                 new_value = sanitize_name(new_value)
             self.items[idx].proposed_name = new_value
             self._close_editor()
-            self._revalidate_and_refresh()
+            self._revalidate_rows([idx])
 
         def cancel(_event=None):
             if self._edit_entry is not entry:
@@ -715,7 +1186,9 @@ class SortGoblinWindow:
         if not self.items:
             messagebox.showinfo('Sort Goblin', 'Load files first.')
             return
-        report = validate(self.items)
+        # Fresh listings: files may have appeared since the last full check.
+        self._validator = RenameValidator(self.items)
+        report = self._validator.report()
         self._refresh_tree()
         self._update_apply_state(report)
         if not report.get('valid'):
@@ -732,7 +1205,17 @@ class SortGoblinWindow:
         ):
             return
         self._set_busy(True, f'Applying {len(plan)} rename(s)...')
-        self.jobs.submit(self._apply_worker, self._on_apply_done, plan)
+        self.jobs.submit(self._apply_worker, self._on_apply_done, plan, self._plan_root(plan))
+
+    def _plan_root(self, plan) -> str:
+        # Folder the history stores paths against: the loaded folder, or the
+        # common parent of picked files ('' when they share none).
+        if self._load_root:
+            return self._load_root
+        try:
+            return os.path.commonpath([os.path.dirname(os.fspath(src)) for src, _dst in plan])
+        except ValueError:
+            return ''
 
     def _on_ctrl_enter(self, _event=None):
         self.on_apply()
@@ -754,9 +1237,12 @@ class SortGoblinWindow:
             self.back_to_launcher()
         return 'break'
 
-    def _apply_worker(self, rename_plan, progress=None):
-        undo_plan = apply_rename(rename_plan)
-        return {'undo_plan': undo_plan}
+    def _apply_worker(self, rename_plan, root=None, progress=None):
+        # Moves are grouped by directory and run on a pool; a failure rolls
+        # back every group. The journal adds the run to the undo history.
+        journal = MoveJournal(JOURNAL_TOOL, root=root, history=self._history)
+        undo_plan = apply_rename(rename_plan, journal=journal, workers=APPLY_WORKERS)
+        return {'undo_plan': undo_plan, 'history': self._history.entries(JOURNAL_TOOL)}
 
     def _on_apply_done(self, result):
         try:
@@ -767,7 +1253,7 @@ class SortGoblinWindow:
                 self.set_status('Rename failed')
                 return
             undo_plan = (result.value or {}).get('undo_plan', [])
-            self._last_undo_plan = list(undo_plan)
+            self._set_undo_entries((result.value or {}).get('history'))
             old_to_new = {str(old.absolute()): new.absolute() for new, old in undo_plan}
             for item in self.items:
                 src = str(item.path.absolute())
@@ -787,11 +1273,12 @@ class SortGoblinWindow:
     def on_undo(self):
         if self._busy:
             return
-        if not self._last_undo_plan:
+        entry = self._selected_undo_entry()
+        if entry is None:
             messagebox.showinfo('Sort Goblin', 'Nothing to undo.')
             return
-        self._set_busy(True, 'Undoing last rename...')
-        self.jobs.submit(self._undo_worker, self._on_undo_done, list(self._last_undo_plan))
+        self._set_busy(True, 'Undoing rename...')
+        self.jobs.submit(self._undo_worker, self._on_undo_done, entry)
 
     def reset_selected(self):
         if self._busy or not self.items:
@@ -800,7 +1287,7 @@ class SortGoblinWindow:
         if not selection:
             messagebox.showinfo('Sort Goblin', 'Select one or more rows first.')
             return
-        count = 0
+        reset_rows = []
         for iid in selection:
             idx = self._tree_to_index.get(iid)
             if idx is None:
@@ -808,8 +1295,9 @@ class SortGoblinWindow:
             item = self.items[idx]
             item.proposed_name = item.current_name
             item.status = ''
-            count += 1
-        self._revalidate_and_refresh()
+            reset_rows.append(idx)
+        count = len(reset_rows)
+        self._revalidate_rows(reset_rows)
         self.show_toast(f'Reset {count} row(s)')
 
     def reset_all(self):
@@ -834,9 +1322,16 @@ class SortGoblinWindow:
         self.set_status(f'Copied {len(invalid)} invalid row(s)')
         self.show_toast('Invalid rows copied')
 
-    def _undo_worker(self, undo_plan, progress=None):
-        redo_plan = undo_rename(undo_plan)
-        return {'undo_input': undo_plan, 'redo_plan': redo_plan}
+    def _undo_worker(self, entry: UndoEntry, progress=None):
+        problems = self._history.verify(entry)
+        if problems:
+            more = f'\n...and {len(problems) - 5} more' if len(problems) > 5 else ''
+            raise RuntimeError('Cannot undo this rename:\n' + '\n'.join(problems[:5]) + more)
+        undo_plan = [(dst, src) for src, dst in entry.pairs()]
+        journal = MoveJournal(JOURNAL_UNDO_TOOL, root=entry.root)
+        redo_plan = undo_rename(undo_plan, journal=journal, workers=APPLY_WORKERS)
+        self._history.mark_undone(entry)
+        return {'undo_input': undo_plan, 'redo_plan': redo_plan, 'history': self._history.entries(JOURNAL_TOOL)}
 
     def _on_undo_done(self, result):
         try:
@@ -857,7 +1352,7 @@ class SortGoblinWindow:
                     item.ext = restored.suffix.lower()
                     item.proposed_name = restored.name
                     item.status = ''
-            self._last_undo_plan = []
+            self._set_undo_entries((result.value or {}).get('history'))
             self._revalidate_and_refresh()
             self.show_toast('Undo complete')
         finally:
@@ -866,6 +1361,12 @@ class SortGoblinWindow:
     def destroy(self):
         self._save_settings()
         self._close_editor()
+        if self._find_preview_job is not None:
+            self.root.after_cancel(self._find_preview_job)
+            self._find_preview_job = None
+        if self._insert_job is not None:
+            self.root.after_cancel(self._insert_job)
+            self._insert_job = None
         self._hide_shortcuts_tooltip()
         self.shortcuts.clear()
 
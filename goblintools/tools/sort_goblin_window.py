@@ -1,21 +1,30 @@
 ﻿from __future__ import annotations
 
 from pathlib import Path
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
+from core.category_rules import CategoryRules, RulesError, load_rules
+from core.move_journal import (
+    JournalState,
+    MoveJournal,
+    find_interrupted,
+    resume_journal,
+    rollback_journal,
+)
 from core.sort_goblin import (
-    CATEGORY_ORDER,
+    DirectorySnapshot,
     FileEntry,
     OperationPlan,
     apply_plan,
     build_rename_plan,
     build_sort_plan,
     build_sort_then_rename_plan,
-    categorize,
     undo_plan,
     validate_plan,
 )
+from core.undo_history import UndoEntry, UndoHistory
 from goblintools.common import (
     BackgroundJobRunner,
     SECTION_GAP,
@@ -33,6 +42,24 @@ from goblintools.common import (
 )
 
 
+JOURNAL_TOOL = 'sort_goblin'
+JOURNAL_UNDO_TOOL = 'sort_goblin.undo'
+APPLY_WORKERS = 8
+SNAPSHOT_POLL_MS = 1500
+REPREVIEW_DELAY_MS = 250
+DUPLICATE_CHOICES = {
+    'off': 'Sort duplicates normally',
+    'bucket': 'Move duplicates to Duplicates',
+    'skip': 'Leave duplicates unsorted',
+}
+BUCKET_CHOICES = {
+    'category': 'Folders by type',
+    'date': 'Images by date (YYYY/MM)',
+    'resolution': 'Images by resolution',
+    'duration': 'Audio by duration',
+}
+
+
 class SortGoblinWindow:
     def __init__(self, root, launcher_root=None):
         self.root = root
@@ -58,19 +85,32 @@ class SortGoblinWindow:
         self.current_plan: OperationPlan | None = None
         self.current_errors: list[str] = []
         self.preview_ready = False
-        self.last_undo_mapping: list[tuple[Path, Path]] = []
+        self._history = UndoHistory()
+        self._undo_entries: list[UndoEntry] = []
+        self._snapshot: DirectorySnapshot | None = None
+        self._repreview_job = None
+        self._rules: CategoryRules | None = None
+        self._rules_path: Path | None = None
 
         self.selected_path_var = tk.StringVar(value='No folder selected')
         self.folder_note_var = tk.StringVar(value='Top-level files only. Subfolders will not be modified.')
         self.summary_var = tk.StringVar(value='No preview yet.')
         self.mode_var = tk.StringVar(value=str(prefs.get('mode', 'sort')))
         self.include_optional_var = tk.BooleanVar(value=bool(prefs.get('include_optional_categories', True)))
+        self.sniff_content_var = tk.BooleanVar(value=bool(prefs.get('sniff_content', False)))
+        duplicates_mode = str(prefs.get('duplicates', 'off'))
+        self.duplicates_var = tk.StringVar(value=DUPLICATE_CHOICES.get(duplicates_mode, DUPLICATE_CHOICES['off']))
+        bucket_rule = str(prefs.get('bucket_rule', 'category'))
+        self.bucket_rule_var = tk.StringVar(value=BUCKET_CHOICES.get(bucket_rule, BUCKET_CHOICES['category']))
         self.base_var = tk.StringVar(value=str(prefs.get('base', 'asset')))
         self.start_var = tk.IntVar(value=int(prefs.get('start_index', 1)))
         self.pad_var = tk.IntVar(value=int(prefs.get('pad_width', 3)))
         self.separator_var = tk.StringVar(value=str(prefs.get('separator', '_')))
         self.preserve_ext_var = tk.BooleanVar(value=bool(prefs.get('preserve_extension', True)))
         self.sanitize_var = tk.BooleanVar(value=bool(prefs.get('sanitize', True)))
+        self.rules_var = tk.StringVar(value='Built-in categories')
+        self.undo_choice_var = tk.StringVar(value='')
+        self._load_rules_file(prefs.get('rules_file'), quiet=True)
 
         self._build_ui()
         self._bind_pref_traces()
@@ -82,6 +122,89 @@ class SortGoblinWindow:
         self._hydrating_prefs = False
         self._refresh_mode_sections()
         self._update_apply_state()
+        self.root.after(0, self._restore_session_state)
+        self.root.after(SNAPSHOT_POLL_MS, self._poll_snapshot)
+
+    def _restore_session_state(self):
+        if self._busy:
+            return
+        self._set_busy(True, 'Goblin checking journal...')
+        self.jobs.submit(self._journal_scan_worker, self._on_journal_scan_done)
+
+    def _journal_scan_worker(self, progress=None):
+        interrupted = find_interrupted(JOURNAL_TOOL) + find_interrupted(JOURNAL_UNDO_TOOL)
+        return {'interrupted': interrupted, 'history': self._history.entries(JOURNAL_TOOL)}
+
+    def _on_journal_scan_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                self.set_status('Journal check failed')
+                return
+            payload = result.value or {}
+            self._set_undo_entries(payload.get('history'))
+            interrupted = list(payload.get('interrupted') or [])
+        finally:
+            self._set_busy(False)
+            self._update_apply_state()
+        if interrupted:
+            self._prompt_recovery(interrupted[0])
+
+    def _set_undo_entries(self, entries: list[UndoEntry] | None):
+        # Newest first. The picker defaults to the newest, so Undo steps back
+        # one operation at a time unless an older one is chosen.
+        self._undo_entries = list(entries or [])
+        labels = [self._undo_label(entry) for entry in self._undo_entries]
+        self.undo_combo.configure(values=labels)
+        self.undo_choice_var.set(labels[0] if labels else '')
+
+    def _undo_label(self, entry: UndoEntry) -> str:
+        when = time.strftime('%m-%d %H:%M', time.localtime(entry.created))
+        return f'{when}  {entry.count} move(s)  {Path(entry.root).name or entry.root}'
+
+    def _selected_undo_entry(self) -> UndoEntry | None:
+        try:
+            idx = list(self.undo_combo.cget('values')).index(self.undo_choice_var.get())
+        except ValueError:
+            idx = 0
+        return self._undo_entries[idx] if idx < len(self._undo_entries) else None
+
+    def _prompt_recovery(self, state: JournalState):
+        answer = messagebox.askyesnocancel(
+            'Sort Goblin',
+            f'An interrupted operation ({len(state.moves)} move(s)) was found in:\n{state.root}\n\n'
+            'Yes: resume it\nNo: roll it back\nCancel: decide next time',
+        )
+        if answer is None:
+            return
+        self._set_busy(True, 'Goblin resuming interrupted run...' if answer else 'Goblin rolling back interrupted run...')
+        self.jobs.submit(self._recover_worker, self._on_recover_done, state, bool(answer))
+
+    def _recover_worker(self, state: JournalState, resume: bool, progress=None):
+        if resume:
+            mapping = resume_journal(state)
+            if state.tool == JOURNAL_TOOL:
+                self._history.record(state.tool, state.root, mapping)
+        else:
+            rollback_journal(state)
+        return {'resumed': resume, 'history': self._history.entries(JOURNAL_TOOL)}
+
+    def _on_recover_done(self, result):
+        try:
+            if not result.ok:
+                if result.tb:
+                    print(result.tb)
+                messagebox.showerror('Sort Goblin', f'Recovery failed.\n{result.error}')
+                self.set_status('Recovery failed')
+                return
+            payload = result.value or {}
+            self._set_undo_entries(payload.get('history'))
+            self.set_status('Interrupted run resumed' if payload.get('resumed') else 'Interrupted run rolled back')
+            self.show_toast('Recovery complete')
+        finally:
+            self._set_busy(False)
+            self._update_apply_state()
 
     def _load_settings(self) -> dict:
         payload = get_pref(self._pref_key, {})
@@ -96,6 +219,10 @@ class SortGoblinWindow:
                 {
                     'mode': self.mode_var.get(),
                     'include_optional_categories': bool(self.include_optional_var.get()),
+                    'sniff_content': bool(self.sniff_content_var.get()),
+                    'duplicates': self._duplicates_mode(),
+                    'bucket_rule': self._bucket_rule(),
+                    'rules_file': str(self._rules_path) if self._rules_path is not None else '',
                     'base': self.base_var.get(),
                     'start_index': int(self.start_var.get()),
                     'pad_width': int(self.pad_var.get()),
@@ -111,6 +238,9 @@ class SortGoblinWindow:
         for var in (
             self.mode_var,
             self.include_optional_var,
+            self.sniff_content_var,
+            self.duplicates_var,
+            self.bucket_rule_var,
             self.base_var,
             self.start_var,
             self.pad_var,
@@ -119,6 +249,43 @@ class SortGoblinWindow:
             self.sanitize_var,
         ):
             var.trace_add('write', lambda *_args: self._save_settings())
+        for var in (
+            self.include_optional_var,
+            self.sniff_content_var,
+            self.duplicates_var,
+            self.bucket_rule_var,
+            self.base_var,
+            self.start_var,
+            self.pad_var,
+            self.separator_var,
+            self.preserve_ext_var,
+            self.sanitize_var,
+        ):
+            var.trace_add('write', lambda *_args: self._schedule_repreview())
+
+    def _schedule_repreview(self):
+        # Option edits re-run the preview against the cached snapshot, so a
+        # short debounce is enough to coalesce typing in the rename fields.
+        if self._hydrating_prefs or self.selected_dir is None:
+            return
+        if self._repreview_job is not None:
+            self.root.after_cancel(self._repreview_job)
+        self._repreview_job = self.root.after(REPREVIEW_DELAY_MS, self._run_repreview)
+
+    def _run_repreview(self):
+        self._repreview_job = None
+        if self._busy:
+            self._schedule_repreview()
+            return
+        self.on_preview()
+
+    def _poll_snapshot(self):
+        try:
+            snapshot = self._snapshot
+            if snapshot is not None and not self._busy and self.preview_ready and snapshot.has_changed():
+                self.on_preview()
+        finally:
+            self.root.after(SNAPSHOT_POLL_MS, self._poll_snapshot)
 
     def _build_ui(self):
         self.shell = ToolShell(
@@ -134,7 +301,7 @@ class SortGoblinWindow:
                 {'id': 'select_folder', 'label': 'Select Folder', 'icon': '>', 'command': self.select_folder},
                 {'id': 'preview', 'label': 'Preview', 'icon': '>', 'command': self.on_preview},
                 {'id': 'apply', 'label': 'Apply', 'icon': '>', 'command': self.on_apply},
-                {'id': 'undo', 'label': 'Undo Last', 'icon': '>', 'command': self.on_undo},
+                {'id': 'undo', 'label': 'Undo', 'icon': '>', 'command': self.on_undo},
             ]
         )
 
@@ -171,6 +338,7 @@ class SortGoblinWindow:
         self.tree.tag_configure('row_even', background=self.colors['surface'])
         self.tree.tag_configure('row_odd', background=self.colors['surface_alt'])
         self.tree.tag_configure('warn', background='#3A1A2A', foreground='#FFD9E7')
+        self.tree.tag_configure('duplicate', foreground=self.colors['muted'])
         self.tree.grid(row=0, column=0, sticky='nsew')
 
         tree_y = ttk.Scrollbar(table_wrap, orient=tk.VERTICAL, command=self.tree.yview)
@@ -228,6 +396,20 @@ class SortGoblinWindow:
         tk.Label(self.sort_opts_frame, text='Top-level only (no recursion)', bg=self.colors['surface'], fg=self.colors['muted'], font=('Segoe UI', 8)).grid(row=1, column=0, sticky='w', pady=(6, 0))
         self.include_optional_check = ttk.Checkbutton(self.sort_opts_frame, text='Include Archives/Code/Audio categories', variable=self.include_optional_var)
         self.include_optional_check.grid(row=2, column=0, sticky='w', pady=(8, 0))
+        self.sniff_content_check = ttk.Checkbutton(self.sort_opts_frame, text='Detect type from file contents', variable=self.sniff_content_var)
+        self.sniff_content_check.grid(row=3, column=0, sticky='w', pady=(4, 0))
+        self.duplicates_combo = ttk.Combobox(self.sort_opts_frame, textvariable=self.duplicates_var, values=list(DUPLICATE_CHOICES.values()), state='readonly')
+        self.duplicates_combo.grid(row=4, column=0, sticky='ew', pady=(8, 0))
+        self.bucket_rule_combo = ttk.Combobox(self.sort_opts_frame, textvariable=self.bucket_rule_var, values=list(BUCKET_CHOICES.values()), state='readonly')
+        self.bucket_rule_combo.grid(row=5, column=0, sticky='ew', pady=(8, 0))
+        rules_row = ttk.Frame(self.sort_opts_frame, style='Surface.TFrame')
+        rules_row.grid(row=6, column=0, sticky='ew', pady=(8, 0))
+        rules_row.columnconfigure(0, weight=1)
+        tk.Label(rules_row, textvariable=self.rules_var, bg=self.colors['surface'], fg=self.colors['muted'], font=('Segoe UI', 8), anchor='w').grid(row=0, column=0, sticky='ew')
+        self.rules_btn = ttk.Button(rules_row, text='Rules...', style='Ghost.TButton', command=self.select_rules_file)
+        self.rules_btn.grid(row=0, column=1, sticky='e', padx=(8, 0))
+        self.rules_reset_btn = ttk.Button(rules_row, text='Built-in', style='Ghost.TButton', command=self.reset_rules)
+        self.rules_reset_btn.grid(row=0, column=2, sticky='e', padx=(4, 0))
 
         self.rename_opts_frame = ttk.Frame(inspector, style='Surface.TFrame', padding=SURFACE_PAD)
         self.rename_opts_frame.grid(row=7, column=0, sticky='ew', pady=(SPACE_8, SECTION_GAP))
@@ -284,10 +466,12 @@ class SortGoblinWindow:
         self.preview_btn.grid(row=0, column=0, sticky='ew')
         self.apply_btn = ShinyButton(apply_surface, text='Apply', command=self.on_apply, width=260, height=40, colors=self.colors)
         self.apply_btn.grid(row=1, column=0, sticky='ew', pady=(8, 0))
-        self.undo_btn = ttk.Button(apply_surface, text='Undo Last', style='Ghost.TButton', command=self.on_undo)
-        self.undo_btn.grid(row=2, column=0, sticky='ew', pady=(8, 0))
+        self.undo_combo = ttk.Combobox(apply_surface, textvariable=self.undo_choice_var, values=[], state='readonly')
+        self.undo_combo.grid(row=2, column=0, sticky='ew', pady=(8, 0))
+        self.undo_btn = ttk.Button(apply_surface, text='Undo', style='Ghost.TButton', command=self.on_undo)
+        self.undo_btn.grid(row=3, column=0, sticky='ew', pady=(8, 0))
 
-        for btn in (self.select_folder_btn, self.preview_btn, self.undo_btn):
+        for btn in (self.select_folder_btn, self.preview_btn, self.undo_btn, self.rules_btn, self.rules_reset_btn):
             self._bind_ghost_feedback(btn)
         self.apply_btn.configure(cursor='hand2')
 
@@ -297,6 +481,11 @@ class SortGoblinWindow:
             self.undo_btn,
             self.tree,
             self.include_optional_check,
+            self.sniff_content_check,
+            self.duplicates_combo,
+            self.bucket_rule_combo,
+            self.rules_btn,
+            self.rules_reset_btn,
             self.base_entry,
             self.start_spin,
             self.pad_spin,
@@ -434,9 +623,11 @@ class SortGoblinWindow:
 
     def _on_mode_change(self):
         self._refresh_mode_sections()
+        self._schedule_repreview()
 
     def _set_selected_dir(self, directory: Path, source_label: str = 'Folder selected', auto_preview: bool = True):
         self.selected_dir = directory.resolve()
+        self._snapshot = None
         self.selected_path_var.set(str(self.selected_dir))
         self.preview_ready = False
         self.current_plan = None
@@ -456,6 +647,39 @@ class SortGoblinWindow:
             return
         self._set_selected_dir(Path(folder), source_label='Folder selected')
 
+    def _load_rules_file(self, value, quiet=False) -> bool:
+        if not value:
+            return False
+        path = Path(str(value)).expanduser()
+        try:
+            rules = load_rules(path)
+        except (OSError, RulesError) as exc:
+            if not quiet:
+                messagebox.showerror('Sort Goblin', f'Could not load category rules.\n{exc}')
+            return False
+        self._rules = rules
+        self._rules_path = path
+        self.rules_var.set(f'Rules: {path.name} ({len(rules.order)} folders)')
+        return True
+
+    def select_rules_file(self):
+        if self._busy:
+            return
+        path = filedialog.askopenfilename(title='Select Category Rules', filetypes=[('JSON rules', '*.json'), ('All files', '*.*')])
+        if not path or not self._load_rules_file(path):
+            return
+        self._save_settings()
+        self._schedule_repreview()
+
+    def reset_rules(self):
+        if self._busy or self._rules is None:
+            return
+        self._rules = None
+        self._rules_path = None
+        self.rules_var.set('Built-in categories')
+        self._save_settings()
+        self._schedule_repreview()
+
     def _enable_folder_drop(self, widgets: list[tk.Widget]):
         if is_dnd_disabled():
             return
@@ -504,24 +728,59 @@ class SortGoblinWindow:
         return 'break'
 
 
-    def _build_plan_worker(self, selected_dir, mode, include_optional, rename_options, progress=None):
+    def _duplicates_mode(self) -> str:
+        label = self.duplicates_var.get()
+        for mode, choice in DUPLICATE_CHOICES.items():
+            if choice == label:
+                return mode
+        return 'off'
+
+    def _bucket_rule(self) -> str:
+        label = self.bucket_rule_var.get()
+        for rule, choice in BUCKET_CHOICES.items():
+            if choice == label:
+                return rule
+        return 'category'
+
+    def _build_plan_worker(
+        self,
+        selected_dir,
+        mode,
+        include_optional,
+        rename_options,
+        sniff_content=False,
+        duplicates='off',
+        bucket_rule='category',
+        snapshot=None,
+        rules=None,
+        progress=None,
+    ):
         root = Path(selected_dir)
+        # The snapshot only rescans when the folder mtime moved, and keeps
+        # categories, sniff results and duplicate hashes for unchanged files.
+        # In-place edits are caught by the restat right before Apply.
+        if snapshot is None or snapshot.root != root.resolve():
+            snapshot = DirectorySnapshot(root)
+        else:
+            snapshot.refresh()
         if mode == 'sort':
-            plan = build_sort_plan(root, include_optional_categories=include_optional)
+            plan = build_sort_plan(root, include_optional_categories=include_optional, sniff_content=sniff_content, duplicates=duplicates, snapshot=snapshot, bucket_rule=bucket_rule, rules=rules)
         elif mode == 'rename':
-            files = [p for p in root.iterdir() if p.is_file()]
-            files.sort(key=lambda p: p.name.casefold())
             entries = [
-                FileEntry(path=p, name=p.name, ext=p.suffix.lower(), category=categorize(p, include_optional_categories=True), proposed_path=p, status='', action='')
-                for p in files
+                FileEntry(path=row.src, name=row.name, ext=row.ext, category=row.category, proposed_path=row.src, status='', action='')
+                for row in snapshot.rows(include_optional_categories=True)
             ]
             plan = build_rename_plan(entries, rename_options)
         else:
             opts = dict(rename_options)
             opts['include_optional_categories'] = include_optional
-            plan = build_sort_then_rename_plan(root, opts)
+            opts['sniff_content'] = sniff_content
+            opts['duplicates'] = duplicates
+            opts['bucket_rule'] = bucket_rule
+            opts['rules'] = rules
+            plan = build_sort_then_rename_plan(root, opts, snapshot=snapshot)
         ok, errors = validate_plan(plan)
-        return {'plan': plan, 'ok': ok, 'errors': errors}
+        return {'plan': plan, 'ok': ok, 'errors': errors, 'snapshot': snapshot}
 
     def on_preview(self):
         if self._busy:
@@ -546,12 +805,17 @@ class SortGoblinWindow:
             mode,
             bool(self.include_optional_var.get()),
             rename_options,
+            bool(self.sniff_content_var.get()),
+            self._duplicates_mode(),
+            self._bucket_rule(),
+            self._snapshot,
+            self._rules,
         )
 
     def _format_counts(self, counts: dict[str, int]) -> str:
         parts = []
-        for category in CATEGORY_ORDER:
-            count = int(counts.get(category, 0))
+        # Counts arrive in folder order, which custom rules decide.
+        for category, count in counts.items():
             if count > 0:
                 parts.append(f'{category} ({count})')
         return ', '.join(parts) if parts else 'No files found.'
@@ -569,7 +833,9 @@ class SortGoblinWindow:
             self.tree.delete(iid)
         for idx, entry in enumerate(entries):
             tags = ['row_even' if idx % 2 == 0 else 'row_odd']
-            if entry.status:
+            if entry.status.startswith('duplicate'):
+                tags.append('duplicate')
+            elif entry.status:
                 tags.append('warn')
             self.tree.insert(
                 '',
@@ -598,6 +864,7 @@ class SortGoblinWindow:
 
             payload = result.value or {}
             plan = payload.get('plan')
+            self._snapshot = payload.get('snapshot')
             ok = bool(payload.get('ok'))
             errors = list(payload.get('errors') or [])
             self.current_plan = plan
@@ -619,8 +886,10 @@ class SortGoblinWindow:
     def _update_apply_state(self):
         can_apply = bool(self.selected_dir and self.preview_ready and self.current_plan and not self.current_errors and self.current_plan.moves and not self._busy)
         self._set_widget_state(self.apply_btn, can_apply)
-        self.undo_btn.configure(state=('normal' if (self.last_undo_mapping and not self._busy) else 'disabled'))
-        dirty = bool(self.preview_ready or self.last_undo_mapping)
+        can_undo = bool(self._undo_entries) and not self._busy
+        self.undo_btn.configure(state=('normal' if can_undo else 'disabled'))
+        self.undo_combo.configure(state=('readonly' if can_undo else 'disabled'))
+        dirty = bool(self.preview_ready)
         self.shell.set_dirty(dirty)
 
     def on_apply(self):
@@ -641,13 +910,25 @@ class SortGoblinWindow:
         if not messagebox.askyesno('Sort Goblin', f'Apply {len(self.current_plan.moves)} operation(s)?'):
             return
         self._set_busy(True, 'Goblin organizing mess...')
-        self.jobs.submit(self._apply_worker, self._on_apply_done, self.current_plan)
-
-    def _apply_worker(self, plan: OperationPlan, progress=None):
-        undo_mapping = apply_plan(plan)
-        return {'undo_mapping': undo_mapping}
+        self.jobs.submit(self._apply_worker, self._on_apply_done, self.current_plan, self._snapshot, on_progress=self._on_move_progress)
+
+    def _on_move_progress(self, payload):
+        label = self._to_relative(Path(str(payload.get('group', ''))))
+        moves = int(payload.get('moves', 0))
+        rate = float(payload.get('rate', 0.0))
+        self.set_status(f'{label or "."}: {moves} move(s) at {rate:.0f}/s')
+
+    def _apply_worker(self, plan: OperationPlan, snapshot: DirectorySnapshot | None, progress=None):
+        # Files edited in place since the preview may have a different type or
+        # duplicate group than the plan assumed, so the plan is rebuilt first.
+        if snapshot is not None and any(snapshot.refresh(restat=True)):
+            return {'stale': True}
+        journal = MoveJournal(JOURNAL_TOOL, root=plan.root_dir, history=self._history)
+        apply_plan(plan, journal=journal, workers=APPLY_WORKERS, progress=progress)
+        return {'history': self._history.entries(JOURNAL_TOOL)}
 
     def _on_apply_done(self, result):
+        stale = False
         try:
             if not result.ok:
                 if result.tb:
@@ -656,7 +937,11 @@ class SortGoblinWindow:
                 self.set_status('Apply failed')
                 return
             payload = result.value or {}
-            self.last_undo_mapping = list(payload.get('undo_mapping') or [])
+            if payload.get('stale'):
+                stale = True
+                messagebox.showinfo('Sort Goblin', 'Files changed since the preview. Check the refreshed preview, then apply again.')
+                return
+            self._set_undo_entries(payload.get('history'))
             self.preview_ready = False
             self.current_plan = None
             self.current_errors = []
@@ -667,19 +952,29 @@ class SortGoblinWindow:
         finally:
             self._set_busy(False)
             self._update_apply_state()
+        if stale:
+            self.on_preview()
 
     def on_undo(self):
         if self._busy:
             return
-        if not self.last_undo_mapping:
+        entry = self._selected_undo_entry()
+        if entry is None:
             messagebox.showinfo('Sort Goblin', 'Nothing to undo.')
             return
-        self._set_busy(True, 'Goblin undoing last operation...')
-        self.jobs.submit(self._undo_worker, self._on_undo_done, list(self.last_undo_mapping))
-
-    def _undo_worker(self, mapping, progress=None):
-        redo = undo_plan(mapping)
-        return {'redo': redo}
+        self._set_busy(True, 'Goblin undoing operation...')
+        self.jobs.submit(self._undo_worker, self._on_undo_done, entry, on_progress=self._on_move_progress)
+
+    def _undo_worker(self, entry: UndoEntry, progress=None):
+        # Checked up front so an operation whose files were moved on since
+        # fails cleanly instead of rolling back halfway through.
+        problems = self._history.verify(entry)
+        if problems:
+            more = f'\n...and {len(problems) - 5} more' if len(problems) > 5 else ''
+            raise RuntimeError('Cannot undo this operation:\n' + '\n'.join(problems[:5]) + more)
+        redo = undo_plan(entry.pairs(), journal=MoveJournal(JOURNAL_UNDO_TOOL, root=entry.root), workers=APPLY_WORKERS, progress=progress)
+        self._history.mark_undone(entry)
+        return {'redo': redo, 'history': self._history.entries(JOURNAL_TOOL)}
 
     def _on_undo_done(self, result):
         try:
@@ -689,7 +984,7 @@ class SortGoblinWindow:
                 messagebox.showerror('Sort Goblin', str(result.error))
                 self.set_status('Undo failed')
                 return
-            self.last_undo_mapping = []
+            self._set_undo_entries((result.value or {}).get('history'))
             self.preview_ready = False
             self.current_plan = None
             self.current_errors = []
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.sort_goblin import (  # noqa: E402
+    apply_plan,
+    build_sort_plan,
+    build_sort_then_rename_plan,
+    categorize,
+    undo_plan,
+    validate_plan,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_SIZES = '10000,100000'
+DEFAULT_MIX = 'png:30,jpg:10,txt:15,pdf:5,mp3:10,mp4:5,zip:10,py:10,bin:5'
+DEFAULT_BASELINE = ROOT / 'scripts' / 'bench_baseline.json'
+RENAME_OPTIONS = {'base': 'asset', 'start_index': 1, 'pad_width': 7, 'separator': '_'}
+# Filesystem entry points the engines go through. Counting them is a portable
+# stand-in for strace; /proc/self/io adds real read/write syscall counts on Linux.
+COUNTED_CALLS = ('stat', 'lstat', 'scandir', 'rename', 'replace', 'mkdir', 'open', 'unlink', 'listdir')
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = {name: 0 for name in COUNTED_CALLS}
+        self._originals = {}
+
+    def __enter__(self):
+        for name in COUNTED_CALLS:
+            original = getattr(os, name)
+            self._originals[name] = original
+
+            def counted(*args, _name=name, _original=original, **kwargs):
+                self.counts[_name] += 1
+                return _original(*args, **kwargs)
+
+            setattr(os, name, counted)
+        return self
+
+    def __exit__(self, *_exc):
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        return False
+
+
+def parse_mix(text: str) -> list[tuple[str, int]]:
+    mix = []
+    for part in text.split(','):
+        ext, _, weight = part.strip().partition(':')
+        if ext:
+            mix.append((f'.{ext.lstrip(".")}', max(1, int(weight or 1))))
+    return mix
+
+
+def generate_tree(root: Path, count: int, mix: list[tuple[str, int]], collision_rate: float, seed: int) -> None:
+    # Flat folder of empty files. A collision_rate share of them also get a
+    # same-named file (and a same-numbered rename target) already sitting in
+    # their category folder, so both planners have to pick suffixed names.
+    rng = random.Random(seed)
+    exts = [ext for ext, _weight in mix]
+    weights = [weight for _ext, weight in mix]
+    root.mkdir(parents=True, exist_ok=True)
+    made_dirs = set()
+    for idx, ext in enumerate(rng.choices(exts, weights=weights, k=count)):
+        name = f'file_{idx:07d}{ext}'
+        open(root / name, 'wb').close()
+        if rng.random() < collision_rate:
+            category = categorize(Path(name))
+            folder = root / category
+            if category not in made_dirs:
+                folder.mkdir(exist_ok=True)
+                made_dirs.add(category)
+            open(folder / name, 'wb').close()
+            open(folder / f'asset_{idx + 1:07d}{ext}', 'wb').close()
+
+
+def _proc_io() -> dict[str, int]:
+    try:
+        with open('/proc/self/io', 'r', encoding='ascii') as fh:
+            pairs = (line.split(':', 1) for line in fh)
+            return {key.strip(): int(value) for key, value in pairs if key.strip() in ('syscr', 'syscw')}
+    except OSError:
+        return {}
+
+
+def _max_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def measure(label: str, fn, trace_memory: bool):
+    io_before = _proc_io()
+    if trace_memory:
+        tracemalloc.start()
+    with CallCounter() as counter:
+        started = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - started
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    io_after = _proc_io()
+    row = {
+        'phase': label,
+        'seconds': round(seconds, 4),
+        'calls': {name: n for name, n in counter.counts.items() if n},
+        'max_rss_mb': _max_rss_mb(),
+        'py_peak_mb': round(peak_mb, 1) if peak_mb is not None else None,
+    }
+    if io_before and io_after:
+        row['syscalls'] = {key: io_after[key] - io_before.get(key, 0) for key in io_after}
+    return value, row
+
+
+def run_size(workdir: Path, count: int, args) -> list[dict]:
+    root = workdir / f'tree_{count}'
+    if root.exists():
+        shutil.rmtree(root)
+    started = time.perf_counter()
+    generate_tree(root, count, parse_mix(args.mix), args.collision_rate, args.seed)
+    print(f'[{count}] generated in {time.perf_counter() - started:.1f}s', file=sys.stderr, flush=True)
+
+    rows = []
+    try:
+        sort_plan, row = measure('build_sort_plan', lambda: build_sort_plan(root), args.trace_memory)
+        rows.append(row)
+        _plan, row = measure('build_sort_then_rename_plan', lambda: build_sort_then_rename_plan(root, RENAME_OPTIONS), args.trace_memory)
+        rows.append(row)
+        del _plan
+        _result, row = measure('validate_plan', lambda: validate_plan(sort_plan), args.trace_memory)
+        rows.append(row)
+        undo_mapping, row = measure('apply_plan', lambda: apply_plan(sort_plan, workers=args.workers), args.trace_memory)
+        rows.append(row)
+        _result, row = measure('undo_plan', lambda: undo_plan(undo_mapping, workers=args.workers), args.trace_memory)
+        rows.append(row)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    for row in rows:
+        row['files'] = count
+        print(f'[{count}] {row["phase"]}: {row["seconds"]:.3f}s', file=sys.stderr, flush=True)
+    return rows
+
+
+def compare(rows: list[dict], baseline: dict, tolerance: float) -> bool:
+    reference = {(row['files'], row['phase']): row['seconds'] for row in baseline.get('results', [])}
+    ok = True
+    print(f'\n{"files":>9}  {"phase":<28}{"seconds":>10}{"baseline":>10}{"ratio":>8}')
+    for row in rows:
+        base = reference.get((row['files'], row['phase']))
+        ratio = row['seconds'] / base if base else None
+        flag = ''
+        if ratio is not None and ratio > tolerance:
+            flag = '  SLOWER'
+            ok = False
+        base_text = f'{base:.3f}' if base else '-'
+        ratio_text = f'{ratio:.2f}' if ratio is not None else '-'
+        print(f'{row["files"]:>9}  {row["phase"]:<28}{row["seconds"]:>10.3f}{base_text:>10}{ratio_text:>8}{flag}')
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark Sort/Rename engines on synthetic folders.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma-separated file counts, e.g. 10000,100000,1000000')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Extension mix as ext:weight pairs')
+    parser.add_argument('--collision-rate', type=float, default=0.1, help='Share of files that already exist in their destination')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--workdir', type=Path, default=None, help='Where trees are generated (default: a temp dir)')
+    parser.add_argument('--keep', action='store_true', help='Keep generated trees')
+    parser.add_argument('--trace-memory', action='store_true', help='Record Python heap peak per phase (slower)')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Fail when a phase is this many times slower than baseline')
+    parser.add_argument('--json', type=Path, default=None, help='Also write raw results here')
+    args = parser.parse_args()
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix='goblin_bench_'))
+    rows: list[dict] = []
+    try:
+        for size in (int(part) for part in args.sizes.split(',') if part.strip()):
+            rows.extend(run_size(workdir, size, args))
+    finally:
+        if args.workdir is None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'collision_rate': args.collision_rate,
+        'mix': args.mix,
+        'workers': args.workers,
+        'results': rows,
+    }
+    if args.json is not None:
+        args.json.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    ok = True
+    if args.baseline.exists() and not args.save_baseline:
+        ok = compare(rows, json.loads(args.baseline.read_text(encoding='utf-8')), args.tolerance)
+    else:
+        compare(rows, {}, args.tolerance)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f'\nBaseline saved to {args.baseline}')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 from pathlib import Path
+import json
+import os
 import shutil
 import sys
+import time
 import uuid
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -11,13 +14,22 @@ if str(ROOT) not in sys.path:
 
 from core.rename_goblin import (  # noqa: E402
     FileItem,
+    RenameValidator,
+    analyze_sequences,
     apply_rename,
+    find_replace,
     generate_names,
+    iter_files,
     plan_rename,
+    renumber_plan,
     sanitize_name,
     undo_rename,
     validate,
+    validate_mapping,
 )
+from core import media_metadata  # noqa: E402
+from core.rename_template import RenameTemplate, TemplateError, render_names  # noqa: E402
+from core.move_engine import schedule_moves  # noqa: E402
 
 
 def assert_true(condition, message):
@@ -74,6 +86,236 @@ def test_validate_and_plan():
     with_temp_workspace(run)
 
 
+def test_incremental_validator():
+    def run(root: Path):
+        (root / 'taken.png').write_text('x', encoding='utf-8')
+        items = []
+        for name in ('a.png', 'b.png', 'c.png', 'd.png'):
+            (root / name).write_text(name, encoding='utf-8')
+            items.append(FileItem(path=root / name, current_name=name, ext='.png', proposed_name=f'new_{name}'))
+        validator = RenameValidator(items)
+        assert_true(validator.report()['valid'], 'distinct names should be valid')
+
+        def edit(idx, name):
+            items[idx].proposed_name = name
+            touched = validator.update([idx])
+            expected = [FileItem(path=it.path, current_name=it.current_name, ext=it.ext, proposed_name=it.proposed_name) for it in items]
+            assert_true(validator.report() == validate(expected), f'incremental report drifted after {name}')
+            assert_true([it.status for it in items] == [it.status for it in expected], f'incremental statuses drifted after {name}')
+            return touched
+
+        touched = edit(1, 'NEW_A.png')
+        assert_true(touched == {0, 1}, 'an edit should re-check only its new bucket peers')
+        assert_true(items[0].status == 'duplicate target', 'peer should be flagged as duplicate')
+        edit(2, 'new_a.png')
+        touched = edit(1, 'taken.png')
+        assert_true(touched == {0, 1, 2}, 'leaving a bucket should re-check the remaining peers')
+        assert_true(items[1].status == 'target exists', 'existing target should be flagged')
+        edit(2, 'c.png')
+        edit(3, '')
+        assert_true(items[0].status == '' and items[2].status == 'no-op', 'cleared duplicates should recover')
+    with_temp_workspace(run)
+
+
+def test_rename_template():
+    def run(root: Path):
+        folder = root / 'shots'
+        folder.mkdir()
+        items = []
+        for name in ('IMG_7 beach.jpg', 'IMG_12 city.jpg', 'notes.txt'):
+            (folder / name).write_text(name, encoding='utf-8')
+            items.append(FileItem(path=folder / name, current_name=name, ext=Path(name).suffix.lower(), proposed_name=name))
+        stamp = time.mktime((2022, 3, 4, 12, 0, 0, 0, 0, -1))
+        os.utime(folder / 'notes.txt', (stamp, stamp))
+
+        names = render_names(items, RenameTemplate('{parent}_{n:04}'), start_index=5)
+        assert_true(names == ['shots_0005.jpg', 'shots_0006.jpg', 'shots_0007.txt'], f'index tokens mismatch: {names}')
+        names = render_names(items, RenameTemplate('{2}_{1:>03}', r'IMG_(\d+) (\w+)'))
+        assert_true(names == ['beach_007.jpg', 'city_012.jpg', None], f'capture groups mismatch: {names}')
+        names = render_names(items[2:], RenameTemplate('{mtime:%Y-%m}_{name}'), keep_ext=True)
+        assert_true(names == ['2022-03_notes.txt'], f'{{name}} should not get a second extension: {names}')
+        for bad, match in (('{nope}', None), ('{1}', None), ('{n:zz}', None), ('{stem}', '(')):
+            try:
+                RenameTemplate(bad, match)
+            except TemplateError:
+                continue
+            raise AssertionError(f'bad template should be rejected: {bad}')
+    with_temp_workspace(run)
+
+
+def test_recursive_per_directory():
+    def run(root: Path):
+        for rel in ('top.png', 'a/x.png', 'a/y.png', 'b/z.png', 'b/c/w.png', 'a/.__goblintmp__stale'):
+            path = root / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(rel, encoding='utf-8')
+        assert_true([p.name for p in iter_files(root)] == ['top.png'], 'non-recursive walk should stay top-level')
+        paths = sorted(iter_files(root, recursive=True))
+        assert_true(len(paths) == 5, f'recursive walk should skip temp names: {paths}')
+
+        items = [FileItem(path=p, current_name=p.name, ext=p.suffix, proposed_name=p.name) for p in paths]
+        generate_names(items, base='f', start_index=1, pad_width=2, separator='_', per_directory=True)
+        names = {p.relative_to(root).as_posix(): it.proposed_name for p, it in zip(paths, items)}
+        assert_true(names['a/y.png'] == 'f_02.png' and names['b/z.png'] == 'f_01.png', f'numbering should restart per folder: {names}')
+        report = validate(items)
+        assert_true(report['valid'], f'same names in different folders are not duplicates: {report}')
+
+        items[1].proposed_name = items[0].proposed_name
+        assert_true(validate(items)['issues']['duplicate'] == 2, 'duplicates inside one folder should still be caught')
+        items[1].proposed_name = 'f_02.png'
+        validate(items)
+        undo_plan = apply_rename(plan_rename(items), workers=4)
+        assert_true((root / 'b' / 'c' / 'f_01.png').exists() and (root / 'a' / 'f_02.png').exists(), 'groups should apply across folders')
+        undo_rename(undo_plan, workers=4)
+        assert_true((root / 'b' / 'c' / 'w.png').exists() and (root / 'a' / 'x.png').exists(), 'undo should restore every folder')
+    with_temp_workspace(run)
+
+
+def test_image_tokens_cached():
+    def run(root: Path):
+        for name in ('walk.png', 'idle.gif', 'notes.txt'):
+            (root / name).write_bytes(b'not really an image')
+        items = [FileItem(path=root / name, current_name=name, ext=Path(name).suffix, proposed_name=name) for name in ('walk.png', 'idle.gif', 'notes.txt')]
+        cache = media_metadata.MetadataCache(root / 'meta.json')
+        cache.put(root / 'walk.png', os.stat(root / 'walk.png'), {'width': 64, 'height': 32, 'mode': 'RGBA', 'frames': 1})
+        cache.put(root / 'idle.gif', os.stat(root / 'idle.gif'), {'width': 16, 'height': 16, 'mode': 'P', 'frames': 8})
+        cache.save()
+
+        saved_cache, saved_read = media_metadata._default_cache, media_metadata.read_metadata
+        reads = []
+        media_metadata._default_cache = media_metadata.MetadataCache(root / 'meta.json')
+        media_metadata.read_metadata = lambda path, frames=False: reads.append(path) or {}
+        try:
+            template = RenameTemplate('{stem}_{w}x{h}_{mode}_{frames:02}f')
+            names = render_names(items, template, workers=2)
+            assert_true(names[:2] == ['walk_64x32_RGBA_01f.png', 'idle_16x16_P_08f.gif'], f'image tokens mismatch: {names}')
+            assert_true(names[2] == 'notes_0x0__00f.txt', f'non-images get empty image values: {names}')
+            assert_true(not reads, f'cached headers and non-image files must not be read: {reads}')
+
+            (root / 'walk.png').write_bytes(b'changed, and longer than before')
+            render_names(items, template, workers=2)
+            assert_true(reads == [root / 'walk.png'], f'only the changed file should be re-read: {reads}')
+        finally:
+            media_metadata._default_cache, media_metadata.read_metadata = saved_cache, saved_read
+
+        # Frame counts scan whole GIF/APNG files, so they are only read for
+        # templates using {frames}; size-only entries are topped up once.
+        media_metadata._default_cache = media_metadata.MetadataCache(root / 'sizes.json')
+        media_metadata._default_cache.put(root / 'idle.gif', os.stat(root / 'idle.gif'), {'width': 16, 'height': 16, 'mode': 'P'})
+        calls = []
+        media_metadata.read_metadata = lambda path, frames=False: calls.append((path.name, frames)) or {'width': 16, 'height': 16, 'mode': 'P', 'frames': 8}
+        try:
+            gif = items[1:2]
+            assert_true(render_names(gif, RenameTemplate('{stem}_{w}')) == ['idle_16.gif'] and not calls, f'size tokens should not read frames: {calls}')
+            assert_true(render_names(gif, RenameTemplate('{stem}_{frames}f')) == ['idle_8f.gif'], 'frame counts should be read on demand')
+            render_names(gif, RenameTemplate('{stem}_{w}_{frames}f'))
+            assert_true(calls == [('idle.gif', True)], f'frame counts should be read once and cached: {calls}')
+        finally:
+            media_metadata._default_cache, media_metadata.read_metadata = saved_cache, saved_read
+    with_temp_workspace(run)
+
+
+def test_find_replace():
+    names = ('IMG_001.PNG', 'img_002.png', 'shot.img.jpg', 'readme')
+    items = [FileItem(path=Path(name), current_name=name, ext=Path(name).suffix.lower(), proposed_name='') for name in names]
+
+    plain = find_replace(items, 'IMG', 'pic')
+    assert_true(plain.names == ['pic_001.PNG', None, None, None] and (plain.matches, plain.files) == (1, 1), f'plain text is case-sensitive: {plain}')
+    folded = find_replace(items, 'img', 'pic', case=False)
+    assert_true(folded.names[:3] == ['pic_001.PNG', 'pic_002.png', 'shot.pic.jpg'], f'extensions stay untouched: {folded.names}')
+    assert_true(folded.matches == 3, 'matches should be counted per occurrence')
+
+    swapped = find_replace(items, r'(?i)img_(\d+)', r'\1_frame', regex=True)
+    assert_true(swapped.names[:2] == ['001_frame.PNG', '002_frame.png'], f'regex groups should expand: {swapped.names}')
+    literal = find_replace(items, 'e', r'\1?', case=False, sanitize=True)
+    assert_true(literal.names[3] == r'r_1_adm_1_', f'plain replacements are literal and sanitized: {literal.names}')
+    items[3].proposed_name = 'notes'
+    assert_true(find_replace(items, 'readme', 'x').files == 0, 'the proposed name is searched when set')
+    try:
+        find_replace(items, '(', 'x', regex=True)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a bad regex should raise ValueError')
+
+
+def test_sequence_renumber():
+    def run(root: Path):
+        names = ('walk_01.png', 'walk_2.png', 'walk_002.png', 'walk_05.png', 'Walk_06.png', 'idle1.png', 'idle3.png', 'notes.txt', 'take7.wav')
+        for name in names:
+            (root / name).write_text(name, encoding='utf-8')
+        items = [FileItem(path=root / name, current_name=name, ext=Path(name).suffix, proposed_name=name) for name in names]
+
+        report = analyze_sequences(items)
+        walk, idle = sorted(report.sequences, key=lambda seq: seq.prefix.casefold(), reverse=True)
+        assert_true((walk.prefix, walk.numbers, walk.width) == ('walk_', [1, 2, 2, 5, 6], 2), f'walk sequence mismatch: {walk}')
+        assert_true(walk.gaps == [(3, 4)] and walk.duplicates == [2], 'gaps and duplicate numbers should be found')
+        assert_true(sorted(names[idx] for idx in walk.mispadded) == ['walk_002.png', 'walk_2.png'], 'padding mismatches should be found')
+        assert_true(idle.width == 0 and idle.gaps == [(2, 2)], 'unpadded sequences keep width 0')
+        assert_true(report.unnumbered == 2, 'lone numbered files are not sequences')
+
+        plan = renumber_plan(items, report)
+        renamed = {src.name: dst.name for src, dst in plan}
+        assert_true(renamed.get('walk_05.png') == 'walk_04.png' and renamed.get('Walk_06.png') == 'Walk_05.png', f'gaps should close: {renamed}')
+        assert_true(renamed.get('idle3.png') == 'idle2.png' and 'walk_01.png' not in renamed, 'numbers already in place stay')
+        # walk_002 -> walk_02 -> walk_03 style chains go through the cycle-safe apply.
+        apply_rename(plan, workers=2)
+        after = sorted(p.name for p in root.iterdir())
+        assert_true(after == ['Walk_05.png', 'idle1.png', 'idle2.png', 'notes.txt', 'take7.wav', 'walk_01.png', 'walk_02.png', 'walk_03.png', 'walk_04.png'], f'unexpected result: {after}')
+        assert_true((root / 'walk_02.png').read_text(encoding='utf-8') == 'walk_002.png', 'duplicates keep name order')
+
+        many = [FileItem(path=root / f'f_{n:05d}.png', current_name=f'f_{n:05d}.png', ext='.png', proposed_name='') for n in range(100_000) if n % 97]
+        started = time.perf_counter()
+        big = analyze_sequences(many)
+        elapsed = time.perf_counter() - started
+        assert_true(len(big.sequences) == 1 and big.gap_count == 1030, f'gap count mismatch: {big.gap_count}')
+        assert_true(elapsed < 5.0, f'100k names took {elapsed:.2f}s')
+    with_temp_workspace(run)
+
+
+def test_rename_mapping():
+    def run(root: Path):
+        folder = root / 'files'
+        (folder / 'sub').mkdir(parents=True)
+        for rel in ('a.png', 'b.png', 'c.png', 'sub/d.png'):
+            (folder / rel).write_text(rel, encoding='utf-8')
+        csv_map = root / 'map.csv'
+        csv_map.write_text('old;new\na.png;b.png\nb.png;c.png\nc.png;a.png\nsub/D.PNG;e.png\nmissing.png;x.png\n', encoding='utf-8')
+
+        seen = []
+        result = validate_mapping(csv_map, folder, recursive=True, chunk_size=2, on_chunk=lambda chunk: seen.append(len(chunk)))
+        assert_true(seen == [2, 2], f'rows should be validated in chunks: {seen}')
+        assert_true((result.rows, result.matched, result.unmatched) == (5, 4, 1), 'row counts mismatch')
+        assert_true(result.unmatched_rows == [(6, 'missing.png')], f'unmatched rows should keep their line: {result.unmatched_rows}')
+        assert_true(result.valid, f'targets freed by later chunks should not count as existing: {result.invalid_rows}')
+        apply_rename(result.plan)
+        assert_true((folder / 'b.png').read_text(encoding='utf-8') == 'a.png', 'rename cycle should apply')
+        assert_true((folder / 'sub' / 'e.png').exists(), 'subpaths should match case-insensitively')
+
+        # Shared targets and sources flag every claimant, wherever the chunk
+        # boundaries fall.
+        jsonl_map = root / 'map.jsonl'
+        jsonl_map.write_text('{"old": "a.png", "new": "z.png"}\nnot json\n{"old": "b.png", "new": "Z.png"}\n{"old": "c.png", "new": "q.png"}\n{"old": "c.png", "new": "r.png"}\n', encoding='utf-8')
+        json_map = root / 'map.json'
+        json_map.write_text(json.dumps({'a.png': 'z.png', 'b.png': 'Z.png', 'c.png': 'q.png'}), encoding='utf-8')
+        for chunk_size in (1, 2, 10):
+            result = validate_mapping(jsonl_map, folder, chunk_size=chunk_size)
+            assert_true(result.unmatched == 1 and result.issues['duplicate'] == 4, f'chunk {chunk_size}: every claimant should be flagged: {result.issues}')
+            assert_true(not result.valid and result.plan == [], f'chunk {chunk_size}: no shared claim should be planned: {result.plan}')
+            result = validate_mapping(json_map, folder, chunk_size=chunk_size)
+            assert_true((result.rows, result.issues['duplicate']) == (3, 2), f'chunk {chunk_size}: .json objects should stream as rows: {result.issues}')
+            assert_true(result.plan == [(folder / 'c.png', folder / 'q.png')], f'chunk {chunk_size}: unshared rows should still be planned: {result.plan}')
+
+            # b.png is not freed because its own row is invalid, which strands
+            # a.png -> b.png, which in turn strands c.png -> a.png.
+            chain_map = root / 'chain.csv'
+            chain_map.write_text('c.png,a.png\na.png,b.png\nb.png,b?.png\n', encoding='utf-8')
+            result = validate_mapping(chain_map, folder, chunk_size=chunk_size)
+            assert_true(result.error_count == 3 and result.issues.get('exists') == 2, f'chunk {chunk_size}: targets kept by invalid rows should exist: {result.issues}')
+            assert_true(result.plan == [] and result.change_count == 0, f'chunk {chunk_size}: stranded rows should not be planned: {result.plan}')
+    with_temp_workspace(run)
+
+
 def test_apply_and_undo():
     def run(root: Path):
         a = root / 'old_a.txt'
@@ -101,8 +343,47 @@ def test_apply_and_undo():
     with_temp_workspace(run)
 
 
+def test_cycle_schedule_and_rollback():
+    def run(root: Path):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            (root / name).write_text(name, encoding='utf-8')
+        plan = [
+            (root / 'a.txt', root / 'b.txt'),
+            (root / 'b.txt', root / 'a.txt'),
+            (root / 'c.txt', root / 'd.txt'),
+        ]
+        steps = schedule_moves(plan)
+        assert_true(len(steps) == 4, f'swap plus one direct move should take 4 renames, got {len(steps)}')
+
+        undo_plan = apply_rename(plan)
+        assert_true((root / 'a.txt').read_text(encoding='utf-8') == 'b.txt', 'swap did not land on a.txt')
+        assert_true((root / 'b.txt').read_text(encoding='utf-8') == 'a.txt', 'swap did not land on b.txt')
+        assert_true((root / 'd.txt').read_text(encoding='utf-8') == 'c.txt', 'direct move missing')
+        undo_rename(undo_plan)
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            assert_true((root / name).read_text(encoding='utf-8') == name, f'undo did not restore {name}')
+
+        (root / 'e.txt').write_text('e.txt', encoding='utf-8')
+        failing = [
+            (root / 'a.txt', root / 'b.txt'),
+            (root / 'b.txt', root / 'a.txt'),
+            (root / 'c.txt', root / 'd.txt'),
+            (root / 'e.txt', root / 'missing_dir' / 'e.txt'),
+        ]
+        try:
+            apply_rename(failing)
+            raise AssertionError('move into a missing directory should fail')
+        except OSError:
+            pass
+        for name in ('a.txt', 'b.txt', 'c.txt', 'e.txt'):
+            assert_true((root / name).read_text(encoding='utf-8') == name, f'rollback did not restore {name}')
+        leftovers = [p.name for p in root.iterdir() if p.name.startswith('.__goblintmp__')]
+        assert_true(not leftovers, f'rollback left temp files: {leftovers}')
+    with_temp_workspace(run)
+
+
 def main() -> int:
-    tests = [test_sanitize, test_validate_and_plan, test_apply_and_undo]
+    tests = [test_sanitize, test_validate_and_plan, test_incremental_validator, test_rename_template, test_image_tokens_cached, test_find_replace, test_recursive_per_directory, test_sequence_renumber, test_rename_mapping, test_apply_and_undo, test_cycle_schedule_and_rollback]
     passed = 0
     failed = 0
     for fn in tests:
@@ -1,22 +1,41 @@
 from __future__ import annotations
 
 from pathlib import Path
+import errno
+import json
+import os
 import shutil
+import subprocess
 import sys
+import time
 import uuid
+import wave
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+from core import media_metadata, move_engine  # noqa: E402
+from core.category_rules import RulesError, rules_from_dict  # noqa: E402
+from core.duplicate_finder import find_duplicates  # noqa: E402
+from core.move_engine import copy_move, execute_moves, schedule_moves  # noqa: E402
+from core.move_journal import MoveJournal, find_interrupted, resume_journal, rollback_journal  # noqa: E402
+from core.natural_sort import SortKeyCache, natural_key, sort_paths  # noqa: E402
+from core.plan_io import apply_plan_file, export_plan, iter_plan_chunks, load_plan  # noqa: E402
 from core.sort_goblin import (  # noqa: E402
+    CollisionIndex,
+    DirectorySnapshot,
+    FileEntry,
+    OperationPlan,
     apply_plan,
+    build_rename_plan,
     build_sort_plan,
     build_sort_then_rename_plan,
     categorize,
     undo_plan,
     validate_plan,
 )
+from core.undo_history import UndoHistory  # noqa: E402
 
 
 def assert_true(condition, message):
@@ -38,6 +57,31 @@ def test_categorize():
     assert_true(categorize(Path('x.mp4')) == 'Videos', 'mp4 should map to Videos')
     assert_true(categorize(Path('x.py')) == 'Code', 'py should map to Code')
     assert_true(categorize(Path('x.unknown')) == 'Other', 'unknown should map to Other')
+    assert_true(categorize(Path('backup.TAR.GZ')) == 'Archives', 'multi-part suffix should map to Archives')
+    assert_true(categorize(Path('x.zip'), include_optional_categories=False) == 'Other', 'optional buckets should fold into Other')
+
+
+def test_sniffed_categories():
+    def run(root: Path):
+        (root / 'photo').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 32)
+        (root / 'clip.txt').write_bytes(b'\x00\x00\x00\x18ftypisom' + b'\x00' * 32)
+        (root / 'report.docx').write_bytes(b'PK\x03\x04' + b'\x00' * 32)
+        (root / 'IMG_0001').write_bytes(b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic' + b'\x00' * 32)
+        (root / 'odd.txt').write_bytes(b'\x00\x00\x00\x14ftypzzzz\x00\x00\x00\x00zzzz' + b'\x00' * 32)
+        (root / 'notes.txt').write_text('plain text', encoding='utf-8')
+
+        plain = {entry.name: entry.category for entry in build_sort_plan(root).entries}
+        assert_true(plain['photo'] == 'Other', 'suffix-only mode should not read contents')
+
+        sniffed = {entry.name: entry.category for entry in build_sort_plan(root, sniff_content=True).entries}
+        assert_true(sniffed['photo'] == 'Images', 'extensionless PNG should be sniffed as Images')
+        assert_true(sniffed['clip.txt'] == 'Videos', 'mislabeled MP4 should be sniffed as Videos')
+        assert_true(sniffed['IMG_0001'] == 'Images', 'HEIC should be sniffed as Images, not Videos')
+        assert_true(sniffed['odd.txt'] == 'Documents', 'unknown ftyp brands should not override the extension')
+        assert_true(sniffed['report.docx'] == 'Documents', 'zip containers should keep their extension category')
+        assert_true(sniffed['notes.txt'] == 'Documents', 'unmatched files should keep their extension category')
+
+    with_temp_workspace(run)
 
 
 def test_sort_plan_and_undo():
@@ -101,8 +145,631 @@ def test_sort_rename_collision_safe():
     with_temp_workspace(run)
 
 
+def test_rename_plan_entries():
+    def run(root: Path):
+        for name in ('b.png', 'asset_001.png', 'c.png'):
+            (root / name).write_text(name, encoding='utf-8')
+        entries = [
+            FileEntry(path=root / name, name=name, ext='.png', category='Images', proposed_path=root / name)
+            for name in ('c.png', 'b.png', 'asset_001.png')
+        ]
+        plan = build_rename_plan(entries, {'base': 'asset', 'start_index': 1, 'pad_width': 3, 'separator': '_'})
+        ok, errors = validate_plan(plan)
+        assert_true(ok, f'rename plan invalid: {errors}')
+        actions = {entry.name: entry.action for entry in plan.entries}
+        assert_true(actions['asset_001.png'] == 'No-op', 'already-named file should be a no-op')
+        assert_true(actions['b.png'] == 'Rename' and actions['c.png'] == 'Rename', 'other files should be renamed')
+        assert_true(len(plan.moves) == 2, 'no-op entries should not produce moves')
+        targets = {dst.name for _src, dst in plan.moves}
+        assert_true(targets == {'asset_002.png', 'asset_003.png'}, f'unexpected targets: {targets}')
+
+    with_temp_workspace(run)
+
+
+def test_collision_index():
+    def run(root: Path):
+        for name in ('shot.png', 'shot (2).png', 'Other.txt'):
+            (root / name).write_text(name, encoding='utf-8')
+        index = CollisionIndex()
+        assert_true(index.is_occupied(root / 'SHOT.png'), 'listing lookup should be case-insensitive')
+        first = index.next_free(root / 'shot.png')
+        assert_true(first.name == 'shot (3).png', f'expected first free suffix, got {first.name}')
+        index.occupy(first)
+        second = index.next_free(root / 'shot.png')
+        assert_true(second.name == 'shot (4).png', f'expected next suffix, got {second.name}')
+        index.release(root / 'Other.txt')
+        assert_true(index.next_free(root / 'other.txt').name == 'other.txt', 'released name should be free')
+
+    with_temp_workspace(run)
+
+
+def test_journal_recovery():
+    def run(root: Path):
+        journal_dir = root / '.journal'
+        names = ('a.png', 'b.png', 'c.png')
+
+        def crash_after(count: int, record: int):
+            for name in names:
+                (root / name).write_text(name, encoding='utf-8')
+            (root / 'Images').mkdir(exist_ok=True)
+            moves = [(root / name, root / 'Images' / name) for name in names]
+            steps = schedule_moves(moves)
+            journal = MoveJournal('sort_goblin', root=root, journal_dir=journal_dir, sync_every=1)
+            journal.start(moves, steps)
+            for step_no, (src, dst, _idx) in enumerate(steps[:count]):
+                src.rename(dst)
+                if step_no < record:
+                    journal.step_done(step_no)
+            journal.close()
+
+        crash_after(count=2, record=1)
+        interrupted = find_interrupted('sort_goblin', journal_dir=journal_dir)
+        assert_true(len(interrupted) == 1, 'interrupted journal should be detected')
+        rollback_journal(interrupted[0])
+        for name in names:
+            assert_true((root / name).exists(), f'rollback should restore {name}, including unsynced steps')
+        assert_true(not find_interrupted('sort_goblin', journal_dir=journal_dir), 'rolled back journal should be closed')
+
+        crash_after(count=2, record=1)
+        mapping = resume_journal(find_interrupted('sort_goblin', journal_dir=journal_dir)[0])
+        for name in names:
+            assert_true((root / 'Images' / name).exists(), f'resume should finish moving {name}')
+        assert_true(len(mapping) == 3, 'resumed run should be undoable')
+        undo_plan(mapping)
+        for name in names:
+            assert_true((root / name).exists(), f'undo from journal should restore {name}')
+
+    with_temp_workspace(run)
+
+
+def test_journal_chain_recovery():
+    def run(root: Path):
+        journal_dir = root / '.journal'
+
+        def crash_unsynced(contents: dict, moves: list) -> dict:
+            # Every step lands but no 'done' record reaches the disk.
+            for name, text in contents.items():
+                (root / name).write_text(text, encoding='utf-8')
+            execute_moves(
+                [(root / src, root / dst) for src, dst in moves],
+                journal=MoveJournal('sort_goblin', root=root, journal_dir=journal_dir, sync_every=1000),
+            )
+            journal = next(path for path in journal_dir.glob('*.jsonl') if path.read_text(encoding='utf-8').count('\n') > 1)
+            journal.write_text(journal.read_text(encoding='utf-8').splitlines()[0] + '\n', encoding='utf-8')
+            return {path.name: path.read_text(encoding='utf-8') for path in root.iterdir() if path.is_file()}
+
+        def listing() -> dict:
+            return {path.name: path.read_text(encoding='utf-8') for path in root.iterdir() if path.is_file()}
+
+        chain = [('a', 'x'), ('b', 'a'), ('c', 'b')]
+        cycle = [('p', 'q'), ('q', 'p')]
+        for moves, contents in ((chain, {'a': 'A', 'b': 'B', 'c': 'C'}), (cycle, {'p': 'P', 'q': 'Q'})):
+            for path in root.iterdir():
+                if path.is_file():
+                    path.unlink()
+            crash_unsynced(contents, moves)
+            rollback_journal(find_interrupted('sort_goblin', journal_dir=journal_dir)[0])
+            assert_true(listing() == contents, f'rollback should restore refilled sources: {listing()}')
+
+            after = crash_unsynced(contents, moves)
+            resume_journal(find_interrupted('sort_goblin', journal_dir=journal_dir)[0])
+            assert_true(listing() == after, f'resume should treat landed chain steps as done: {listing()}')
+            shutil.rmtree(journal_dir)
+
+    with_temp_workspace(run)
+
+
+def test_undo_history():
+    def run(root: Path):
+        journal_dir = root / '.journal'
+        folder = root / 'drop'
+        folder.mkdir()
+        for name in ('a.png', 'b.txt', 'c.png'):
+            (folder / name).write_text(name, encoding='utf-8')
+
+        history = UndoHistory(journal_dir, depth=3)
+        first = build_sort_plan(folder)
+        apply_plan(first, journal=MoveJournal('sort_goblin', root=folder, journal_dir=journal_dir, history=history))
+        (folder / 'd.png').write_text('d', encoding='utf-8')
+        apply_plan(build_sort_plan(folder), journal=MoveJournal('sort_goblin', root=folder, journal_dir=journal_dir, history=history))
+
+        # A fresh instance reads the same log, as after a restart.
+        entries = UndoHistory(journal_dir, depth=3).entries('sort_goblin', root=folder)
+        assert_true([entry.count for entry in entries] == [1, 3], f'history should list runs newest first: {entries}')
+        older = entries[1]
+        assert_true(older.pairs()[0][1].parent == folder / 'Images', 'pairs should decode back to full paths')
+        assert_true(history.verify(older) == [], 'an untouched run should verify')
+
+        # Undo the older run first, out of order.
+        undo_plan(older.pairs())
+        history.mark_undone(older)
+        assert_true((folder / 'a.png').exists() and (folder / 'Images' / 'd.png').exists(), 'only the chosen run should be undone')
+        assert_true([entry.id for entry in history.entries('sort_goblin')] == [entries[0].id], 'undone runs should leave the list')
+
+        (folder / 'Images' / 'd.png').unlink()
+        problems = history.verify(entries[0])
+        assert_true(len(problems) == 1 and 'd.png' in problems[0], f'verify should report moved-away files: {problems}')
+
+        lines = history.path.read_text(encoding='utf-8').splitlines()
+        tampered = lines[-2].replace('"sum":"', '"sum":"0')
+        history.path.write_text('\n'.join(lines[:-2] + [tampered, lines[-1]]) + '\n', encoding='utf-8')
+        damaged = history.entries('sort_goblin')[0]
+        assert_true('damaged' in history.verify(damaged)[0], 'a checksum mismatch should block undo')
+
+        for n in range(8):
+            history.record('rename_goblin', folder, [(folder / f'x{n}.png', folder / f'y{n}.png')])
+        assert_true(len(history.path.read_text(encoding='utf-8').splitlines()) <= 6, 'the log should compact past twice its depth')
+        kept = history.entries('rename_goblin')
+        assert_true([entry.pairs()[0][0].name for entry in kept] == ['x7.png', 'x6.png', 'x5.png'], 'only the last N operations stay undoable')
+
+    with_temp_workspace(run)
+
+
+def test_parallel_apply_and_rollback():
+    def run(root: Path):
+        exts = ('.png', '.mp4', '.txt', '.wav', '.zip', '.bin')
+        names = [f'file_{idx:03d}{exts[idx % len(exts)]}' for idx in range(60)]
+        for name in names:
+            (root / name).write_text(name, encoding='utf-8')
+
+        reports = []
+        plan = build_sort_plan(root)
+        undo_mapping = apply_plan(plan, workers=4, progress=reports.append)
+        assert_true(len(undo_mapping) == len(names), 'every file should be moved')
+        assert_true(len(reports) >= 2, 'expected per-group throughput reports')
+        assert_true(sum(report['moves'] for report in reports) == len(names), 'group reports should cover every move')
+        for src, dst in undo_mapping:
+            assert_true(dst.read_text(encoding='utf-8') == src.name, f'wrong content at {dst}')
+        undo_plan(undo_mapping, workers=4)
+        for name in names:
+            assert_true((root / name).exists(), f'parallel undo should restore {name}')
+
+        plan = build_sort_plan(root)
+        (root / 'Videos').rmdir()
+        (root / 'Videos').write_text('not a folder', encoding='utf-8')
+        try:
+            apply_plan(plan, workers=4)
+            raise AssertionError('apply should fail when a category folder is blocked by a file')
+        except OSError:
+            pass
+        for name in names:
+            assert_true((root / name).exists(), f'parallel rollback should restore {name}')
+
+    with_temp_workspace(run)
+
+
+def test_apply_never_replaces():
+    def run(root: Path):
+        images = root / 'Images'
+        images.mkdir()
+        (images / 'x.png').write_text('old', encoding='utf-8')
+        (root / 'x.png').write_text('x', encoding='utf-8')
+        (root / 'y.png').write_text('y', encoding='utf-8')
+
+        # x.png conflicts and gets a "name (n)"; it must not pick y's planned
+        # destination even when x's group runs first.
+        plan = OperationPlan(
+            mode='sort',
+            root_dir=root,
+            entries=[],
+            moves=[(root / 'x.png', images / 'x.png'), (root / 'y.png', images / 'x (2).png')],
+            category_counts={},
+        )
+        applied = dict(apply_plan(plan, workers=2))
+        assert_true(applied[root / 'y.png'] == images / 'x (2).png', f'planned destination should stay free: {applied}')
+        assert_true(applied[root / 'x.png'] == images / 'x (3).png', f'redirect should skip reserved names: {applied}')
+        contents = sorted(path.read_text(encoding='utf-8') for path in images.iterdir())
+        assert_true(contents == ['old', 'x', 'y'], f'no file should be overwritten: {contents}')
+
+        renameat2 = move_engine._renameat2
+        for primitive in (renameat2, None):
+            move_engine._renameat2 = primitive
+            try:
+                (root / 'a.txt').write_text('a', encoding='utf-8')
+                try:
+                    move_engine.move_entry(root / 'a.txt', images / 'x.png')
+                    raise AssertionError('moving onto an existing file should fail')
+                except FileExistsError:
+                    pass
+                assert_true((images / 'x.png').read_text(encoding='utf-8') == 'old', 'existing target should be untouched')
+                move_engine.move_entry(root / 'a.txt', root / 'b.txt')
+                assert_true(not (root / 'a.txt').exists() and (root / 'b.txt').exists(), 'free targets should still move')
+                (root / 'b.txt').unlink()
+            finally:
+                move_engine._renameat2 = renameat2
+
+    with_temp_workspace(run)
+
+
+def test_duplicates_bucket_and_skip():
+    def run(root: Path):
+        big = bytes(range(256)) * 1024
+        (root / 'a.png').write_bytes(big)
+        (root / 'b.png').write_bytes(big)
+        (root / 'c.png').write_bytes(big[:-1] + b'x')
+        (root / 'd.txt').write_text('same', encoding='utf-8')
+        (root / 'e.txt').write_text('same', encoding='utf-8')
+
+        plan = build_sort_plan(root, duplicates='bucket')
+        by_name = {entry.name: entry for entry in plan.entries}
+        assert_true(by_name['b.png'].category == 'Duplicates', 'later copy should route to Duplicates')
+        assert_true(by_name['b.png'].status == 'duplicate of a.png', 'duplicate should name its original')
+        assert_true(by_name['c.png'].category == 'Images', 'same size but different tail is not a duplicate')
+        assert_true(by_name['e.txt'].proposed_path.parent.name == 'Duplicates', 'small duplicates should be detected')
+        assert_true(plan.category_counts['Duplicates'] == 2, 'duplicates should be counted')
+
+        plan = build_sort_plan(root, duplicates='skip')
+        by_name = {entry.name: entry for entry in plan.entries}
+        assert_true(by_name['b.png'].action == 'No-op', 'skipped duplicate should stay in place')
+        assert_true(all(src.name not in ('b.png', 'e.txt') for src, _dst in plan.moves), 'skipped duplicates should not move')
+
+        (root / 'shot10.jpg').write_bytes(big[:-2])
+        (root / 'shot9.jpg').write_bytes(big[:-2])
+        found = find_duplicates(sorted(root.iterdir()))
+        assert_true(found.get(root / 'shot10.jpg') == root / 'shot9.jpg', 'keeper should be the first file in natural order')
+        assert_true(found.get(root / 'b.png') == root / 'a.png', 'other size buckets should be hashed in the same pass')
+
+    with_temp_workspace(run)
+
+
+def test_snapshot_refresh():
+    def run(root: Path):
+        (root / 'a.png').write_bytes(b'png')
+        (root / 'b.txt').write_text('b', encoding='utf-8')
+        (root / 'c.txt').write_text('c', encoding='utf-8')
+        snapshot = DirectorySnapshot(root)
+        assert_true(len(snapshot) == 3, 'snapshot should list top-level files')
+
+        (root / 'b.txt').unlink()
+        (root / 'd.mp3').write_bytes(b'mp3')
+        (root / 'c.txt').write_text('changed', encoding='utf-8')
+        added, removed, changed = snapshot.refresh()
+        assert_true(added == ['d.mp3'] and removed == ['b.txt'] and changed == ['c.txt'], 'refresh should report only deltas')
+
+        plan = build_sort_plan(root, include_optional_categories=False, snapshot=snapshot)
+        by_name = {entry.name: entry.category for entry in plan.entries}
+        assert_true(by_name == {'a.png': 'Images', 'c.txt': 'Documents', 'd.mp3': 'Other'}, 'options should apply to cached rows')
+        plan = build_sort_plan(root, include_optional_categories=True, snapshot=snapshot)
+        assert_true({entry.name: entry.category for entry in plan.entries}['d.mp3'] == 'Audio', 'optional categories should re-gate')
+
+        old = time.time() - 60
+        os.utime(root, (old, old))
+        snapshot.refresh()
+        assert_true(not snapshot.has_changed(), 'settled folder should poll as unchanged')
+        (root / 'e.zip').write_bytes(b'zip')
+        assert_true(snapshot.has_changed(), 'new file should bump the folder mtime')
+
+        # In-place edits leave the folder mtime alone; only a restat sees them.
+        (root / 'f.png').write_bytes(b'png')
+        snapshot.refresh()
+        os.utime(root, (old - 10, old - 10))
+        snapshot.refresh()
+        plan = build_sort_plan(root, duplicates='bucket', snapshot=snapshot)
+        assert_true({entry.name: entry.category for entry in plan.entries}['f.png'] == 'Duplicates', 'identical files should be duplicates')
+        rules = rules_from_dict({'buckets': [{'name': 'Big', 'min_size': 4}, {'name': 'Small'}]})
+        seen = []
+        categorize_rule = rules.categorize
+        rules.categorize = lambda name, *args, **kwargs: seen.append(name) or categorize_rule(name, *args, **kwargs)
+        plan = build_sort_plan(root, snapshot=snapshot, rules=rules)
+        assert_true({entry.name: entry.category for entry in plan.entries}['f.png'] == 'Small', 'rules should see the file size')
+        build_sort_plan(root, snapshot=snapshot, rules=rules, duplicates='bucket')
+        assert_true(sorted(seen) == sorted(path.name for path in root.iterdir() if path.is_file()), f'each file should be categorized once per option set: {seen}')
+
+        (root / 'f.png').write_bytes(b'new!')
+        os.utime(root / 'f.png', (old + 30, old + 30))
+        assert_true(snapshot.refresh() == ([], [], []), 'plain refresh should trust the folder mtime')
+        assert_true(snapshot.refresh(restat=True) == ([], [], ['f.png']), 'restat should catch in-place edits')
+        plan = build_sort_plan(root, duplicates='bucket', snapshot=snapshot)
+        assert_true({entry.name: entry.category for entry in plan.entries}['f.png'] == 'Images', 'edited file should drop its cached duplicate')
+        seen.clear()
+        plan = build_sort_plan(root, snapshot=snapshot, rules=rules)
+        assert_true(seen == ['f.png'], f'only the edited file should be recategorized: {seen}')
+        assert_true({entry.name: entry.category for entry in plan.entries}['f.png'] == 'Big', 'recategorized file should see its new size')
+
+    with_temp_workspace(run)
+
+
+def test_cross_device_fallback():
+    def run(root: Path):
+        payload = os.urandom(300_000)
+        (root / 'big.png').write_bytes(payload)
+        (root / 'notes.txt').write_text('notes', encoding='utf-8')
+        os.utime(root / 'big.png', (1_000_000_000, 1_000_000_000))
+
+        real_rename = os.rename
+
+        def cross_device_rename(src, dst):
+            if Path(src).parent != Path(dst).parent:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            real_rename(src, dst)
+
+        os.rename = cross_device_rename
+        try:
+            plan = build_sort_plan(root)
+            undo_mapping = apply_plan(plan, workers=2, verify_copies=True)
+            moved = root / 'Images' / 'big.png'
+            assert_true(moved.read_bytes() == payload, 'copied file should match the source')
+            assert_true(not (root / 'big.png').exists(), 'source should be removed after a verified copy')
+            assert_true(int(moved.stat().st_mtime) == 1_000_000_000, 'copy should keep file times')
+            undo_plan(undo_mapping)
+            assert_true((root / 'big.png').read_bytes() == payload, 'undo should copy back across devices')
+        finally:
+            os.rename = real_rename
+
+        copy_move(root / 'notes.txt', root / 'Documents' / 'notes.txt')
+        leftovers = [p.name for p in (root / 'Documents').iterdir() if p.name != 'notes.txt']
+        assert_true(not leftovers, 'copy temp names should not be left behind')
+
+    with_temp_workspace(run)
+
+
+def test_bucket_rules():
+    def write_wav(path: Path, seconds: int):
+        with wave.open(str(path), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(1)
+            wav.setframerate(100)
+            wav.writeframes(b'\x80' * (100 * seconds))
+
+    def run(root: Path):
+        write_wav(root / 'short.wav', 30)
+        write_wav(root / 'long.wav', 400)
+        (root / 'clip.mp3').write_bytes(b'ID3')
+        (root / 'photo.png').write_bytes(b'png')
+        (root / 'notes.txt').write_text('notes', encoding='utf-8')
+        stamp = time.mktime((2021, 7, 15, 12, 0, 0, 0, 0, -1))
+        os.utime(root / 'photo.png', (stamp, stamp))
+
+        cache_path = root.parent / f'{root.name}_metadata.json'
+        saved_cache = media_metadata._default_cache
+        media_metadata._default_cache = media_metadata.MetadataCache(cache_path)
+        try:
+            plan = build_sort_plan(root, bucket_rule='duration')
+            dst = {entry.name: entry.proposed_path.relative_to(root).as_posix() for entry in plan.entries}
+            assert_true(dst['short.wav'] == 'Audio/Under 1 min/short.wav', 'short clip should land in the first duration bucket')
+            assert_true(dst['long.wav'] == 'Audio/5-20 min/long.wav', 'long clip should land in a later duration bucket')
+            assert_true(dst['clip.mp3'] == 'Audio/Unknown/clip.mp3', 'unreadable duration should go to Unknown')
+            assert_true(dst['notes.txt'] == 'Documents/notes.txt', 'other categories keep their folder')
+            assert_true(plan.category_counts['Audio'] == 3, 'buckets should still count under their category')
+            assert_true(cache_path.exists(), 'metadata should be cached on disk')
+
+            plan = build_sort_plan(root, bucket_rule='date')
+            dst = {entry.name: entry.proposed_path.relative_to(root).as_posix() for entry in plan.entries}
+            assert_true(dst['photo.png'] == 'Images/2021/07/photo.png', 'undated images should fall back to file time')
+
+            plan = build_sort_then_rename_plan(root, {'bucket_rule': 'duration', 'base': 'clip'})
+            dst = {entry.name: entry.proposed_path.relative_to(root).as_posix() for entry in plan.entries}
+            assert_true(dst['short.wav'] == 'Audio/Under 1 min/clip_001.wav', 'rename numbering should restart per bucket')
+            ok, errors = validate_plan(plan)
+            assert_true(ok, f'bucketed plan should validate: {errors}')
+        finally:
+            media_metadata._default_cache = saved_cache
+            if cache_path.exists():
+                cache_path.unlink()
+
+    with_temp_workspace(run)
+
+
+def test_cli_headless():
+    probe = (
+        'import sys; from goblintools.cli import main; code = main(sys.argv[1:]); '
+        'sys.stderr.write("loaded:" + ",".join(m for m in ("tkinter", "PIL") if m in sys.modules)); sys.exit(code)'
+    )
+
+    def run_cli(*args):
+        return subprocess.run([sys.executable, '-c', probe, *args], cwd=str(ROOT), capture_output=True, text=True)
+
+    def run(root: Path):
+        folder = root / 'drop'
+        folder.mkdir()
+        (folder / 'a.png').write_bytes(b'png')
+        (folder / 'b.txt').write_text('b', encoding='utf-8')
+        journal_dir = str(root / 'journal')
+
+        preview = run_cli('sort', 'preview', str(folder), '--journal-dir', journal_dir)
+        assert_true(preview.returncode == 0, f'preview should succeed: {preview.stderr}')
+        records = [json.loads(line) for line in preview.stdout.splitlines()]
+        assert_true([r['type'] for r in records] == ['entry', 'entry', 'summary'], 'preview should stream one row per file then a summary')
+        assert_true(records[0]['dst'].endswith(str(Path('Images') / 'a.png')), 'rows should carry the planned destination')
+        assert_true(preview.stderr.endswith('loaded:'), 'CLI must not import tkinter or PIL')
+
+        apply = run_cli('sort', 'apply', str(folder), '--journal-dir', journal_dir)
+        assert_true(apply.returncode == 0 and (folder / 'Documents' / 'b.txt').exists(), 'apply should move files')
+        undo = run_cli('sort', 'undo', str(folder), '--journal-dir', journal_dir)
+        assert_true(undo.returncode == 0 and (folder / 'b.txt').exists(), 'undo should restore the last run')
+        again = run_cli('sort', 'undo', str(folder), '--journal-dir', journal_dir)
+        assert_true(again.returncode == 1, 'a run can only be undone once')
+
+        rename = run_cli('rename', 'apply', str(folder), '--journal-dir', journal_dir, '--base', 'item', '--ext', 'png')
+        assert_true(rename.returncode == 0 and (folder / 'item_001.png').exists(), 'rename apply should honor filters')
+        listed = run_cli('history', str(folder), '--journal-dir', journal_dir)
+        undoable = [json.loads(line) for line in listed.stdout.splitlines()]
+        assert_true([r['tool'] for r in undoable] == ['rename_goblin'], f'history should list only runs still undoable: {undoable}')
+        undo = run_cli('rename', 'undo', str(folder), '--journal-dir', journal_dir, '--id', undoable[0]['id'][:6])
+        assert_true(undo.returncode == 0 and (folder / 'a.png').exists(), 'rename undo should restore names')
+
+        tokens = run_cli('rename', 'preview', str(folder), '--journal-dir', journal_dir, '--template', '{w}x{h}_{n}')
+        assert_true(tokens.returncode == 1 and tokens.stderr.endswith('loaded:'), 'image tokens should be refused without loading PIL')
+        order = run_cli('rename', 'preview', str(folder), '--journal-dir', journal_dir, '--order', 'dimensions')
+        assert_true(order.returncode == 2, 'ordering by image size should not be offered headless')
+
+        # A rename that died after its first move, before any 'done' record.
+        moves = [(folder / 'a.png', folder / 'k.png')]
+        journal = MoveJournal('rename_goblin', root=folder, journal_dir=Path(journal_dir))
+        journal.start(moves, schedule_moves(moves))
+        (folder / 'a.png').rename(folder / 'k.png')
+        journal.close()
+        listed = run_cli('recover', 'list', '--journal-dir', journal_dir)
+        found = [json.loads(line) for line in listed.stdout.splitlines()]
+        assert_true([r['type'] for r in found] == ['interrupted', 'summary'] and found[0]['tool'] == 'rename_goblin', f'recover list should report the run: {found}')
+        resumed = run_cli('recover', 'resume', str(folder), '--only', 'rename', '--journal-dir', journal_dir)
+        assert_true(resumed.returncode == 0 and (folder / 'k.png').exists(), f'recover resume should finish the run: {resumed.stderr}')
+        listed = run_cli('recover', 'list', '--journal-dir', journal_dir)
+        assert_true(json.loads(listed.stdout.splitlines()[-1])['journals'] == 0, 'recovered runs should be closed')
+        listed = run_cli('history', str(folder), '--only', 'rename', '--journal-dir', journal_dir)
+        assert_true(json.loads(listed.stdout.splitlines()[0])['moves'] == 1, 'resumed renames should be undoable')
+
+    with_temp_workspace(run)
+
+
+def test_plan_export_import():
+    def run(root: Path):
+        folder = root / 'drop'
+        folder.mkdir()
+        for name in ('x_2.txt', 'x_3.txt', 'y.png', 'z.png'):
+            (folder / name).write_text(name, encoding='utf-8')
+        entries = [
+            FileEntry(path=p, name=p.name, ext=p.suffix.lower(), category=categorize(p), proposed_path=p, status='', action='')
+            for p in sorted(folder.iterdir())
+        ]
+        plan = build_rename_plan(entries, {'base': 'x', 'start_index': 3, 'pad_width': 0, 'separator': '_'})
+        plan_file = root / 'plan.jsonl'
+        assert_true(export_plan(plan, plan_file) == len(plan.moves), 'export should write every move')
+
+        loaded = load_plan(plan_file)
+        assert_true(sorted(loaded.moves) == sorted(plan.moves), 'round trip should keep the moves')
+        chunks = list(iter_plan_chunks(plan_file, chunk_size=1))
+        chained = [chunk for chunk in chunks if any(src.name == 'x_2.txt' for src, _dst in chunk.moves)][0]
+        assert_true({src.name for src, _dst in chained.moves} >= {'x_2.txt', 'x_3.txt'}, 'a rename chain must stay in one chunk')
+
+        # Offline review: drop one row before applying.
+        lines = plan_file.read_text(encoding='utf-8').splitlines()
+        kept = [line for line in lines if '"z.png"' not in line]
+        plan_file.write_text('\n'.join(kept) + '\n', encoding='utf-8')
+        applied = apply_plan_file(plan_file, chunk_size=1)
+        assert_true(applied == len(plan.moves) - 1, 'filtered rows should not be applied')
+        assert_true((folder / 'z.png').exists(), 'dropped row should leave its file alone')
+        assert_true((folder / 'x_3.txt').read_text(encoding='utf-8') == 'x_2.txt', 'chain should apply in dependency order')
+
+    with_temp_workspace(run)
+
+
+def test_validate_plan_batch():
+    def run(root: Path):
+        folder = root / 'drop'
+        folder.mkdir()
+        (folder / 'a.png').write_bytes(b'a')
+        (folder / 'b.png').write_bytes(b'b')
+        outside = root / 'elsewhere'
+        outside.mkdir()
+        (outside / 'c.png').write_bytes(b'c')
+        moves = [
+            (folder / 'a.png', folder / 'Images' / 'a.png'),
+            (folder / 'b.png', folder / 'Images' / 'A.PNG'),
+            (folder / 'missing.png', folder / 'Images' / 'missing.png'),
+            (outside / 'c.png', folder / 'Images' / 'c.png'),
+            (folder / 'a.png', folder / 'Images' / '..' / '..' / 'a.png'),
+        ]
+        ok, errors = validate_plan(OperationPlan(mode='sort', root_dir=folder, entries=[], moves=moves))
+        assert_true(not ok, 'bad plan should not validate')
+        assert_true(any(e.startswith('Duplicate destination') and 'A.PNG' in e for e in errors), 'case-only duplicate should be caught')
+        assert_true(any(e.startswith('Missing source') and 'missing.png' in e for e in errors), 'missing source should be caught')
+        assert_true(any(e.startswith('Source outside root') and 'c.png' in e for e in errors), 'outside source should be caught')
+        assert_true(any(e.startswith('Destination outside root') for e in errors), 'escaping destination should be caught')
+        assert_true(len(errors) == 4, f'only the four bad rows should be flagged: {errors}')
+
+    with_temp_workspace(run)
+
+
+def test_category_rules():
+    rules = rules_from_dict(
+        {
+            'buckets': [
+                {'name': 'BigTex', 'globs': ['*_tex.*'], 'min_size': 100},
+                {'name': 'Tex', 'globs': ['*_tex.*']},
+                {'name': 'Concept', 'regex': [r'^concept[-_]\d+']},
+                {'name': 'Images', 'extensions': ['png', '.jpg']},
+                {'name': 'Pdfish', 'sniffed': ['Documents']},
+            ],
+            'optional': ['Concept'],
+        }
+    )
+    assert_true(rules.order == ['BigTex', 'Tex', 'Concept', 'Images', 'Pdfish', 'Other'], 'folders should keep rule order plus the fallback')
+    assert_true(rules.categorize('rock_tex.png', size=10) == 'Tex', 'size filter should pass a small texture to the next rule')
+    assert_true(rules.categorize('rock_TEX.png', size=500) == 'BigTex', 'globs should match case-insensitively')
+    assert_true(rules.categorize('concept_01.png') == 'Concept', 'earlier regex rule should beat the extension rule')
+    assert_true(rules.categorize('photo.JPG') == 'Images', 'extensions should be normalized')
+    assert_true(rules.categorize('blob.bin', sniff=lambda: 'Documents') == 'Pdfish', 'sniffed filter should use the detected type')
+    assert_true(rules.categorize('blob.bin', sniff=lambda: None) == 'Other', 'unmatched files should use the fallback')
+    assert_true(rules.gate('Concept', False) == 'Other', 'optional buckets should fold into the fallback when disabled')
+    for bad in ({'buckets': []}, {'buckets': [{'name': '../x'}]}, {'buckets': [{'name': 'X', 'regex': ['(']}]}):
+        try:
+            rules_from_dict(bad)
+        except RulesError:
+            continue
+        raise AssertionError(f'invalid rules should be rejected: {bad}')
+
+    # Inline flags, shared group names and backreferences can't be pasted into
+    # one combined pattern but are still valid rules.
+    tricky = rules_from_dict(
+        {
+            'buckets': [
+                {'name': 'Drafts', 'regex': [r'(?i)^draft']},
+                {'name': 'Dupes', 'regex': [r'^(?P<stem>\w+)_(?P=stem)\.']},
+                {'name': 'Takes', 'regex': [r'^(?P<stem>take)_\d+', r'(\d)\1\.wav$']},
+                {'name': 'Audio', 'globs': ['*.wav'], 'min_size': 10},
+            ]
+        }
+    )
+    assert_true(tricky.categorize('DRAFT_cover.png') == 'Drafts', 'global inline flags should still apply')
+    assert_true(tricky.categorize('rock_rock.png') == 'Dupes', 'named backreferences should still match')
+    assert_true(tricky.categorize('take_3.wav') == 'Takes', 'a group name reused across buckets should be allowed')
+    assert_true(tricky.categorize('mix44.wav') == 'Takes', 'numbered backreferences should keep their numbering')
+    assert_true(tricky.categorize('mix45.wav', size=50) == 'Audio', 'later buckets should still be reached')
+    assert_true(tricky.categorize('mix45.wav', size=1) == 'Other', 'size filters should still apply after separate regexes')
+    for bad in ({'name': 'X', 'regex': ['a(?i)b']}, {'name': 'X', 'regex': [r'(a)\2']}):
+        try:
+            rules_from_dict({'buckets': [bad]})
+        except RulesError:
+            continue
+        raise AssertionError(f'bad regex should raise RulesError: {bad}')
+
+    def run(root: Path):
+        (root / 'rock_tex.png').write_bytes(b'x')
+        (root / 'concept_02.jpg').write_bytes(b'x')
+        (root / 'notes.txt').write_text('notes', encoding='utf-8')
+        plan = build_sort_plan(root, rules=rules)
+        dst = {entry.name: entry.proposed_path.relative_to(root).as_posix() for entry in plan.entries}
+        assert_true(dst == {'rock_tex.png': 'Tex/rock_tex.png', 'concept_02.jpg': 'Concept/concept_02.jpg', 'notes.txt': 'Other/notes.txt'}, f'rules should pick folders: {dst}')
+        assert_true(list(plan.category_counts)[:3] == ['BigTex', 'Tex', 'Concept'], 'counts should follow rule order')
+        ok, errors = validate_plan(plan)
+        assert_true(ok, f'rule plan should validate: {errors}')
+
+    with_temp_workspace(run)
+
+
+def test_natural_order():
+    names = ['frame10.png', 'Frame2.png', 'frame1.png', 'frame01.png', 'a.png']
+    ordered = sorted(names, key=natural_key)
+    assert_true(ordered == ['a.png', 'frame01.png', 'frame1.png', 'Frame2.png', 'frame10.png'], f'digit runs should sort as numbers: {ordered}')
+
+    def run(root: Path):
+        for name, size in (('frame10.png', 1), ('frame2.png', 30), ('frame1.png', 20)):
+            (root / name).write_bytes(b'x' * size)
+        paths = sorted(root.iterdir())
+        cache = SortKeyCache()
+        by_size = [p.name for p in sort_paths(paths, 'size', cache=cache)]
+        assert_true(by_size == ['frame10.png', 'frame1.png', 'frame2.png'], f'size order mismatch: {by_size}')
+        (root / 'frame10.png').write_bytes(b'x' * 99)
+        again = [p.name for p in sort_paths(paths, 'size', cache=cache)]
+        assert_true(again == by_size, 'cached keys should be reused across re-sorts')
+        grouped = [Path('b10/x.png'), Path('b2/z.png'), Path('b10/a.png'), Path('b2/c.png')]
+        by_folder = [p.as_posix() for p in sort_paths(grouped, group_by_dir=True)]
+        assert_true(by_folder == ['b2/c.png', 'b2/z.png', 'b10/a.png', 'b10/x.png'], f'folders should stay together in natural order: {by_folder}')
+
+        entries = [
+            FileEntry(path=p, name=p.name, ext=p.suffix.lower(), category=categorize(p), proposed_path=p, status='', action='')
+            for p in paths
+        ]
+        plan = build_rename_plan(entries, {'base': 'f', 'pad_width': 2})
+        renamed = {entry.name: entry.proposed_path.name for entry in plan.entries}
+        assert_true(renamed == {'frame1.png': 'f_01.png', 'frame2.png': 'f_02.png', 'frame10.png': 'f_03.png'}, f'frames should renumber in natural order: {renamed}')
+
+    with_temp_workspace(run)
+
+
 def main() -> int:
-    tests = [test_categorize, test_sort_plan_and_undo, test_sort_rename_collision_safe]
+    tests = [test_categorize, test_sniffed_categories, test_sort_plan_and_undo, test_sort_rename_collision_safe, test_rename_plan_entries, test_collision_index, test_journal_recovery, test_journal_chain_recovery, test_undo_history, test_parallel_apply_and_rollback, test_apply_never_replaces, test_duplicates_bucket_and_skip, test_snapshot_refresh, test_cross_device_fallback, test_bucket_rules, test_cli_headless, test_plan_export_import, test_validate_plan_batch, test_category_rules, test_natural_order]
     passed = 0
     failed = 0
     for fn in tests: